@@ -46,6 +46,9 @@ intents.message_content = True
 intents.guilds = True
 
 from src.firebase_utils import db
+from src import chat_sessions, leaderboards, wanted_poster
+from src.auction_index import index as auction_index
+from src.auction_settlement import settler as auction_settler
 
 bot = commands.Bot(command_prefix='!', intents=intents)
 
@@ -83,6 +86,19 @@ async def cleanup_task():
         session.reference.delete()
     log.info("Cleanup task finished.")
 
+@tasks.loop(seconds=60)
+async def chat_session_flush_task():
+    # Write back dirty chat histories and drop idle sessions from memory
+    await chat_sessions.cache.flush()
+
+@tasks.loop(minutes=leaderboards.LEADERBOARD_REFRESH_MINUTES)
+async def leaderboard_refresh_task():
+    # Rebuild the materialized leaderboards; a full scan of pirates and ships now and then
+    try:
+        await asyncio.to_thread(leaderboards.store.refresh)
+    except Exception as e:
+        log.error(f"Failed to refresh leaderboards: {e}")
+
 async def main():
     await bot.load_extension('src.cogs.events')
     await bot.load_extension('src.cogs.admin')
@@ -90,7 +106,16 @@ async def main():
     await bot.load_extension('src.cogs.ship')
     await bot.load_extension('src.cogs.cosmetic')
     
+    try:
+        leaderboards.store.load()
+    except Exception as e:
+        log.error(f"Failed to load leaderboard snapshots: {e}")
+
+    auction_index.start(db)
+    auction_settler.start(bot)
     cleanup_task.start()
+    chat_session_flush_task.start()
+    leaderboard_refresh_task.start()
     
     # Start Flask in a separate thread
     flask_thread = threading.Thread(target=run_flask)
@@ -98,7 +123,13 @@ async def main():
     flask_thread.start()
 
     # Start the bot
-    await bot.start(os.getenv("DISCORD_TOKEN"))
+    try:
+        await bot.start(os.getenv("DISCORD_TOKEN"))
+    finally:
+        auction_settler.stop()
+        auction_index.stop()
+        wanted_poster.stop_sheet_pool()
+        chat_sessions.cache.flush_all()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
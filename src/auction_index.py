@@ -0,0 +1,262 @@
+import time
+import heapq
+import bisect
+import logging
+import threading
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Every auction document, mirrored in memory by a Firestore snapshot listener, so listing
+# and looking up auctions costs no queries.
+AUCTION_DURATION = 86400
+SORTS = ('ending', 'price', 'newest')
+
+def _end_key(auction):
+    return (auction['end_time'], auction['id'])
+
+def _price_key(auction):
+    return (-auction['current_bid'], auction['end_time'], auction['id'])
+
+def _add_to(mapping, key, auction_id):
+    if key:
+        mapping.setdefault(str(key), set()).add(auction_id)
+
+def _remove_from(mapping, key, auction_id):
+    ids = mapping.get(str(key)) if key else None
+    if ids is not None:
+        ids.discard(auction_id)
+        if not ids:
+            del mapping[str(key)]
+
+class AuctionIndex:
+    """
+    All auctions by ID, with lookups by item, item type, seller and highest bidder. Open auctions
+    are also kept in two sorted key lists (by end time and by price) for paging, and a
+    heap of end times moves them out of the open lists as they end.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.auctions = {}
+        self.by_item = {}
+        self.by_seller = {}
+        self.by_bidder = {}
+        self.by_type = {}
+        self.end_heap = []
+        self.open_by_end = []
+        self.open_by_price = []
+        self.watch = None
+        self.ready = threading.Event()
+
+    def start(self, db):
+        """
+        Subscribes to the auctions collection. The first snapshot loads every auction;
+        later ones carry only the changes.
+        """
+        self.watch = db.collection('auctions').on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self.watch is not None:
+            self.watch.unsubscribe()
+            self.watch = None
+
+    def _on_snapshot(self, snapshot, changes, read_time):
+        with self.lock:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self.remove(change.document.id)
+                else:
+                    self.upsert(change.document.id, change.document.to_dict())
+            metrics.set_gauge('auction_index.auctions', len(self.auctions))
+            metrics.set_gauge('auction_index.open', len(self.open_by_end))
+        if not self.ready.is_set():
+            log.info(f"Auction index loaded {len(self.auctions)} auctions.")
+            self.ready.set()
+
+    def _is_open(self, auction, now):
+        return auction['end_time'] > now
+
+    def upsert(self, auction_id, data):
+        with self.lock:
+            old = self.auctions.get(auction_id)
+            if old is not None:
+                self._unindex(old)
+            auction = dict(data, id=auction_id)
+            auction.setdefault('created_at', auction['end_time'] - AUCTION_DURATION)
+            self.auctions[auction_id] = auction
+            _add_to(self.by_item, auction.get('item_id'), auction_id)
+            _add_to(self.by_seller, auction.get('seller_id'), auction_id)
+            _add_to(self.by_bidder, auction.get('highest_bidder_id'), auction_id)
+            _add_to(self.by_type, auction.get('item_type'), auction_id)
+            if self._is_open(auction, time.time()):
+                bisect.insort(self.open_by_end, _end_key(auction))
+                bisect.insort(self.open_by_price, _price_key(auction))
+                if old is None or old['end_time'] != auction['end_time']:
+                    heapq.heappush(self.end_heap, _end_key(auction))
+
+    def remove(self, auction_id):
+        with self.lock:
+            auction = self.auctions.pop(auction_id, None)
+            if auction is not None:
+                self._unindex(auction)
+
+    def _unindex(self, auction):
+        auction_id = auction['id']
+        _remove_from(self.by_item, auction.get('item_id'), auction_id)
+        _remove_from(self.by_seller, auction.get('seller_id'), auction_id)
+        _remove_from(self.by_bidder, auction.get('highest_bidder_id'), auction_id)
+        _remove_from(self.by_type, auction.get('item_type'), auction_id)
+        self._close(auction)
+
+    def _close(self, auction):
+        for keys, key in ((self.open_by_end, _end_key(auction)), (self.open_by_price, _price_key(auction))):
+            position = bisect.bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def expire(self, now=None):
+        """
+        Moves auctions whose end time has passed out of the open lists. Returns the
+        IDs that ended.
+        """
+        now = now or time.time()
+        ended = []
+        with self.lock:
+            while self.end_heap and self.end_heap[0][0] <= now:
+                end_time, auction_id = heapq.heappop(self.end_heap)
+                auction = self.auctions.get(auction_id)
+                # Entries for removed or re-timed auctions are skipped here rather than
+                # deleted from the middle of the heap.
+                if auction is None or auction['end_time'] != end_time:
+                    continue
+                self._close(auction)
+                ended.append(auction_id)
+        return ended
+
+    def next_end_time(self, expire_before=None):
+        """
+        End time of the next open auction to end, or None. With `expire_before`,
+        auctions that ended by then are expired first, so one left unsettled stops
+        counting as next.
+        """
+        if expire_before is not None:
+            self.expire(expire_before)
+        with self.lock:
+            while self.end_heap:
+                end_time, auction_id = self.end_heap[0]
+                auction = self.auctions.get(auction_id)
+                if auction is not None and auction['end_time'] == end_time:
+                    return end_time
+                heapq.heappop(self.end_heap)
+        return None
+
+    def get(self, auction_id):
+        with self.lock:
+            return self.auctions.get(auction_id)
+
+    def open_count(self):
+        self.expire()
+        with self.lock:
+            return len(self.open_by_end)
+
+    def page(self, sort='ending', offset=0, limit=10):
+        """
+        Returns open auctions `offset` to `offset + limit` in the given order.
+        """
+        self.expire()
+        with self.lock:
+            if sort == 'price':
+                keys = self.open_by_price[offset:offset + limit]
+                return [self.auctions[key[2]] for key in keys]
+            if sort == 'newest':
+                # Every auction runs for the same time, so newest is latest-ending first.
+                end = len(self.open_by_end) - offset
+                keys = self.open_by_end[max(0, end - limit):max(0, end)][::-1]
+            else:
+                keys = self.open_by_end[offset:offset + limit]
+            return [self.auctions[key[1]] for key in keys]
+
+    def search(self, item_id=None, item_type=None, seller_id=None, min_price=None, max_price=None, ends_within=None):
+        """
+        Open auctions matching every given filter, ending soonest first. Candidates come
+        from the most selective filter: an ID map for item, type or seller, or a
+        bisected range of the sorted price or end-time lists. The rest are checked on
+        those candidates only.
+        """
+        self.expire()
+        now = time.time()
+        with self.lock:
+            candidates = []
+            for mapping, key in ((self.by_item, item_id), (self.by_type, item_type), (self.by_seller, seller_id)):
+                if key is not None:
+                    candidates.append(mapping.get(str(key), set()))
+            if min_price is not None or max_price is not None:
+                low = bisect.bisect_left(self.open_by_price, -max_price, key=lambda key: key[0]) if max_price is not None else 0
+                high = bisect.bisect_right(self.open_by_price, -min_price, key=lambda key: key[0]) if min_price is not None else len(self.open_by_price)
+                candidates.append([key[2] for key in self.open_by_price[low:high]])
+            if ends_within is not None:
+                high = bisect.bisect_right(self.open_by_end, now + ends_within, key=lambda key: key[0])
+                candidates.append([key[1] for key in self.open_by_end[:high]])
+            if not candidates:
+                candidates.append([key[1] for key in self.open_by_end])
+
+            candidates.sort(key=len)
+            results = []
+            for auction_id in candidates[0]:
+                auction = self.auctions.get(auction_id)
+                if auction is None or not self._is_open(auction, now):
+                    continue
+                if item_id is not None and auction.get('item_id') != item_id:
+                    continue
+                if item_type is not None and auction.get('item_type') != item_type:
+                    continue
+                if seller_id is not None and auction.get('seller_id') != str(seller_id):
+                    continue
+                if min_price is not None and auction['current_bid'] < min_price:
+                    continue
+                if max_price is not None and auction['current_bid'] > max_price:
+                    continue
+                if ends_within is not None and auction['end_time'] > now + ends_within:
+                    continue
+                results.append(auction)
+        results.sort(key=_end_key)
+        metrics.incr('auction_index.search')
+        return results
+
+    def listed_items(self, text="", limit=25):
+        """
+        (item_id, item_name, count) for items in open auctions whose ID or name contains
+        `text`, most listed first, for autocomplete.
+        """
+        text = text.lower()
+        now = time.time()
+        with self.lock:
+            items = []
+            for item_id, auction_ids in self.by_item.items():
+                # Ended auctions stay indexed until settled, but can't be bid on.
+                open_auctions = [self.auctions[auction_id] for auction_id in auction_ids if self._is_open(self.auctions[auction_id], now)]
+                if not open_auctions:
+                    continue
+                name = open_auctions[0].get('item_name', item_id)
+                if text in item_id.lower() or text in name.lower():
+                    items.append((item_id, name, len(open_auctions)))
+        items.sort(key=lambda item: (-item[2], item[1]))
+        return items[:limit]
+
+    def ended_before(self, timestamp):
+        """
+        IDs of all auctions that ended at or before `timestamp`.
+        """
+        with self.lock:
+            return [auction_id for auction_id, auction in self.auctions.items() if auction['end_time'] <= timestamp]
+
+    def ended_for(self, user_id):
+        """
+        Ended, unsettled auctions the user sold or won.
+        """
+        now = time.time()
+        with self.lock:
+            ids = self.by_seller.get(str(user_id), set()) | self.by_bidder.get(str(user_id), set())
+            return [self.auctions[auction_id] for auction_id in ids if not self._is_open(self.auctions[auction_id], now)]
+
+index = AuctionIndex()
@@ -0,0 +1,153 @@
+import os
+import time
+import asyncio
+import logging
+import discord
+from src import metrics
+from src.firebase_utils import settle_auctions
+from src.auction_index import index as auction_index
+from src.user_resolver import resolver as user_resolver
+
+log = logging.getLogger(__name__)
+
+# Ended auctions are settled by the bot shortly after they end, so nobody has to claim them.
+SETTLE_DELAY = float(os.getenv("AUCTION_SETTLE_DELAY", 5))  # seconds after end_time, so late bids land first
+SETTLE_BATCH = int(os.getenv("AUCTION_SETTLE_BATCH", 50))  # auctions per transaction
+MAX_SLEEP = 60
+RETRY_DELAY = 30
+DIGEST_MAX_LINES = 20
+
+def digest_lines(settled):
+    """
+    Groups settled auctions into {user_id: [lines]} for the seller and the winner.
+    """
+    lines = {}
+    for auction in settled:
+        name = f"{auction['item_name']} (x{auction['quantity']})"
+        seller_id, winner_id = auction['seller_id'], auction.get('highest_bidder_id')
+        if winner_id:
+            lines.setdefault(seller_id, []).append(f"Sold **{name}** for {auction['current_bid']:,} Berries. You received {auction['payout']:,} Berries after tax.")
+            lines.setdefault(winner_id, []).append(f"Won **{name}** for {auction['current_bid']:,} Berries. It's been delivered to you.")
+        else:
+            lines.setdefault(seller_id, []).append(f"**{name}** got no bids and was returned to you.")
+    return lines
+
+class AuctionSettler:
+    """
+    Sleeps until the next auction ends, then settles every ended auction in batched
+    transactions and DMs each seller and winner one digest.
+    """
+    def __init__(self):
+        self.task = None
+        # Ended auctions whose seller or winner has no pirate document. Left alone
+        # rather than retried every pass.
+        self.unsettleable = set()
+        self.failures = 0
+
+    def start(self, bot):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(bot))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self, bot):
+        await asyncio.to_thread(auction_index.ready.wait)
+        while True:
+            failures = self.failures
+            try:
+                settled = await self.settle_due()
+                if settled:
+                    await self.notify(bot, settled)
+                # Anything that ended before the settle delay was just settled or can't be.
+                next_end = auction_index.next_end_time(expire_before=time.time() - SETTLE_DELAY)
+                delay = MAX_SLEEP if next_end is None else min(MAX_SLEEP, next_end + SETTLE_DELAY - time.time())
+                if self.failures > failures:
+                    # Some auctions failed on their own; don't hammer Firestore retrying them.
+                    delay = max(delay, RETRY_DELAY)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Auction settlement failed: {e}", exc_info=True)
+                metrics.incr('auction_settlement.error')
+                delay = RETRY_DELAY
+            await asyncio.sleep(max(delay, 0.5))
+
+    async def settle_due(self):
+        """
+        Settles every auction past its end time. Returns the settled auctions.
+        """
+        due = [auction_id for auction_id in auction_index.ended_before(time.time() - SETTLE_DELAY) if auction_id not in self.unsettleable]
+        settled = await self.settle(due)
+        if settled:
+            log.info(f"Settled {len(settled)} ended auctions.")
+        return settled
+
+    async def settle(self, auction_ids):
+        """
+        Settles the given ended auctions, SETTLE_BATCH per transaction. Returns the
+        settled auctions.
+        """
+        settled = []
+        for i in range(0, len(auction_ids), SETTLE_BATCH):
+            batch_ids = auction_ids[i:i + SETTLE_BATCH]
+            started = time.perf_counter()
+            try:
+                batch, skipped = await asyncio.to_thread(settle_auctions, batch_ids)
+            except Exception as e:
+                if len(batch_ids) == 1:
+                    raise
+                # One bad auction shouldn't hold up the rest of its batch.
+                log.warning(f"Settling {len(batch_ids)} auctions together failed ({e}); settling them one at a time.")
+                batch, skipped = await self._settle_singly(batch_ids)
+            metrics.observe('auction_settlement.batch_ms', (time.perf_counter() - started) * 1000)
+            metrics.incr('auction_settlement.settled', len(batch))
+            for auction_id in skipped:
+                log.error(f"Can't settle auction {auction_id}: its seller or winner has no pirate document.")
+                self.unsettleable.add(auction_id)
+            metrics.incr('auction_settlement.unsettleable', len(skipped))
+            for auction in batch:
+                # Drop it now rather than waiting for the listener, so it isn't retried.
+                auction_index.remove(auction['id'])
+            settled.extend(batch)
+        return settled
+
+    async def _settle_singly(self, auction_ids):
+        settled, skipped = [], []
+        for auction_id in auction_ids:
+            try:
+                batch, batch_skipped = await asyncio.to_thread(settle_auctions, [auction_id])
+            except Exception as e:
+                log.error(f"Failed to settle auction {auction_id}: {e}")
+                metrics.incr('auction_settlement.error')
+                self.failures += 1
+                continue
+            settled.extend(batch)
+            skipped.extend(batch_skipped)
+        return settled, skipped
+
+    async def notify(self, bot, settled, skip=()):
+        lines = digest_lines(settled)
+        for user_id in skip:
+            lines.pop(user_id, None)
+        users = await user_resolver.get_many(bot, list(lines))
+
+        async def send(user_id):
+            user = users[user_id]
+            if user is None:
+                return
+            user_lines = lines[user_id]
+            description = "\n".join(user_lines[:DIGEST_MAX_LINES])
+            if len(user_lines) > DIGEST_MAX_LINES:
+                description += f"\n...and {len(user_lines) - DIGEST_MAX_LINES} more."
+            embed = discord.Embed(title="Auction House Results", description=description, color=discord.Color.purple())
+            try:
+                await user.send(embed=embed)
+            except discord.HTTPException as e:
+                log.warning(f"Could not DM auction results to {user_id}: {e}")
+
+        await asyncio.gather(*(send(user_id) for user_id in lines))
+
+settler = AuctionSettler()
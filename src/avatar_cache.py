@@ -0,0 +1,89 @@
+import io
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from PIL import Image
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Decoded avatars, keyed by Discord's avatar hash and the size they are drawn at, already
+# resized. Downloads go through discord.py's own HTTP session via Asset.read().
+AVATAR_CACHE_MAX_BYTES = int(os.getenv("AVATAR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+MIN_CDN_SIZE = 16
+MAX_CDN_SIZE = 4096
+
+def cdn_size(pixels):
+    """
+    Smallest size the Discord CDN serves (a power of two) that covers `pixels`.
+    """
+    size = MIN_CDN_SIZE
+    while size < pixels and size < MAX_CDN_SIZE:
+        size *= 2
+    return size
+
+def _decode(data, pixels):
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    if image.size != (pixels, pixels):
+        image = image.resize((pixels, pixels))
+    return image
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+class AvatarCache:
+    """
+    LRU of decoded avatar images bounded by decoded size. Concurrent requests for the
+    same avatar share one download.
+    """
+    def __init__(self, max_bytes=AVATAR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total_bytes = 0
+        self.in_flight = {}
+
+    async def get(self, user, pixels):
+        """
+        Returns the user's avatar as a PIL image `pixels` wide, fetched from the CDN
+        at the nearest size above that.
+        """
+        size = cdn_size(pixels)
+        asset = user.display_avatar
+        key = (asset.key, pixels)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            metrics.incr('avatar_cache.hit')
+            return image
+
+        task = self.in_flight.get(key)
+        if task is None:
+            metrics.incr('avatar_cache.miss')
+            task = asyncio.ensure_future(self._fetch(key, asset.replace(size=size, format="png"), pixels))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            metrics.incr('avatar_cache.shared')
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, asset, pixels):
+        data = await asset.read()
+        image = await asyncio.get_running_loop().run_in_executor(None, _decode, data, pixels)
+        self._store(key, image)
+        return image
+
+    def _store(self, key, image):
+        if key in self.images:
+            self.total_bytes -= _image_bytes(self.images.pop(key))
+        self.images[key] = image
+        self.total_bytes += _image_bytes(image)
+        while self.total_bytes > self.max_bytes and len(self.images) > 1:
+            _, old_image = self.images.popitem(last=False)
+            self.total_bytes -= _image_bytes(old_image)
+        metrics.set_gauge('avatar_cache.images', len(self.images))
+        metrics.set_gauge('avatar_cache.bytes', self.total_bytes)
+
+cache = AvatarCache()
@@ -0,0 +1,106 @@
+import time
+import asyncio
+import itertools
+from src import metrics
+
+# Bids on one auction are queued and committed one at a time, highest first. Bids that are
+# already beaten are turned away before they reach Firestore.
+
+class OutbidError(Exception):
+    def __init__(self, current_bid):
+        super().__init__(f"Someone outbid you before your bid went through. The current bid is {current_bid:,} Berries.")
+        self.current_bid = current_bid
+
+class Bid:
+    def __init__(self, bidder_id, amount, sequence, future):
+        self.bidder_id = bidder_id
+        self.amount = amount
+        self.sequence = sequence
+        self.future = future
+
+    def resolve(self, error=None):
+        # The bidder may have given up waiting (a cancelled interaction).
+        if self.future.done():
+            return
+        if error is None:
+            self.future.set_result(None)
+        else:
+            self.future.set_exception(error)
+
+class AuctionLane:
+    def __init__(self):
+        self.pending = []
+        self.worker = None
+        self.committed_bid = 0
+
+class BidSequencer:
+    """
+    One queue and one worker per auction with bids waiting. The worker drops queued
+    bids at or below the best known bid, commits the highest remaining one through
+    `commit(bidder_id, auction_id, amount)` (blocking; run in a thread) and repeats.
+    A failed commit lets the next-highest bid try. `current_bid(auction_id)` supplies
+    the bid last seen in storage, or None.
+    """
+    def __init__(self, commit, current_bid):
+        self.commit = commit
+        self.current_bid = current_bid
+        self.lanes = {}
+        self.sequence = itertools.count()
+
+    async def submit(self, auction_id, bidder_id, amount):
+        """
+        Queues a bid and waits for its outcome. A bid that doesn't beat the current
+        bid is refused straight away. Raises OutbidError if a higher bid won while
+        it was queued, or whatever the commit raised.
+        """
+        lane = self.lanes.get(auction_id)
+        if lane is None:
+            lane = AuctionLane()
+        if amount <= self._best_known(auction_id, lane):
+            metrics.incr('bid_sequencer.too_low')
+            raise Exception("Your bid must be higher than the current bid.")
+        self.lanes[auction_id] = lane
+        future = asyncio.get_running_loop().create_future()
+        lane.pending.append(Bid(bidder_id, amount, next(self.sequence), future))
+        metrics.incr('bid_sequencer.queued')
+        if lane.worker is None:
+            lane.worker = asyncio.create_task(self._drain(auction_id, lane))
+        return await future
+
+    def _best_known(self, auction_id, lane):
+        stored = self.current_bid(auction_id)
+        return max(lane.committed_bid, stored or 0)
+
+    async def _drain(self, auction_id, lane):
+        try:
+            while lane.pending:
+                best_known = self._best_known(auction_id, lane)
+                beaten = [bid for bid in lane.pending if bid.amount <= best_known]
+                for bid in beaten:
+                    bid.resolve(OutbidError(best_known))
+                metrics.incr('bid_sequencer.dropped', len(beaten))
+                lane.pending = [bid for bid in lane.pending if bid.amount > best_known]
+                if not lane.pending:
+                    break
+
+                bid = max(lane.pending, key=lambda bid: (bid.amount, -bid.sequence))
+                lane.pending.remove(bid)
+                started = time.perf_counter()
+                try:
+                    await asyncio.to_thread(self.commit, bid.bidder_id, auction_id, bid.amount)
+                except Exception as e:
+                    metrics.incr('bid_sequencer.failed')
+                    bid.resolve(e)
+                    continue
+                finally:
+                    metrics.observe('bid_sequencer.commit_ms', (time.perf_counter() - started) * 1000)
+                lane.committed_bid = bid.amount
+                metrics.incr('bid_sequencer.committed')
+                bid.resolve()
+        finally:
+            # No awaits between the last check and here, so no bid can slip in unserved.
+            for bid in lane.pending:
+                bid.resolve(RuntimeError("The bid queue stopped before your bid was placed."))
+            lane.pending = []
+            if self.lanes.get(auction_id) is lane:
+                del self.lanes[auction_id]
@@ -0,0 +1,121 @@
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.bid_sequencer import BidSequencer, OutbidError
+
+# A synthetic bidding storm on one auction, run against an in-memory stand-in for a
+# Firestore transaction: read, wait a round trip, commit only if nothing changed since
+# the read, otherwise retry (up to Firestore's default of 5 attempts).
+MAX_ATTEMPTS = 5
+
+class Aborted(Exception):
+    pass
+
+class FakeAuctionStore:
+    def __init__(self, round_trip, starting_bid=100):
+        self.round_trip = round_trip
+        self.lock = threading.Lock()
+        self.version = 0
+        self.current_bid = starting_bid
+        self.highest_bidder_id = None
+        self.attempts = 0
+        self.commits = 0
+        self.retries = 0
+        self.aborted = 0
+        self.writes = 0
+
+    def current(self, auction_id):
+        with self.lock:
+            return self.current_bid
+
+    def bid(self, bidder_id, auction_id, amount):
+        for _ in range(MAX_ATTEMPTS):
+            with self.lock:
+                self.attempts += 1
+                version, current_bid, previous_bidder = self.version, self.current_bid, self.highest_bidder_id
+            time.sleep(self.round_trip)
+            if amount <= current_bid:
+                raise Exception("Your bid must be higher than the current bid.")
+            with self.lock:
+                if self.version != version:
+                    self.retries += 1
+                    continue
+                self.version += 1
+                self.current_bid = amount
+                self.highest_bidder_id = bidder_id
+                self.commits += 1
+                # Auction update and bidder escrow, plus the refund to the previous bidder.
+                self.writes += 3 if previous_bidder else 2
+                return
+        with self.lock:
+            self.aborted += 1
+        raise Aborted(f"Failed to commit transaction in {MAX_ATTEMPTS} attempts.")
+
+def make_storm(bids, bidders, window, seed):
+    """
+    (arrival time, bidder, raise) triples. Each bidder raises the bid they last saw
+    by 1-10%, the way people chase an auction in its final seconds.
+    """
+    rng = random.Random(seed)
+    return sorted((rng.uniform(0, window), f"bidder-{rng.randrange(bidders)}", rng.uniform(0.01, 0.1)) for _ in range(bids))
+
+async def _run(storm, store, submit):
+    outcomes = {"accepted": 0, "outbid": 0, "rejected": 0, "aborted": 0}
+    started = time.perf_counter()
+
+    async def place(at, bidder_id, raise_by):
+        await asyncio.sleep(max(0, at - (time.perf_counter() - started)))
+        seen = store.current("storm")
+        amount = seen + max(1, int(seen * raise_by))
+        try:
+            await submit(bidder_id, amount)
+            outcomes["accepted"] += 1
+        except OutbidError:
+            outcomes["outbid"] += 1
+        except Aborted:
+            outcomes["aborted"] += 1
+        except Exception:
+            outcomes["rejected"] += 1
+
+    await asyncio.gather(*(place(*bid) for bid in storm))
+    elapsed = time.perf_counter() - started
+    return outcomes, elapsed
+
+async def run_direct(storm, round_trip):
+    store = FakeAuctionStore(round_trip)
+    loop = asyncio.get_running_loop()
+    # One thread per bid, as if every handler ran its transaction straight away.
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=len(storm)))
+    outcomes, elapsed = await _run(storm, store, lambda bidder_id, amount: asyncio.to_thread(store.bid, bidder_id, "storm", amount))
+    return store, outcomes, elapsed
+
+async def run_sequenced(storm, round_trip):
+    store = FakeAuctionStore(round_trip)
+    sequencer = BidSequencer(store.bid, store.current)
+    outcomes, elapsed = await _run(storm, store, lambda bidder_id, amount: sequencer.submit("storm", bidder_id, amount))
+    return store, outcomes, elapsed
+
+def report(name, store, outcomes, elapsed):
+    print(f"{name}:")
+    print(f"  outcomes: {outcomes}")
+    print(f"  transaction attempts: {store.attempts}, commits: {store.commits}, contention retries: {store.retries}, aborted: {store.aborted}")
+    print(f"  document writes: {store.writes}, final bid: {store.current_bid:,}, wall time: {elapsed:.2f}s")
+
+async def main(args):
+    storm = make_storm(args.bids, args.bidders, args.window, args.seed)
+    round_trip = args.round_trip_ms / 1000
+    print(f"{args.bids} bids from {args.bidders} bidders over {args.window}s, {args.round_trip_ms} ms per round trip\n")
+    report("Direct transactions", *await run_direct(storm, round_trip))
+    report("Sequenced", *await run_sequenced(storm, round_trip))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a bidding storm on one auction, with and without the bid sequencer.")
+    parser.add_argument("--bids", type=int, default=300)
+    parser.add_argument("--bidders", type=int, default=60)
+    parser.add_argument("--window", type=float, default=3.0, help="seconds over which bids arrive")
+    parser.add_argument("--round-trip-ms", type=float, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
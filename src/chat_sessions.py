@@ -0,0 +1,186 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from src.firebase_utils import db
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Live Gemini chat sessions are kept in memory and written back to Firestore lazily.
+MAX_SESSIONS = int(os.getenv("CHAT_CACHE_MAX_SESSIONS", 500))
+MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+IDLE_SECONDS = int(os.getenv("CHAT_CACHE_IDLE_SECONDS", 1800))
+HISTORY_LIMIT = 20
+WRITE_BATCH_SIZE = 500  # Firestore's limit per batch
+
+def _history_size(history, summary=''):
+    return len(summary) + sum(len(part.text) for content in history for part in content.parts)
+
+def _serialize_history(history):
+    serializable_history = []
+    for content in history:
+        parts = [{'text': part.text} for part in content.parts]
+        serializable_history.append({'role': content.role, 'parts': parts})
+    return serializable_history
+
+class CachedSession:
+    def __init__(self, chat, summary=''):
+        self.chat = chat
+        self.summary = summary
+        self.lock = asyncio.Lock()
+        self.last_used = time.time()
+        self.dirty = False
+        self.size = _history_size(chat.history, summary)
+
+class ChatSessionCache:
+    """
+    LRU of live chat sessions, bounded by session count and total history bytes.
+    Dirty histories are queued for write-back when a session is evicted and on flush(),
+    which commits everything queued in batched writes off the event loop.
+    """
+    def __init__(self, max_sessions=MAX_SESSIONS, max_bytes=MAX_BYTES, idle_seconds=IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        # user_id -> document waiting to be written. Entries stay until their write
+        # commits, so a session reloaded in between sees the queued history.
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+    def get(self, user_id, model):
+        """
+        Returns the cached session for a user, loading it from Firestore on a miss.
+        """
+        user_id = str(user_id)
+        session = self.sessions.get(user_id)
+        if session is not None:
+            self.sessions.move_to_end(user_id)
+            metrics.incr('chat_cache.hit')
+            return session
+
+        metrics.incr('chat_cache.miss')
+        history = []
+        with self.pending_lock:
+            session_data = self.pending.get(user_id)
+        if session_data is None:
+            chat_session_doc = db.collection('chat_sessions').document(user_id).get()
+            session_data = chat_session_doc.to_dict() if chat_session_doc.exists else {}
+        summary = session_data.get('summary', '')
+        for item in session_data.get('history', []):
+            parts = [part['text'] for part in item['parts']]
+            history.append({'role': item['role'], 'parts': parts})
+
+        session = CachedSession(model.start_chat(history=history), summary)
+        self.sessions[user_id] = session
+        self.total_bytes += session.size
+        self._evict()
+        return session
+
+    def mark_updated(self, user_id, session):
+        """
+        Trims a session's history in place after a reply and marks it for write-back.
+        """
+        user_id = str(user_id)
+        history = session.chat.history
+        if len(history) > HISTORY_LIMIT:
+            del history[:-HISTORY_LIMIT]
+        session.last_used = time.time()
+        if self.sessions.get(user_id) is not session:
+            # Evicted while the reply was in flight; queue it for the next flush.
+            self._queue(user_id, session)
+            return
+        new_size = _history_size(history, session.summary)
+        self.total_bytes += new_size - session.size
+        session.size = new_size
+        session.dirty = True
+        self._evict()
+
+    def _queue(self, user_id, session):
+        # Serialized now, so the write doesn't race later replies to the same session.
+        document = {
+            'history': _serialize_history(session.chat.history),
+            'summary': session.summary,
+            'last_used': session.last_used
+        }
+        with self.pending_lock:
+            self.pending[user_id] = document
+        session.dirty = False
+
+    def _drop(self, user_id):
+        session = self.sessions.pop(user_id)
+        self.total_bytes -= session.size
+        if session.dirty:
+            self._queue(user_id, session)
+        metrics.incr('chat_cache.evict')
+
+    def discard(self, user_id, session):
+        """
+        Drops a session from the cache, e.g. after a failed streamed reply.
+        """
+        user_id = str(user_id)
+        if self.sessions.get(user_id) is session:
+            self._drop(user_id)
+
+    def _evict(self):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            oldest_user_id = next(iter(self.sessions))
+            self._drop(oldest_user_id)
+        metrics.set_gauge('chat_cache.sessions', len(self.sessions))
+        metrics.set_gauge('chat_cache.bytes', self.total_bytes)
+
+    def _commit(self):
+        """
+        Writes every queued document in batches of WRITE_BATCH_SIZE. Blocking.
+        """
+        with self.pending_lock:
+            writes = list(self.pending.items())
+        for start in range(0, len(writes), WRITE_BATCH_SIZE):
+            chunk = writes[start:start + WRITE_BATCH_SIZE]
+            batch = db.batch()
+            for user_id, document in chunk:
+                batch.set(db.collection('chat_sessions').document(user_id), document)
+            try:
+                batch.commit()
+            except Exception as e:
+                # Left queued for the next flush.
+                log.error(f"Failed to persist {len(chunk)} chat sessions: {e}")
+                metrics.incr('chat_cache.write_error')
+                continue
+            with self.pending_lock:
+                for user_id, document in chunk:
+                    # Keep anything queued again while the batch was in flight.
+                    if self.pending.get(user_id) is document:
+                        del self.pending[user_id]
+            metrics.incr('chat_cache.write', len(chunk))
+
+    async def flush(self):
+        """
+        Queues dirty sessions, evicts the ones that have gone idle and commits the
+        queued writes in a worker thread.
+        """
+        cutoff = time.time() - self.idle_seconds
+        for user_id, session in list(self.sessions.items()):
+            if session.last_used < cutoff:
+                self._drop(user_id)
+            elif session.dirty:
+                self._queue(user_id, session)
+        metrics.set_gauge('chat_cache.sessions', len(self.sessions))
+        metrics.set_gauge('chat_cache.bytes', self.total_bytes)
+        if self.pending:
+            await asyncio.to_thread(self._commit)
+
+    def flush_all(self):
+        """
+        Queues every dirty session and commits them. Blocking; for shutdown.
+        """
+        for user_id, session in list(self.sessions.items()):
+            if session.dirty:
+                self._queue(user_id, session)
+        self._commit()
+
+cache = ChatSessionCache()
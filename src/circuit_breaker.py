@@ -0,0 +1,108 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Shared breaker for an upstream API. Every call gets a deadline; when the error rate
+    over the rolling window crosses the threshold the circuit opens and calls fail fast
+    until a half-open probe succeeds.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window_seconds=60, min_calls=10, error_rate=0.5, open_seconds=30, half_open_probes=1):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.outcomes = deque()
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self._report()
+
+    def _report(self):
+        metrics.set_gauge(f'{self.name}.breaker_state', self.state)
+
+    def _set_state(self, state):
+        if state != self.state:
+            log.warning(f"Circuit breaker '{self.name}' changed from {self.state} to {state}.")
+            self.state = state
+            self._report()
+
+    def _prune(self, now):
+        while self.outcomes and self.outcomes[0][0] < now - self.window_seconds:
+            self.outcomes.popleft()
+
+    def _before_call(self):
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                metrics.incr(f'{self.name}.rejected')
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self._set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                metrics.incr(f'{self.name}.rejected')
+                raise CircuitOpenError(f"{self.name} circuit is half-open")
+            self.probes_in_flight += 1
+            return True
+        return False
+
+    def _record(self, success, probe):
+        now = time.monotonic()
+        if probe:
+            self.probes_in_flight -= 1
+            if success:
+                self.outcomes.clear()
+                self._set_state(self.CLOSED)
+            else:
+                self.opened_at = now
+                self._set_state(self.OPEN)
+            return
+
+        self.outcomes.append((now, success))
+        self._prune(now)
+        if self.state != self.CLOSED or len(self.outcomes) < self.min_calls:
+            return
+        failures = sum(1 for _, ok in self.outcomes if not ok)
+        if failures / len(self.outcomes) >= self.error_rate:
+            self.opened_at = now
+            self._set_state(self.OPEN)
+
+    async def call(self, fn, *args, timeout=None, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) under the breaker, raising CircuitOpenError without
+        calling it while the circuit is open and asyncio.TimeoutError past the deadline.
+        """
+        probe = self._before_call()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f'{self.name}.timeout')
+            self._record(False, probe)
+            raise
+        except asyncio.CancelledError:
+            if probe:
+                self.probes_in_flight -= 1
+            raise
+        except Exception:
+            metrics.incr(f'{self.name}.error')
+            self._record(False, probe)
+            raise
+        metrics.observe(f'{self.name}.latency_ms', (time.monotonic() - started) * 1000)
+        self._record(True, probe)
+        return result
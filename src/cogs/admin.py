@@ -5,6 +5,8 @@ from discord.ext import commands
 from discord import app_commands
 import typing
 from src.firebase_utils import get_ship_by_name, db
+from src import metrics
+from src.intrusion_controller import controller as intrusion_controller, DEFAULT_TARGET_PER_HOUR
 import math
 
 log = logging.getLogger(__name__)
@@ -15,20 +17,61 @@ class Admin(commands.Cog):
 
     @app_commands.command(name="config_intrusion", description="Configure the bot's intrusion level (0-100).")
     @app_commands.checks.has_permissions(administrator=True)
-    async def config_intrusion(self, interaction: discord.Interaction, level: int):
-        log.info(f"{interaction.user.name} used /config_intrusion with level={level}")
+    async def config_intrusion(self, interaction: discord.Interaction, level: int, mode: typing.Optional[typing.Literal["fixed", "adaptive"]] = None, target_per_hour: typing.Optional[int] = None):
+        log.info(f"{interaction.user.name} used /config_intrusion with level={level}, mode={mode}, target_per_hour={target_per_hour}")
         if 0 <= level <= 100:
             server_id = str(interaction.guild.id)
+            server_settings = dict(self.bot.settings.get(server_id, {}))
+            server_settings.update({
+                'intrusion_level': level,
+                'set_by': interaction.user.name
+            })
+            if mode is not None:
+                server_settings['intrusion_mode'] = mode
+            if target_per_hour is not None:
+                server_settings['intrusion_target_per_hour'] = max(0, target_per_hour)
             db.collection('config').document('settings').update({
-                server_id: {
-                    'intrusion_level': level,
-                    'set_by': interaction.user.name
-                }
+                server_id: server_settings
             })
-            await interaction.response.send_message(f"Intrusion level for this server set to {level}% by {interaction.user.name}.")
+            self.bot.settings[server_id] = server_settings
+
+            if server_settings.get('intrusion_mode') == 'adaptive':
+                target = server_settings.get('intrusion_target_per_hour', DEFAULT_TARGET_PER_HOUR)
+                await interaction.response.send_message(f"Adaptive intrusion for this server set to about {target:g} replies per hour, capped at {level}%, by {interaction.user.name}.")
+            else:
+                await interaction.response.send_message(f"Intrusion level for this server set to {level}% by {interaction.user.name}.")
         else:
             await interaction.response.send_message("Please enter a number between 0 and 100.")
 
+    @app_commands.command(name="intrusion_status", description="Show how often Luffy is currently intruding in this server.")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def intrusion_status(self, interaction: discord.Interaction):
+        log.info(f"{interaction.user.name} used /intrusion_status")
+        server_id = str(interaction.guild.id)
+        server_settings = self.bot.settings.get(server_id, {})
+        mode = server_settings.get('intrusion_mode', 'fixed')
+        lines = [
+            f"mode: {mode}",
+            f"level (ceiling in adaptive mode): {server_settings.get('intrusion_level', 20)}%",
+        ]
+        if mode == 'adaptive':
+            lines.append(f"target: {server_settings.get('intrusion_target_per_hour', DEFAULT_TARGET_PER_HOUR):g} replies/hour")
+
+        state = intrusion_controller.describe(server_id)
+        if state is None:
+            lines.append("No unaddressed messages seen since the bot started.")
+        else:
+            lines += [
+                f"unaddressed messages: {state['candidates_per_hour']:.0f}/hour",
+                f"judge says interesting: {state['judge_yes_rate']:.0%}",
+                f"intrusion replies in the last hour: {state['intrusions_last_hour']}",
+            ]
+            if state['probability'] is not None:
+                lines.append(f"current intrusion chance: {state['probability']:.2%}")
+            lines.append(f"tracked for: {state['tracked_for'] / 60:.0f} min")
+        text = "\n".join(lines)
+        await interaction.response.send_message(f"```\n{text}\n```", ephemeral=True)
+
     @app_commands.command(name="recalculate_ship_level", description="Recalculate a ship's level based on its XP.")
     @app_commands.checks.has_permissions(administrator=True)
     async def recalculate_ship_level(self, interaction: discord.Interaction, ship_name: str):
@@ -60,6 +103,29 @@ class Admin(commands.Cog):
 
         await interaction.followup.send(f"'{ship_name}' has been recalculated to Level {level} with {xp} XP.")
 
+    @app_commands.command(name="metrics", description="Show the bot's runtime metrics.")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def show_metrics(self, interaction: discord.Interaction):
+        log.info(f"{interaction.user.name} used /metrics")
+        data = metrics.snapshot()
+
+        lines = [f"{name}: {value:,}" for name, value in sorted(data['counters'].items())]
+        counters = data['counters']
+        local = counters.get('judge.local_yes', 0) + counters.get('judge.local_no', 0)
+        remote = counters.get('judge.remote', 0)
+        if local + remote:
+            lines.append(f"judge local share: {local / (local + remote):.1%}")
+        if counters.get('judge.audit'):
+            lines.append(f"judge audit agreement: {counters.get('judge.audit_agree', 0) / counters['judge.audit']:.1%}")
+        cache_lookups = counters.get('reply_cache.hit', 0) + counters.get('reply_cache.miss', 0)
+        if cache_lookups:
+            lines.append(f"reply cache hit rate: {counters.get('reply_cache.hit', 0) / cache_lookups:.1%} ({counters.get('reply_cache.hit', 0):,} Gemini calls avoided)")
+        lines += [f"{name}: {value}" for name, value in sorted(data['gauges'].items())]
+        lines += [f"{name}: n={t['count']} avg={t['avg']:.1f} max={t['max']:.1f}" for name, t in sorted(data['timings'].items())]
+
+        text = "\n".join(lines) or "No metrics recorded yet."
+        await interaction.response.send_message(f"```\n{text[:1900]}\n```", ephemeral=True)
+
     events = app_commands.Group(name="events", description="Manage world events.")
 
     @events.command(name="start", description="Start a world event.")
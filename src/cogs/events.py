@@ -1,3 +1,4 @@
+import os
 import random
 import time
 import logging
@@ -5,14 +6,23 @@ import discord
 import asyncio
 from collections import deque
 from discord.ext import commands, tasks
-from src.firebase_utils import db, get_user, update_spam_warnings, suspend_user, lift_suspension, grant_chat_reward
-from src.gemini_ai import get_luffy_response, is_interesting_to_luffy
+from src.firebase_utils import db, get_user, update_spam_warnings, suspend_user, lift_suspension, grant_chat_reward, add_user_guild
+from src.gemini_ai import get_luffy_response, is_interesting_to_luffy, stream_luffy_response
+from src import metrics, reply_cache
+from src.intrusion_controller import controller as intrusion_controller, DEFAULT_TARGET_PER_HOUR
+from src.llm_scheduler import LLMShedError, PRIORITY_MENTION, PRIORITY_INTRUSION
 
 log = logging.getLogger(__name__)
 
 # --- 1. GLOBAL STATE (REMOVED) ---
 ACTIVE_DURATION = 120  # 2 minutes
 REJECTION_PHRASES = ["stop", "shut up", "quiet", "not you", "go away", "bad bot"]
+FALLBACK_REPLY = "Argh! I can't seem to think of a response right now. Maybe ask me later?"
+
+# Streamed replies post the first chunk right away and edit the message as more arrives.
+STREAM_REPLIES = os.getenv("LUFFY_STREAM_REPLIES", "off").lower() in ("1", "true", "on")
+STREAM_EDIT_INTERVAL = float(os.getenv("LUFFY_STREAM_EDIT_INTERVAL", 1.2))  # seconds between edits
+DISCORD_MESSAGE_LIMIT = 2000
 
 class Events(commands.Cog):
     def __init__(self, bot):
@@ -48,6 +58,8 @@ class Events(commands.Cog):
 
         user_id = str(message.author.id)
         player = get_user(user_id)
+        if str(message.guild.id) not in player.get('guilds', []):
+            add_user_guild(user_id, message.guild.id)
 
         # --- Suspension Enforcement ---
         if 'suspended_until' in player and player['suspended_until'] > time.time():
@@ -112,7 +124,6 @@ class Events(commands.Cog):
         # --- 3. ACTIVE MODE & THE JUDGE ---
         server_id = str(message.guild.id)
         server_settings = self.bot.settings.get(server_id, {})
-        intrusion_level = server_settings.get('intrusion_level', 20)
 
         is_mention = self.bot.user.mentioned_in(message)
         contains_luffy = 'luffy' in message.content.lower()
@@ -132,10 +143,15 @@ class Events(commands.Cog):
         elif is_active:
             if random.randint(1, 100) <= 50:
                 should_reply = True
-        elif random.randint(1, 100) <= intrusion_level:
-            if await is_interesting_to_luffy(message_buffer):
-                message_is_interesting = True
+        elif self.roll_intrusion(server_id, server_settings):
+            verdict = await is_interesting_to_luffy(message_buffer, guild_id=server_id)
+            # A shed or failed judge call says nothing about the server; don't let it skew the yes rate.
+            if verdict is not None:
+                intrusion_controller.record_verdict(server_id, verdict)
+            message_is_interesting = bool(verdict)
+            if message_is_interesting:
                 should_reply = True
+                intrusion_controller.record_intrusion(server_id)
                 active_conversations_ref.set({'timestamp': time.time()})
 
         # AI Chat Rewards
@@ -155,16 +171,103 @@ class Events(commands.Cog):
             
             # Get conversation history
             history = "\n".join(message_buffer)
+            priority = PRIORITY_MENTION if is_mention or contains_luffy else PRIORITY_INTRUSION
+
+            started = time.monotonic()
+            cache_key = None
+            if reply_cache.REPLY_CACHE and priority == PRIORITY_MENTION and not (reply_cache.SKIP_ACTIVE and is_active):
+                # Stock greetings are answered from earlier replies without a Gemini turn.
+                cache_key = reply_cache.cache.key_for(message.content)
+                cached_reply = reply_cache.cache.get(cache_key) if cache_key is not None else None
+                if cached_reply is not None:
+                    log.info(f"Luffy bot replied from cache: {cached_reply}")
+                    await message.reply(cached_reply)
+                    self.record_first_text(started, streamed=False)
+                    return
+
+            if STREAM_REPLIES:
+                await self.stream_reply(message, history, started, priority, cache_key)
+                return
 
             async with message.channel.typing():
                 try:
-                    response_text = get_luffy_response(message.author.id, history)
+                    response_text = await get_luffy_response(message.author.id, history, guild_id=server_id, priority=priority)
                     
                     log.info(f"Luffy bot replied: {response_text}")
                     await message.reply(response_text)
+                    self.record_first_text(started, streamed=False)
+                    if cache_key is not None:
+                        reply_cache.cache.add(cache_key, response_text)
+                except LLMShedError as e:
+                    # Over budget: unprompted replies are dropped, direct ones still get an answer.
+                    log.info(f"Luffy reply skipped: {e}")
+                    if priority != PRIORITY_INTRUSION:
+                        await message.reply(FALLBACK_REPLY)
                 except Exception as e:
                     log.error(f"Error generating response: {e}")
-                    await message.reply("Argh! I can't seem to think of a response right now. Maybe ask me later?")
+                    await message.reply(FALLBACK_REPLY)
+
+    def roll_intrusion(self, server_id, server_settings):
+        """
+        Decides whether a message nobody addressed to Luffy goes to The Judge. In adaptive
+        mode the chance follows the guild's traffic, with the admin level as the ceiling.
+        """
+        intrusion_level = server_settings.get('intrusion_level', 20)
+        intrusion_controller.note_candidate(server_id)
+        if server_settings.get('intrusion_mode') != 'adaptive':
+            return random.randint(1, 100) <= intrusion_level
+        target = server_settings.get('intrusion_target_per_hour', DEFAULT_TARGET_PER_HOUR)
+        return random.random() < intrusion_controller.probability(server_id, intrusion_level / 100, target)
+
+    def record_first_text(self, started, streamed):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        metrics.observe('chat.first_text_ms.streamed' if streamed else 'chat.first_text_ms', elapsed_ms)
+        log.info(f"Time to first visible text: {elapsed_ms:.0f} ms (streamed {streamed})")
+
+    async def stream_reply(self, message, history, started, priority, cache_key=None):
+        """
+        Posts Luffy's reply as soon as the first chunk arrives and edits it as the rest
+        streams in, at most once every STREAM_EDIT_INTERVAL seconds.
+        """
+        reply = None
+        text = ""
+        shown = ""
+        last_edit = 0.0
+        try:
+            async with message.channel.typing():
+                async for chunk in stream_luffy_response(message.author.id, history, guild_id=message.guild.id, priority=priority):
+                    text = (text + chunk)[:DISCORD_MESSAGE_LIMIT]
+                    if not text.strip():
+                        continue
+                    if reply is None:
+                        reply = await message.reply(text)
+                        shown = text
+                        last_edit = time.monotonic()
+                        self.record_first_text(started, streamed=True)
+                    elif time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                        await reply.edit(content=text)
+                        shown = text
+                        last_edit = time.monotonic()
+                        metrics.incr('chat.stream_edits')
+        except LLMShedError as e:
+            log.info(f"Luffy reply skipped: {e}")
+            if priority != PRIORITY_INTRUSION:
+                await message.reply(FALLBACK_REPLY)
+            return
+        except Exception as e:
+            log.error(f"Error generating response: {e}")
+            if reply is None:
+                await message.reply(FALLBACK_REPLY)
+            return
+
+        log.info(f"Luffy bot replied: {text}")
+        if reply is None:
+            await message.reply(FALLBACK_REPLY)
+        else:
+            if text != shown:
+                await reply.edit(content=text)
+            if cache_key is not None:
+                reply_cache.cache.add(cache_key, text)
 
 async def setup(bot):
     await bot.add_cog(Events(bot))
@@ -6,12 +6,21 @@ import math
 import discord
 import logging
 import asyncio
+import typing
 from discord.ext import commands
 from discord import app_commands
-from PIL import Image, ImageDraw, ImageFont
-from google.cloud import firestore
-from src.firebase_utils import get_user, update_berries, update_bounty, add_to_crew, db, get_ship, claim_daily_reward, gift_berries, buy_item, sell_item, add_ship_xp, use_medical_kit, escrow_wager, resolve_duel, create_auction, bid_on_auction, claim_sold_auction, claim_won_auction, buy_title, equip_title, update_recruit_cooldown, update_private_adventure_cooldown, update_auction_claim_cooldown, update_wanted_poster_cooldown
+from src.firebase_utils import get_user, update_berries, update_bounty, add_to_crew, db, get_ship, claim_daily_reward, gift_berries, buy_item, sell_item, add_ship_xp, use_medical_kit, escrow_wager, resolve_duel, create_auction, bid_on_auction, buy_title, equip_title, update_recruit_cooldown, update_private_adventure_cooldown, update_auction_claim_cooldown, update_wanted_poster_cooldown
 from src.gemini_ai import get_adventure_description, get_recruit_description
+from src.wanted_poster import render_poster_async, poster_variant, poster_filename, avatar_pixels
+from src.avatar_cache import cache as avatar_cache
+from src.poster_cache import cache as poster_cache, poster_key
+from src.user_resolver import resolver as user_resolver
+from src.combat import Duelist, BadgeEffects, fight_duel, ship_xp, new_rng, DUEL_SHIP_XP
+from src.rank_index import index as rank_index, describe_rank
+from src.auction_index import index as auction_index
+from src.bid_sequencer import BidSequencer, OutbidError
+from src.auction_settlement import settler as auction_settler, digest_lines
+from src.leaderboards import store as leaderboard_store, METRICS as LEADERBOARD_METRICS, LEADERBOARD_PAGE_SIZE
 
 log = logging.getLogger(__name__)
 
@@ -23,30 +32,35 @@ CHARACTERS = {
 }
 RARITY_CHANCES = {"Common": 60, "Rare": 30, "Legendary": 9, "Mythical": 1}
 
+WANTED_POSTER_COOLDOWN = 60
+AUCTION_PAGE_SIZE = 10
+AUCTION_SORT_TITLES = {"ending": "Ending Soon", "price": "Highest Bid", "newest": "Newest"}
+
 async def create_wanted_poster(user, bounty):
-    # Load template and font
-    template = Image.open("wanted_template.png")
-    name_font = ImageFont.truetype("font.ttf", 105)
-    bounty_font = ImageFont.truetype("font.ttf", 155)
-    
-    # Get user avatar
-    avatar_data = await user.display_avatar.read()
-    avatar = Image.open(io.BytesIO(avatar_data)).resize((880, 880))
-    
-    # Paste avatar
-    template.paste(avatar, (360, 640))
-    
-    # Draw text
-    draw = ImageDraw.Draw(template)
-    draw.text((585, 1735), user.name, font=name_font, fill="black")
-    draw.text((850, 1870), f"{bounty:,}", font=bounty_font, fill="black")
-    
-    # Save to buffer
-    buffer = io.BytesIO()
-    template.save(buffer, format="PNG")
-    buffer.seek(0)
-    
-    return discord.File(buffer, filename="wanted.png")
+    """
+    Renders a poster and stores it in the render cache. Returns the encoded bytes.
+    """
+    avatar = await avatar_cache.get(user, avatar_pixels())
+    poster_bytes = await render_poster_async(avatar, user.name, bounty)
+    await poster_cache.put_async(poster_key(user.display_avatar.key, user.name, bounty, poster_variant()), poster_bytes)
+    return poster_bytes
+
+def _stored_bid(auction_id):
+    auction = auction_index.get(auction_id)
+    return auction['current_bid'] if auction else None
+
+# Bids on the same auction are queued and committed one at a time.
+bid_sequencer = BidSequencer(bid_on_auction, _stored_bid)
+
+def _claim_cooldown(interaction):
+    # No cooldown while the auction index is loading, so being turned away doesn't cost the hour.
+    if not auction_index.ready.is_set():
+        return None
+    return app_commands.Cooldown(1, 3600)
+
+def describe_auction(auction):
+    remaining_time = time.strftime('%Hh %Mm %Ss', time.gmtime(max(0, auction['end_time'] - time.time())))
+    return f"Current Bid: {auction['current_bid']:,} Berries\nEnds In: {remaining_time}\nAuction ID: `{auction['id']}`"
 
 class Game(commands.Cog):
     def __init__(self, bot):
@@ -79,6 +93,9 @@ class Game(commands.Cog):
         embed.add_field(name="HP", value=f"{player.get('hp', 100)}/{player.get('max_hp', 100)}", inline=True)
         embed.add_field(name="Berries", value=f"{player.get('berries', 0):,}", inline=True)
         embed.add_field(name="Bounty", value=f"{player.get('bounty', 0):,}", inline=True)
+        if rank_index.ready:
+            rank_index.set(user.id, player.get('bounty', 0))
+            embed.add_field(name="Rank", value=describe_rank(*rank_index.rank_of(user.id)), inline=True)
 
         ship_info = "Not in a ship"
         if player.get('ship_id'):
@@ -123,8 +140,8 @@ class Game(commands.Cog):
             embed.add_field(name="Auction Claim Cooldown", value=remaining_time, inline=True)
 
         wanted_poster_cooldown = player.get('last_wanted_poster_timestamp')
-        if wanted_poster_cooldown and time.time() - wanted_poster_cooldown < 60:
-            remaining_time = time.strftime('%Mm %Ss', time.gmtime(60 - (time.time() - wanted_poster_cooldown)))
+        if wanted_poster_cooldown and time.time() - wanted_poster_cooldown < WANTED_POSTER_COOLDOWN:
+            remaining_time = time.strftime('%Mm %Ss', time.gmtime(WANTED_POSTER_COOLDOWN - (time.time() - wanted_poster_cooldown)))
             embed.add_field(name="Wanted Poster Cooldown", value=remaining_time, inline=True)
 
         chat_reward_cooldown_ends = player.get('chat_reward_cooldown_ends')
@@ -181,7 +198,7 @@ class Game(commands.Cog):
         success = random.randint(1, 100) <= 70
 
         await interaction.response.defer()
-        description = await get_adventure_description(scenario, success)
+        description = await get_adventure_description(scenario, success, guild_id=interaction.guild_id)
 
         if success:
             bounty_gain = random.randint(500, 5000)
@@ -224,7 +241,7 @@ class Game(commands.Cog):
         scenario = random.choice(scenarios)
         success = random.randint(1, 100) <= 85 # Higher success chance for private adventures
 
-        description = await get_adventure_description(scenario, success)
+        description = await get_adventure_description(scenario, success, guild_id=interaction.guild_id)
 
         if success:
             bounty_gain = random.randint(1000, 10000)
@@ -272,7 +289,7 @@ class Game(commands.Cog):
         add_to_crew(user_id, character)
         update_recruit_cooldown(user_id)
 
-        description = await get_recruit_description(character)
+        description = await get_recruit_description(character, guild_id=interaction.guild_id)
 
         await interaction.followup.send(f"**{description}**\nYou recruited {character} ({rarity})!")
 
@@ -281,40 +298,47 @@ class Game(commands.Cog):
         if isinstance(error, app_commands.CommandOnCooldown):
             await interaction.response.send_message(f"You can recruit again in {time.strftime('%Hh %Mm %Ss', time.gmtime(error.retry_after))}", ephemeral=True)
 
-    @app_commands.command(name="leaderboard", description="See the top 5 pirates.")
-    async def leaderboard(self, interaction: discord.Interaction):
-        log.info(f"{interaction.user.name} used /leaderboard")
-        
-        # Efficiently query the top 5 pirates by bounty
-        query = db.collection('pirates').order_by('bounty', direction=firestore.Query.DESCENDING).limit(5)
-        top_pirates = query.stream()
+    @app_commands.command(name="leaderboard", description="See the top pirates and ships.")
+    @app_commands.describe(metric="What to rank by.", scope="Everyone, or just this server.")
+    async def leaderboard(self, interaction: discord.Interaction, metric: typing.Literal["bounty", "berries", "ship_level", "crew_size"] = "bounty", scope: typing.Literal["global", "server"] = "global"):
+        log.info(f"{interaction.user.name} used /leaderboard with metric={metric} scope={scope}")
+        board = leaderboard_store.get(metric, interaction.guild_id if scope == "server" else None)
+        if board is None:
+            await interaction.response.send_message("The leaderboards are still being tallied. Try again in a few minutes.", ephemeral=True)
+            return
 
-        embed = discord.Embed(
-            title="Top 5 Pirates",
-            color=discord.Color.dark_red()
-        )
+        await interaction.response.defer()
+        view = LeaderboardView(self.bot, board, interaction.user.id, interaction.guild.name if scope == "server" and interaction.guild else None)
+        embed = await view.render()
+        view.message = await interaction.followup.send(embed=embed, view=view, wait=True)
 
-        i = 1
-        for user_doc in top_pirates:
-            try:
-                user_id = int(user_doc.id)
-                user = await self.bot.fetch_user(user_id)
-                player_data = user_doc.to_dict()
-                embed.add_field(
-                    name=f"{i}. {user.name}",
-                    value=f"Bounty: {player_data.get('bounty', 0):,}",
-                    inline=False
-                )
-                i += 1
-            except (discord.NotFound, ValueError):
-                log.warning(f"Could not find user with ID: {user_doc.id} for leaderboard.")
-                continue
-        
-        if i == 1: # No pirates found
-            embed.description = "The seas are quiet... no top pirates to show yet."
+    @app_commands.command(name="rank", description="See where a pirate ranks by bounty.")
+    @app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
+    async def rank(self, interaction: discord.Interaction, user: discord.User = None):
+        log.info(f"{interaction.user.name} used /rank")
+        if user is None:
+            user = interaction.user
 
+        if not rank_index.ready:
+            await interaction.response.send_message("The bounty rankings are still being tallied. Try again in a few minutes.", ephemeral=True)
+            return
+
+        player = get_user(str(user.id))
+        bounty = player.get('bounty', 0)
+        rank_index.set(user.id, bounty)
+        rank, total = rank_index.rank_of(user.id)
+
+        embed = discord.Embed(title=f"{user.name}'s Rank", color=discord.Color.dark_red())
+        embed.set_thumbnail(url=user.display_avatar.url)
+        embed.add_field(name="Bounty", value=f"{bounty:,}", inline=True)
+        embed.add_field(name="Rank", value=describe_rank(rank, total), inline=True)
         await interaction.response.send_message(embed=embed)
 
+    @rank.error
+    async def on_rank_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, app_commands.CommandOnCooldown):
+            await interaction.response.send_message(f"You can check ranks again in {int(error.retry_after)}s.", ephemeral=True)
+
     @app_commands.command(name="event", description="Check the current world event.")
     async def event(self, interaction: discord.Interaction):
         log.info(f"{interaction.user.name} used /event")
@@ -598,29 +622,54 @@ class Game(commands.Cog):
     auction = app_commands.Group(name="auction", description="Manage auctions.")
 
     @auction.command(name="list", description="List all active auctions.")
-    async def auction_list(self, interaction: discord.Interaction):
-        log.info(f"{interaction.user.name} used /auction list")
-        
-        auctions_ref = db.collection('auctions').where('end_time', '>', time.time()).stream()
-        
-        embed = discord.Embed(title="Active Auctions", color=discord.Color.purple())
-        
-        auctions_found = False
-        for auction_doc in auctions_ref:
-            auctions_found = True
-            auction = auction_doc.to_dict()
-            end_time = auction['end_time']
-            remaining_time = time.strftime('%Hh %Mm %Ss', time.gmtime(end_time - time.time()))
-            embed.add_field(
-                name=f"{auction['item_name']} (Qty: {auction['quantity']})",
-                value=f"Current Bid: {auction['current_bid']} Berries\nEnds In: {remaining_time}\nAuction ID: `{auction_doc.id}`",
-                inline=False
-            )
-            
-        if not auctions_found:
-            embed.description = "There are no active auctions."
-            
-        await interaction.response.send_message(embed=embed)
+    @app_commands.describe(sort="Order to list auctions in.")
+    async def auction_list(self, interaction: discord.Interaction, sort: typing.Literal["ending", "price", "newest"] = "ending"):
+        log.info(f"{interaction.user.name} used /auction list with sort={sort}")
+        if not auction_index.ready.is_set():
+            await interaction.response.send_message("The Auction House is still opening its doors. Try again in a moment.", ephemeral=True)
+            return
+
+        view = AuctionListView(interaction.user.id, "/auction list", f"Active Auctions - {AUCTION_SORT_TITLES[sort]}", auction_index.open_count(), lambda offset, limit: auction_index.page(sort, offset, limit))
+        await interaction.response.send_message(embed=await view.render(), view=view)
+        view.message = await interaction.original_response()
+
+    @auction.command(name="search", description="Search active auctions.")
+    @app_commands.describe(
+        item_id="The item or crew member to look for.",
+        item_type="Items or crew members only.",
+        min_price="Lowest current bid.",
+        max_price="Highest current bid.",
+        seller="Only auctions from this pirate.",
+        ends_within_hours="Only auctions ending within this many hours."
+    )
+    async def auction_search(self, interaction: discord.Interaction, item_id: str = None, item_type: typing.Literal["item", "crew"] = None, min_price: int = None, max_price: int = None, seller: discord.User = None, ends_within_hours: float = None):
+        log.info(f"{interaction.user.name} used /auction search with item_id={item_id} item_type={item_type} min_price={min_price} max_price={max_price} seller={seller} ends_within_hours={ends_within_hours}")
+        if not auction_index.ready.is_set():
+            await interaction.response.send_message("The Auction House is still opening its doors. Try again in a moment.", ephemeral=True)
+            return
+
+        if min_price is not None and max_price is not None and min_price > max_price:
+            await interaction.response.send_message("The minimum price can't be above the maximum price.", ephemeral=True)
+            return
+
+        results = auction_index.search(
+            item_id=item_id,
+            item_type=item_type,
+            seller_id=str(seller.id) if seller else None,
+            min_price=min_price,
+            max_price=max_price,
+            ends_within=ends_within_hours * 3600 if ends_within_hours is not None else None
+        )
+        view = AuctionListView(interaction.user.id, "/auction search", f"Auction Search - {len(results)} found", len(results), lambda offset, limit: results[offset:offset + limit])
+        await interaction.response.send_message(embed=await view.render(), view=view)
+        view.message = await interaction.original_response()
+
+    @auction_search.autocomplete('item_id')
+    async def auction_search_item_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [
+            app_commands.Choice(name=f"{item_name} ({count} listed)"[:100], value=item_id)
+            for item_id, item_name, count in auction_index.listed_items(current)
+        ]
 
     @auction.command(name="sell", description="Sell an item or crew member on the auction house.")
     async def auction_sell(self, interaction: discord.Interaction, item_type: str, item_id: str, quantity: int, starting_bid: int):
@@ -667,51 +716,53 @@ class Game(commands.Cog):
 
         bidder_id = str(interaction.user.id)
 
+        await interaction.response.defer()
         try:
-            bid_on_auction(bidder_id, auction_id, bid_amount)
-            await interaction.response.send_message("You are now the highest bidder!")
+            await bid_sequencer.submit(auction_id, bidder_id, bid_amount)
+            await interaction.followup.send("You are now the highest bidder!")
+        except OutbidError as e:
+            await interaction.followup.send(str(e))
         except Exception as e:
-            await interaction.response.send_message(f"An error occurred: {e}")
+            await interaction.followup.send(f"An error occurred: {e}")
 
     @auction.command(name="claim", description="Claim winnings or sold items from ended auctions.")
-    @app_commands.checks.cooldown(1, 3600, key=lambda i: i.user.id)
+    @app_commands.checks.dynamic_cooldown(_claim_cooldown, key=lambda i: i.user.id)
     async def auction_claim(self, interaction: discord.Interaction):
         log.info(f"{interaction.user.name} used /auction claim")
+        if not auction_index.ready.is_set():
+            await interaction.response.send_message("The Auction House is still opening its doors. Try again in a moment.", ephemeral=True)
+            return
         await interaction.response.defer()
         user_id = str(interaction.user.id)
 
-        claimed_something = False
-
-        # Claim sold auctions
-        sold_auctions_ref = db.collection('auctions').where('seller_id', '==', user_id).stream()
-        for auction_doc in sold_auctions_ref:
-            auction_data = auction_doc.to_dict()
-            if auction_data['end_time'] <= time.time():
-                try:
-                    payout = claim_sold_auction(user_id, auction_doc.id)
-                    update_auction_claim_cooldown(user_id)
-                    await interaction.followup.send(f"Your auction for {auction_data['item_name']} sold! You receive {payout} Berries (after 5% tax).")
-                    claimed_something = True
-                except Exception as e:
-                    await interaction.followup.send(f"An error occurred while claiming sold auction {auction_doc.id}: {e}")
-
-        # Claim won auctions
-        won_auctions_ref = db.collection('auctions').where('highest_bidder_id', '==', user_id).stream()
-        for auction_doc in won_auctions_ref:
-            auction_data = auction_doc.to_dict()
-            if auction_data['end_time'] <= time.time():
-                try:
-                    claim_won_auction(user_id, auction_doc.id)
-                    update_auction_claim_cooldown(user_id)
-                    await interaction.followup.send(f"You won the auction for {auction_data['item_name']}!")
-                    claimed_something = True
-                except Exception as e:
-                    await interaction.followup.send(f"An error occurred while claiming won auction {auction_doc.id}: {e}")
-        
-        if claimed_something:
-            await interaction.followup.send("You have claimed all available auction items and earnings.")
-        else:
-            await interaction.followup.send("You have no ended auctions to claim.")
+        # Ended auctions are settled automatically; this settles any still waiting, in one pass.
+        claimable = [auction['id'] for auction in auction_index.ended_for(user_id)]
+        if not claimable:
+            await interaction.followup.send("You have no ended auctions to claim. Ended auctions are settled automatically, and you get a DM with the results.")
+            return
+
+        try:
+            settled = await auction_settler.settle(claimable)
+        except Exception as e:
+            log.error(f"Error claiming auctions for {user_id}: {e}")
+            await interaction.followup.send(f"An error occurred while claiming your auctions: {e}")
+            return
+
+        if not settled:
+            if any(auction_id in auction_settler.unsettleable for auction_id in claimable):
+                await interaction.followup.send("Your ended auctions couldn't be settled. Please contact a bot admin.")
+            else:
+                await interaction.followup.send("Those auctions were just settled. Check your DMs for the results.")
+            return
+
+        # The other side of each auction hears about it by DM, as with automatic settlement.
+        await asyncio.gather(
+            asyncio.to_thread(update_auction_claim_cooldown, user_id),
+            auction_settler.notify(self.bot, settled, skip={user_id})
+        )
+
+        view = ClaimSummaryView(interaction.user.id, settled, digest_lines(settled).get(user_id, []))
+        view.message = await interaction.followup.send(embed=await view.render(), view=view, wait=True)
 
     @auction_claim.error
     async def on_auction_claim_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
@@ -721,25 +772,32 @@ class Game(commands.Cog):
     asset = app_commands.Group(name="asset", description="Download various game assets.")
 
     @asset.command(name="wanted_poster", description="Download your wanted poster.")
-    @app_commands.checks.cooldown(1, 60, key=lambda i: i.user.id)
     async def asset_wanted_poster(self, interaction: discord.Interaction, user: discord.User = None):
         log.info(f"{interaction.user.name} used /asset wanted_poster")
         if user is None:
             user = interaction.user
         
         player = get_user(str(user.id))
-        
+
+        # Only fresh renders are rate limited; a cached poster is just a file upload.
+        key = poster_key(user.display_avatar.key, user.name, player['bounty'], poster_variant())
+        cached = await poster_cache.get_async(key)
+        if cached is None:
+            invoker = player if user.id == interaction.user.id else get_user(str(interaction.user.id))
+            last_poster = invoker.get('last_wanted_poster_timestamp')
+            if last_poster and time.time() - last_poster < WANTED_POSTER_COOLDOWN:
+                await interaction.response.send_message(f"You're on cooldown! Try again in {int(WANTED_POSTER_COOLDOWN - (time.time() - last_poster))}s", ephemeral=True)
+                return
+
         await interaction.response.defer()
 
-        wanted_poster = await create_wanted_poster(user, player['bounty'])
-        update_wanted_poster_cooldown(str(user.id))
+        if cached is None:
+            poster_bytes = await create_wanted_poster(user, player['bounty'])
+            update_wanted_poster_cooldown(str(interaction.user.id))
+        else:
+            poster_bytes = cached
         
-        await interaction.followup.send(file=wanted_poster)
-
-    @asset_wanted_poster.error
-    async def on_asset_wanted_poster_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
-        if isinstance(error, app_commands.CommandOnCooldown):
-            await interaction.response.send_message(f"You're on cooldown! Try again in {int(error.retry_after)}s", ephemeral=True)
+        await interaction.followup.send(file=discord.File(io.BytesIO(poster_bytes), filename=poster_filename()))
 
     @app_commands.command(name="guide", description="Get a guide to the Grand Line!")
     async def guide(self, interaction: discord.Interaction):
@@ -755,6 +813,7 @@ class Game(commands.Cog):
             "- `/ship create <name>`: Start your own pirate crew!\n"
             "- `/ship join <name>`: Join an existing crew!\n"
             "- `/ship info`: See your ship's stats.\n"
+            "- `/ship posters`: Captains and officers get the whole crew's wanted posters.\n"
             "- `/ship leave`: Abandon ship (if you're not the captain!).\n"
             "- `/ship disband`: Captains can disband their ship.\n"
             "- `/ship promote @user`: Promote a crew member to officer.\n"
@@ -785,15 +844,17 @@ class Game(commands.Cog):
             "- `/recruit`: Recruit a new crew member!\n"
             "- `/duel @user [wager]`: Challenge another pirate to a duel!\n"
             "- `/asset wanted_poster [user]`: Generate a wanted poster!\n"
-            "- `/leaderboard`: See the top pirates by bounty!\n"
+            "- `/rank [user]`: See where you (or another pirate) rank by bounty.\n"
+            "- `/leaderboard [metric] [scope]`: See the top pirates by bounty or berries, and the top ships by level or crew size, across all servers or just this one!\n"
             "- `/event`: Check for active world events!"
         ), inline=False)
 
         embed.add_field(name="🏴‍☠️ Auctions", value=(
-            "- `/auction list`: See items up for bid.\n"
+            "- `/auction list [sort]`: See items up for bid, ending soon, by highest bid or newest first.\n"
             "- `/auction sell <item_type> <item_id> <quantity> <starting_bid>`: Sell your treasures!\n"
+            "- `/auction search [item_id] [item_type] [min_price] [max_price] [seller] [ends_within_hours]`: Find auctions for what you're after.\n"
             "- `/auction bid <auction_id> <bid_amount>`: Bid on items!\n"
-            "- `/auction claim`: Claim your winnings or earnings!"
+            "- `/auction claim`: Claim your winnings or earnings right away. Ended auctions are also settled for you automatically!"
         ), inline=False)
 
         embed.add_field(name="✨ Customization", value=(
@@ -844,58 +905,40 @@ class DuelView(discord.ui.View):
         challenger = get_user(self.challenger_id)
         opponent = get_user(self.opponent_id)
 
-        challenger_hp = challenger.get('hp', 100)
-        opponent_hp = opponent.get('hp', 100)
-        
-        challenger_max_hp = challenger.get('max_hp', 100)
-        opponent_max_hp = opponent.get('max_hp', 100)
-
-        challenger_user = await self.bot.fetch_user(self.challenger_id)
-        opponent_user = await self.bot.fetch_user(self.opponent_id)
-        challenger_name = challenger_user.name
-        opponent_name = opponent_user.name
+        challenger_user, opponent_user = await asyncio.gather(
+            user_resolver.get(self.bot, self.challenger_id),
+            user_resolver.get(self.bot, self.opponent_id)
+        )
+        # A deleted account or a failed fetch still gets to fight, under a placeholder name.
+        challenger_name = challenger_user.name if challenger_user else "Unknown Pirate"
+        opponent_name = opponent_user.name if opponent_user else "Unknown Pirate"
+        fighters = (Duelist.from_player(challenger_name, challenger), Duelist.from_player(opponent_name, opponent))
+        rng, seed = new_rng()
+        result = fight_duel(fighters[0], fighters[1], rng)
+        log.info(f"Duel {self.challenger_id} vs {self.opponent_id} (seed {seed}): {len(result.rounds)} blows, winner {fighters[result.winner].name}")
 
         message = await interaction.followup.send("The duel begins!")
 
-
-        while challenger_hp > 0 and opponent_hp > 0:
-            # Challenger's turn
-            damage = random.randint(10, 20)
-            opponent_hp -= damage
-            await message.edit(content=f"{challenger_name} attacks {opponent_name} for {damage} damage! ({opponent_name} HP: {opponent_hp}/{opponent_max_hp})")
-            await asyncio.sleep(3)
-
-            if opponent_hp <= 0:
-                break
-
-            # Opponent's turn
-            damage = random.randint(10, 20)
-            challenger_hp -= damage
-            await message.edit(content=f"{opponent_name} fights back for {damage} damage! ({challenger_name} HP: {challenger_hp}/{challenger_max_hp})")
+        for blow in result.rounds:
+            attacker, defender = fighters[blow.attacker], fighters[blow.defender]
+            action = f"attacks {defender.name}" if blow.attacker == 0 else "fights back"
+            await message.edit(content=f"{attacker.name} {action} for {blow.damage} damage! ({defender.name} HP: {blow.defender_hp}/{defender.max_hp})")
             await asyncio.sleep(3)
 
-        if challenger_hp > opponent_hp:
-            winner_id = self.challenger_id
-            loser_id = self.opponent_id
-            winner_name = challenger_name
-        else:
-            winner_id = self.opponent_id
-            loser_id = self.challenger_id
-            winner_name = opponent_name
+        participants = (self.challenger_id, self.opponent_id)
+        winner_id = participants[result.winner]
+        loser_id = participants[1 - result.winner]
+        winner_name = fighters[result.winner].name
 
         resolve_duel(winner_id, loser_id, self.wager)
         
         winner = get_user(winner_id)
         if winner.get('ship_id'):
-            xp_gain = 500
+            xp_gain = DUEL_SHIP_XP
             ship = get_ship(winner['ship_id'])
-            if ship:
-                badge_id = ship.get('equipped_badge')
-                if badge_id:
-                    items = db.collection('config').document('items').get().to_dict()
-                    badge = items.get(badge_id)
-                    if badge and badge.get('effect', {}).get('type') == 'xp_boost':
-                        xp_gain = int(xp_gain * (1 + badge['effect']['value']))
+            if ship and ship.get('equipped_badge'):
+                items = db.collection('config').document('items').get().to_dict()
+                xp_gain = ship_xp(xp_gain, BadgeEffects.from_items(items, ship['equipped_badge']))
             add_ship_xp(winner['ship_id'], xp_gain)
             ship_cog = self.bot.get_cog('Ship')
             if ship_cog:
@@ -916,4 +959,127 @@ class DuelView(discord.ui.View):
             item.disabled = True
         await interaction.message.edit(view=self)
         
-        await interaction.followup.send("The duel has been declined.")
\ No newline at end of file
+        await interaction.followup.send("The duel has been declined.")
+
+class PagedView(discord.ui.View):
+    """
+    Previous/Next pager for an embed. Subclasses set `pages` and implement `build_embed`
+    for `self.page`; only the user who ran the command can turn pages.
+    """
+    def __init__(self, user_id, command_name, pages=1):
+        super().__init__(timeout=180)
+        self.user_id = user_id
+        self.command_name = command_name
+        self.pages = max(1, pages)
+        self.page = 0
+        self.message = None
+
+    async def build_embed(self):
+        raise NotImplementedError
+
+    async def render(self):
+        embed = await self.build_embed()
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page >= self.pages - 1
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message(f"Run {self.command_name} yourself to flip through the pages.", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.defer()
+        await interaction.message.edit(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await interaction.response.defer()
+        await interaction.message.edit(embed=await self.render(), view=self)
+
+class LeaderboardView(PagedView):
+    def __init__(self, bot, board, user_id, guild_name=None):
+        super().__init__(user_id, "/leaderboard", math.ceil(len(board.entries) / LEADERBOARD_PAGE_SIZE))
+        self.bot = bot
+        self.board = board
+        self.guild_name = guild_name
+
+    async def build_embed(self):
+        """
+        Builds the embed for the current page, resolving only that page's pirates.
+        """
+        collection, title = LEADERBOARD_METRICS[self.board.metric]
+        first = self.page * LEADERBOARD_PAGE_SIZE
+        entries = self.board.entries[first:first + LEADERBOARD_PAGE_SIZE]
+        scope_name = self.guild_name or "All Seas"
+        embed = discord.Embed(title=f"Top {'Pirates' if collection == 'pirates' else 'Ships'} by {title} - {scope_name}", color=discord.Color.dark_red())
+
+        if collection == 'pirates':
+            users = await user_resolver.get_many(self.bot, [entry['id'] for entry in entries])
+            names = [users[entry['id']].name if users[entry['id']] else "Unknown Pirate" for entry in entries]
+        else:
+            names = [entry['name'] for entry in entries]
+
+        lines = []
+        for rank, (entry, name) in enumerate(zip(entries, names), start=first + 1):
+            if self.board.metric == 'ship_level':
+                value = f"Level {entry['value']} ({entry.get('xp', 0):,} XP)"
+            elif self.board.metric == 'crew_size':
+                value = f"{entry['value']} crew"
+            else:
+                value = f"{entry['value']:,} {title}"
+            lines.append(f"**{rank}.** {name} - {value}")
+        embed.description = "\n".join(lines) or "The seas are quiet... no one to show here yet."
+
+        updated = leaderboard_store.checked_at(self.board)
+        footer = f"Page {self.page + 1}/{self.pages}"
+        if updated:
+            footer += f" - updated {max(0, int((time.time() - updated) // 60))} min ago"
+        embed.set_footer(text=footer)
+        return embed
+
+class AuctionListView(PagedView):
+    def __init__(self, user_id, command_name, title, count, fetch):
+        super().__init__(user_id, command_name, math.ceil(count / AUCTION_PAGE_SIZE))
+        self.title = title
+        self.fetch = fetch
+
+    async def build_embed(self):
+        auctions = self.fetch(self.page * AUCTION_PAGE_SIZE, AUCTION_PAGE_SIZE)
+        embed = discord.Embed(title=self.title, color=discord.Color.purple())
+        for auction in auctions:
+            embed.add_field(name=f"{auction['item_name']} (Qty: {auction['quantity']})", value=describe_auction(auction), inline=False)
+        if not auctions:
+            embed.description = "There are no active auctions."
+        embed.set_footer(text=f"Page {self.page + 1}/{self.pages}")
+        return embed
+
+class ClaimSummaryView(PagedView):
+    def __init__(self, user_id, settled, lines):
+        super().__init__(user_id, "/auction claim", math.ceil(len(lines) / AUCTION_PAGE_SIZE))
+        self.lines = lines
+        self.earned = sum(auction['payout'] for auction in settled if auction['seller_id'] == str(user_id))
+        self.received = sum(1 for auction in settled if auction.get('highest_bidder_id') == str(user_id))
+        self.returned = sum(1 for auction in settled if auction['seller_id'] == str(user_id) and not auction.get('highest_bidder_id'))
+
+    async def build_embed(self):
+        first = self.page * AUCTION_PAGE_SIZE
+        embed = discord.Embed(title="Auction Claims", description="\n".join(self.lines[first:first + AUCTION_PAGE_SIZE]), color=discord.Color.purple())
+        embed.add_field(name="Berries Earned", value=f"{self.earned:,}", inline=True)
+        embed.add_field(name="Lots Won", value=str(self.received), inline=True)
+        embed.add_field(name="Returned Unsold", value=str(self.returned), inline=True)
+        embed.set_footer(text=f"Page {self.page + 1}/{self.pages}")
+        return embed
@@ -1,10 +1,17 @@
+import io
+import time
 import discord
 import logging
 import asyncio
 import random
 from discord.ext import commands
 from discord import app_commands
-from src.firebase_utils import get_user, update_berries, get_ship_by_name, join_ship, leave_ship, get_ship, db, deposit_item_to_ship, upgrade_ship, set_war_cooldown, resolve_ship_war, repair_ship, escrow_wager, equip_badge, unequip_badge
+from src.firebase_utils import get_user, update_berries, get_ship_by_name, join_ship, leave_ship, get_ship, db, deposit_item_to_ship, upgrade_ship, set_war_cooldown, resolve_ship_war, repair_ship, escrow_wager, equip_badge, unequip_badge, set_posters_cooldown, get_users
+from src.avatar_cache import cache as avatar_cache
+from src.user_resolver import resolver as user_resolver
+from src.combat import Warship, BadgeEffects, fight_ship_war, new_rng
+from src.wanted_poster import render_contact_sheets_async, avatar_pixels, SHEET_TILE_SCALE, SHEET_WORKERS, EXTENSIONS, POSTER_FORMAT
+from src import metrics
 from firebase_admin import firestore
 import uuid
 import math
@@ -12,6 +19,9 @@ import json
 
 log = logging.getLogger(__name__)
 
+POSTERS_COOLDOWN = 600  # seconds, per ship
+PROGRESS_EDIT_INTERVAL = 1.5
+
 class Ship(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -134,6 +144,7 @@ class Ship(commands.Cog):
             "storage": {},
             "hp": 2000,
             "war_cooldown": None,
+            "posters_cooldown": None,
             "equipped_badge": None,
             "crew_bonus": 1.0
         })
@@ -213,11 +224,11 @@ class Ship(commands.Cog):
             await interaction.response.send_message("Could not find your ship's information.")
             return
         
-        captain = await self.bot.fetch_user(int(ship['captain_id']))
+        captain = await user_resolver.get(self.bot, ship['captain_id'])
 
         embed = discord.Embed(title=f"The {ship['name']}", color=discord.Color.blue())
         embed.set_thumbnail(url="https://img.freepik.com/premium-vector/pirate-ship-vintage-illustration_1188798-270.jpg")
-        embed.add_field(name="Captain", value=captain.name, inline=True)
+        embed.add_field(name="Captain", value=captain.name if captain else "Unknown", inline=True)
         
         level = ship.get('level', 1)
         xp = ship.get('xp', 0)
@@ -249,6 +260,78 @@ class Ship(commands.Cog):
 
         await interaction.response.send_message(embed=embed)
 
+    @ship.command(name="posters", description="Get wanted posters for your whole crew.")
+    async def posters(self, interaction: discord.Interaction):
+        log.info(f"{interaction.user.name} used /ship posters")
+        player = get_user(str(interaction.user.id))
+        if not player.get('ship_id'):
+            await interaction.response.send_message("You are not in a crew.")
+            return
+
+        if player.get('role') not in ['captain', 'officer']:
+            await interaction.response.send_message("Only captains and officers can order crew posters.")
+            return
+
+        ship = get_ship(player['ship_id'])
+        last_posters = ship.get('posters_cooldown')
+        if last_posters and time.time() - last_posters < POSTERS_COOLDOWN:
+            remaining_time = time.strftime('%Mm %Ss', time.gmtime(POSTERS_COOLDOWN - (time.time() - last_posters)))
+            await interaction.response.send_message(f"Your crew's posters are still being printed. Try again in {remaining_time}.")
+            return
+
+        await interaction.response.defer()
+        progress = await interaction.followup.send(f"Gathering the crew of the {ship['name']}...", wait=True)
+        started = time.perf_counter()
+        members = get_users(ship['members'])
+        semaphore = asyncio.Semaphore(10)
+
+        async def load_member(member_id):
+            async with semaphore:
+                try:
+                    user = await user_resolver.get(self.bot, member_id)
+                    if user is None:
+                        return None
+                    avatar = await avatar_cache.get(user, avatar_pixels(SHEET_TILE_SCALE))
+                except discord.HTTPException as e:
+                    log.warning(f"Skipping crew member {member_id} on the poster sheet: {e}")
+                    return None
+                return avatar, user.name, members[member_id].get('bounty', 0)
+
+        loaded = await asyncio.gather(*(load_member(member_id) for member_id in ship['members'] if member_id in members))
+        crew = sorted((member for member in loaded if member is not None), key=lambda member: member[2], reverse=True)
+        if not crew:
+            await progress.edit(content="Couldn't find anyone to put on a poster.")
+            return
+
+        last_edit = 0.0
+
+        async def report(done, total):
+            nonlocal last_edit
+            if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL or done == total:
+                last_edit = time.monotonic()
+                await progress.edit(content=f"Printing wanted posters... {done}/{total}")
+
+        render_started = time.perf_counter()
+        try:
+            pages, cpu_seconds = await render_contact_sheets_async(crew, on_progress=report)
+        except Exception as e:
+            log.error(f"Failed to render crew posters for ship {ship['name']}: {e}", exc_info=True)
+            metrics.incr('ship_posters.error')
+            await progress.edit(content="The printing press jammed. Your crew's posters couldn't be printed, try again later.")
+            return
+        render_seconds = time.perf_counter() - render_started
+        set_posters_cooldown(ship['id'])
+
+        # Worker CPU time is what rendering the sheets one by one would have taken.
+        elapsed = time.perf_counter() - started
+        metrics.observe('ship_posters.seconds', elapsed)
+        metrics.observe('ship_posters.speedup', cpu_seconds / max(render_seconds, 0.001))
+        log.info(f"Rendered {len(crew)} posters for ship {ship['name']} in {render_seconds:.2f}s with {SHEET_WORKERS} workers ({cpu_seconds:.2f}s of render CPU), {elapsed:.2f}s total")
+
+        extension = EXTENSIONS.get(POSTER_FORMAT, 'png')
+        files = [discord.File(io.BytesIO(page), filename=f"crew_posters_{index}.{extension}") for index, page in enumerate(pages, start=1)]
+        await progress.edit(content=f"Wanted: the crew of the {ship['name']}! ({len(crew)} pirates)", attachments=files)
+
     async def check_ship_level_up(self, ship_id):
         ship_ref = db.collection('ships').document(str(ship_id))
         
@@ -275,11 +358,13 @@ class Ship(commands.Cog):
 
                 captain_id = ship_data['captain_id']
                 try:
-                    captain = await self.bot.fetch_user(int(captain_id))
+                    captain = await user_resolver.get(self.bot, captain_id)
                     if captain:
                         await captain.send(f"Your ship '{ship_data['name']}' has reached Level {new_level}!")
-                except discord.NotFound:
-                    log.warning(f"Could not find captain with ID {captain_id} to send level up notification.")
+                    else:
+                        log.warning(f"Could not find captain with ID {captain_id} to send level up notification.")
+                except discord.HTTPException as e:
+                    log.warning(f"Could not send level up notification to captain {captain_id}: {e}")
                 
                 # Continue loop to check for another level up
                 continue
@@ -416,7 +501,7 @@ class Ship(commands.Cog):
             await interaction.response.send_message(f"The captain of '{target_ship_name}' doesn't have enough berries for this wager.")
             return
 
-        target_captain_user = await self.bot.fetch_user(int(target_ship['captain_id']))
+        target_captain_user = await user_resolver.get(self.bot, target_ship['captain_id'])
         if not target_captain_user:
             await interaction.response.send_message("Could not find the captain of the target ship.")
             return
@@ -616,77 +701,27 @@ class ShipWarView(discord.ui.View):
             await interaction.followup.send(f"An error occurred while starting the war: {e}")
             return
 
-        message = await interaction.followup.send(f"The war has begun! {self.challenger_ship['name']} vs {self.target_ship['name']}!")
-
-        ship1_data = self.challenger_ship
-        ship2_data = self.target_ship
-
         items = db.collection('config').document('items').get().to_dict()
+        ships = (self.challenger_ship, self.target_ship)
+        warships = tuple(Warship.from_ship(ship, BadgeEffects.from_items(items, ship.get('equipped_badge'))) for ship in ships)
+        rng, seed = new_rng()
+        result = fight_ship_war(warships[0], warships[1], rng)
+        log.info(f"Ship war {ships[0]['id']} vs {ships[1]['id']} (seed {seed}): {len(result.rounds)} rounds, winner {ships[result.winner]['name']}")
 
-        for i in range(1, 6): # 5 rounds
-            await asyncio.sleep(5)
-
-            # Ship 1 attacks
-            cannons1 = ship1_data['upgrades']['cannon_lvl'] * 2
-            balls_to_use1 = min(ship1_data['storage'].get('cannonball_x10', 0) * 10, cannons1)
-            if balls_to_use1 == 0:
-                dmg1 = 0
-            else:
-                base_dmg1 = (cannons1 * 50) * (1 + ship1_data['level'] * 0.1)
-                defense2 = 1 - (ship2_data['upgrades']['hull_lvl'] * 0.05)
-                
-                badge_id2 = ship2_data.get('equipped_badge')
-                if badge_id2 and items.get(badge_id2, {}).get('effect', {}).get('type') == 'defense_boost':
-                    defense2 -= items[badge_id2]['effect']['value']
-
-                dmg1 = math.floor(base_dmg1 * defense2)
-            
-            ship2_data['hp'] -= dmg1
-            ship1_data['storage']['cannonball_x10'] = ship1_data['storage'].get('cannonball_x10', 0) - math.ceil(balls_to_use1 / 10)
-
-
-            # Ship 2 attacks
-            cannons2 = ship2_data['upgrades']['cannon_lvl'] * 2
-            balls_to_use2 = min(ship2_data['storage'].get('cannonball_x10', 0) * 10, cannons2)
-            if balls_to_use2 == 0:
-                dmg2 = 0
-            else:
-                base_dmg2 = (cannons2 * 50) * (1 + ship2_data['level'] * 0.1)
-                defense1 = 1 - (ship1_data['upgrades']['hull_lvl'] * 0.05)
-
-                badge_id1 = ship1_data.get('equipped_badge')
-                if badge_id1 and items.get(badge_id1, {}).get('effect', {}).get('type') == 'defense_boost':
-                    defense1 -= items[badge_id1]['effect']['value']
-
-                dmg2 = math.floor(base_dmg2 * defense1)
-
-            ship1_data['hp'] -= dmg2
-            ship2_data['storage']['cannonball_x10'] = ship2_data['storage'].get('cannonball_x10', 0) - math.ceil(balls_to_use2 / 10)
-
-            await message.edit(content=f"**Round {i}**!\n{ship1_data['name']} fires for {dmg1}! {ship2_data['name']} fires for {dmg2}!\n> {ship1_data['name']} HP: {ship1_data['hp']}/{ship1_data['stats']['max_hp']}\n> {ship2_data['name']} HP: {ship2_data['hp']}/{ship2_data['stats']['max_hp']}")
+        message = await interaction.followup.send(f"The war has begun! {ships[0]['name']} vs {ships[1]['name']}!")
 
-            if ship1_data['hp'] <= 0 or ship2_data['hp'] <= 0:
-                break
-
-        if ship1_data['hp'] > ship2_data['hp']:
-            winner_ship = ship1_data
-            loser_ship = ship2_data
-        else:
-            winner_ship = ship2_data
-            loser_ship = ship1_data
+        for war_round in result.rounds:
+            await asyncio.sleep(5)
+            await message.edit(content=f"**Round {war_round.number}**!\n{warships[0].name} fires for {war_round.damage[0]}! {warships[1].name} fires for {war_round.damage[1]}!\n> {warships[0].name} HP: {war_round.hp[0]}/{warships[0].max_hp}\n> {warships[1].name} HP: {war_round.hp[1]}/{warships[1].max_hp}")
 
-        loser_item_loss = random.random() < 0.3
-        
-        xp_gain = 5000
-        badge_id = winner_ship.get('equipped_badge')
-        if badge_id and items.get(badge_id, {}).get('effect', {}).get('type') == 'xp_boost':
-            xp_gain = int(xp_gain * (1 + items[badge_id]['effect']['value']))
+        winner_ship = ships[result.winner]
+        loser_ship = ships[1 - result.winner]
 
-        resolve_ship_war(winner_ship['captain_id'], winner_ship['id'], loser_ship['id'], self.wager, xp_gain, loser_item_loss)
+        resolve_ship_war(winner_ship['captain_id'], winner_ship['id'], loser_ship['id'], self.wager, result.xp_gain, result.item_loss, result.degrade)
 
         # Update ship documents with new hp and storage
-        db.collection('ships').document(ship1_data['id']).update({'hp': ship1_data['hp'], 'storage': ship1_data['storage']})
-        db.collection('ships').document(ship2_data['id']).update({'hp': ship2_data['hp'], 'storage': ship2_data['storage']})
+        for ship, hp, crates in zip(ships, result.hp, result.crates):
+            db.collection('ships').document(ship['id']).update({'hp': hp, 'storage': {**ship.get('storage', {}), 'cannonball_x10': crates}})
 
         await self.bot.get_cog('Ship').check_ship_level_up(winner_ship['id'])
 
@@ -0,0 +1,193 @@
+import math
+import random
+
+# Duels and ship wars as pure functions: stats and a seeded RNG in, a round-by-round log
+# out. Nothing here touches Discord or Firestore, so the views only play the log back.
+DUEL_MIN_DAMAGE = 10
+DUEL_MAX_DAMAGE = 20
+DUEL_SHIP_XP = 500
+WAR_ROUNDS = 5
+WAR_SHIP_XP = 5000
+CANNONS_PER_LEVEL = 2
+DAMAGE_PER_CANNON = 50
+LEVEL_DAMAGE_BONUS = 0.1
+HULL_DEFENSE_PER_LEVEL = 0.05
+BALLS_PER_CRATE = 10
+ITEM_LOSS_CHANCE = 0.3
+DEGRADE_CHANCE = 0.2
+DEGRADE_TYPES = ('hull_lvl', 'cannon_lvl')
+
+class BadgeEffects:
+    """
+    A badge's effects as plain numbers, looked up once per fight.
+    """
+    __slots__ = ('defense_boost', 'xp_boost')
+
+    def __init__(self, defense_boost=0.0, xp_boost=0.0):
+        self.defense_boost = defense_boost
+        self.xp_boost = xp_boost
+
+    @classmethod
+    def from_items(cls, items, badge_id):
+        effect = (items.get(badge_id) or {}).get('effect', {}) if badge_id else {}
+        value = effect.get('value', 0.0)
+        return cls(
+            defense_boost=value if effect.get('type') == 'defense_boost' else 0.0,
+            xp_boost=value if effect.get('type') == 'xp_boost' else 0.0,
+        )
+
+def ship_xp(base, badge):
+    return int(base * (1 + badge.xp_boost)) if badge.xp_boost else base
+
+class Duelist:
+    __slots__ = ('name', 'hp', 'max_hp')
+
+    def __init__(self, name, hp, max_hp):
+        self.name = name
+        self.hp = hp
+        self.max_hp = max_hp
+
+    @classmethod
+    def from_player(cls, name, player):
+        return cls(name, player.get('hp', 100), player.get('max_hp', 100))
+
+class DuelRound:
+    __slots__ = ('attacker', 'defender', 'damage', 'defender_hp')
+
+    def __init__(self, attacker, defender, damage, defender_hp):
+        self.attacker = attacker
+        self.defender = defender
+        self.damage = damage
+        self.defender_hp = defender_hp
+
+class DuelResult:
+    __slots__ = ('rounds', 'winner', 'hp')
+
+    def __init__(self, rounds, winner, hp):
+        self.rounds = rounds
+        self.winner = winner  # 0 for the challenger, 1 for the opponent
+        self.hp = hp
+
+def fight_duel(challenger, opponent, rng):
+    """
+    The challenger and opponent trade blows of 10-20 damage, challenger first, until one
+    drops to 0 HP. Each round in the log is one blow.
+    """
+    hp = [challenger.hp, opponent.hp]
+    rounds = []
+    attacker = 0
+    while hp[0] > 0 and hp[1] > 0:
+        defender = 1 - attacker
+        damage = rng.randint(DUEL_MIN_DAMAGE, DUEL_MAX_DAMAGE)
+        hp[defender] -= damage
+        rounds.append(DuelRound(attacker, defender, damage, hp[defender]))
+        attacker = defender
+    return DuelResult(rounds, 0 if hp[0] > hp[1] else 1, hp)
+
+class Warship:
+    """
+    A ship's war stats with its damage and defense multipliers worked out up front.
+    """
+    __slots__ = ('name', 'hp', 'max_hp', 'cannons', 'crates', 'damage', 'defense', 'badge')
+
+    def __init__(self, name, hp, max_hp, cannons, crates, damage, defense, badge):
+        self.name = name
+        self.hp = hp
+        self.max_hp = max_hp
+        self.cannons = cannons
+        self.crates = crates
+        self.damage = damage
+        self.defense = defense
+        self.badge = badge
+
+    @classmethod
+    def from_ship(cls, ship, badge):
+        upgrades = ship.get('upgrades', {})
+        cannons = upgrades.get('cannon_lvl', 1) * CANNONS_PER_LEVEL
+        return cls(
+            name=ship['name'],
+            hp=ship.get('hp', 0),
+            max_hp=ship.get('stats', {}).get('max_hp', 2000),
+            cannons=cannons,
+            crates=ship.get('storage', {}).get('cannonball_x10', 0),
+            damage=cannons * DAMAGE_PER_CANNON * (1 + ship.get('level', 1) * LEVEL_DAMAGE_BONUS),
+            defense=1 - upgrades.get('hull_lvl', 1) * HULL_DEFENSE_PER_LEVEL - badge.defense_boost,
+            badge=badge,
+        )
+
+class WarRound:
+    __slots__ = ('number', 'damage', 'hp')
+
+    def __init__(self, number, damage, hp):
+        self.number = number
+        self.damage = damage  # (dealt by ship 1, dealt by ship 2)
+        self.hp = hp
+
+class WarResult:
+    __slots__ = ('rounds', 'winner', 'hp', 'crates', 'xp_gain', 'item_loss', 'degrade')
+
+    def __init__(self, rounds, winner, hp, crates, xp_gain, item_loss, degrade):
+        self.rounds = rounds
+        self.winner = winner  # 0 for ship 1 (the challenger), 1 for ship 2
+        self.hp = hp
+        self.crates = crates
+        self.xp_gain = xp_gain
+        self.item_loss = item_loss
+        self.degrade = degrade  # upgrade the loser loses a level of, or None
+
+def _broadside(attacker, crates, defender):
+    balls = min(crates * BALLS_PER_CRATE, attacker.cannons)
+    damage = math.floor(attacker.damage * defender.defense) if balls else 0
+    return damage, crates - math.ceil(balls / BALLS_PER_CRATE)
+
+def fight_ship_war(ship1, ship2, rng, rounds=WAR_ROUNDS):
+    """
+    Up to `rounds` rounds in which both ships fire at once, each using up to one
+    cannonball per cannon, until one is sunk. Also rolls the spoils: the winner's
+    ship XP, whether the loser loses cargo and which upgrade it may lose a level of.
+    """
+    ships = (ship1, ship2)
+    hp = [ship1.hp, ship2.hp]
+    crates = [ship1.crates, ship2.crates]
+    log = []
+    for number in range(1, rounds + 1):
+        damage1, crates[0] = _broadside(ship1, crates[0], ship2)
+        damage2, crates[1] = _broadside(ship2, crates[1], ship1)
+        hp[1] -= damage1
+        hp[0] -= damage2
+        log.append(WarRound(number, (damage1, damage2), tuple(hp)))
+        if hp[0] <= 0 or hp[1] <= 0:
+            break
+
+    winner = 0 if hp[0] > hp[1] else 1
+    item_loss = rng.random() < ITEM_LOSS_CHANCE
+    degrade = rng.choice(DEGRADE_TYPES) if rng.random() < DEGRADE_CHANCE else None
+    return WarResult(log, winner, hp, crates, ship_xp(WAR_SHIP_XP, ships[winner].badge), item_loss, degrade)
+
+def new_rng(seed=None):
+    """
+    Returns (rng, seed). Log the seed to replay a fight exactly.
+    """
+    if seed is None:
+        seed = random.getrandbits(32)
+    return random.Random(seed), seed
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description="Time the combat engine.")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng, _ = new_rng(1)
+    started = time.perf_counter()
+    for _ in range(args.count):
+        fight_duel(Duelist("A", 100, 100), Duelist("B", 100, 100), rng)
+    print(f"duel: {(time.perf_counter() - started) / args.count * 1e6:.1f} us per fight")
+
+    ship = {'name': "S", 'hp': 2000, 'stats': {'max_hp': 2000}, 'level': 3, 'upgrades': {'hull_lvl': 2, 'cannon_lvl': 3}, 'storage': {'cannonball_x10': 5}}
+    badge = BadgeEffects(defense_boost=0.02, xp_boost=0.05)
+    started = time.perf_counter()
+    for _ in range(args.count):
+        fight_ship_war(Warship.from_ship(ship, badge), Warship.from_ship(ship, BadgeEffects()), rng)
+    print(f"ship war: {(time.perf_counter() - started) / args.count * 1e6:.1f} us per fight, stats included")
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import random
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Offline stand-in for google.generativeai, enabled with LUFFY_FAKE_GEMINI=on.
+# Only the parts of the SDK the bot uses are implemented: configure(), GenerativeModel,
+# generate_content_async() and start_chat().send_message_async(), both with stream=True.
+FAKE_LATENCY_MS = os.getenv("FAKE_GEMINI_LATENCY_MS", "lognormal:900:0.4")
+FAKE_LITE_LATENCY_MS = os.getenv("FAKE_GEMINI_LITE_LATENCY_MS", "lognormal:300:0.3")
+FAKE_CHUNK_MS = os.getenv("FAKE_GEMINI_CHUNK_MS", "uniform:30:120")
+FAKE_ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", 0.0))
+FAKE_HANG_RATE = float(os.getenv("FAKE_GEMINI_HANG_RATE", 0.0))
+FAKE_YES_RATE = float(os.getenv("FAKE_GEMINI_YES_RATE", 0.3))
+FAKE_RESPONSES_PATH = os.getenv("FAKE_GEMINI_RESPONSES")
+FAKE_SEED = os.getenv("FAKE_GEMINI_SEED")
+HANG_SECONDS = 300
+
+DEFAULT_RESPONSES = {
+    "chat": [
+        "Shishishi! {name}, that sounds like an adventure!",
+        "Oi {name}, is there meat involved? I'm starving!",
+        "{topic}? Whoa, I wanna see that! Let's go!",
+        "Huh? I don't get it, but you're my nakama, {name}!",
+        "Zoro got lost again... anyway, {topic} sounds SUPER fun!",
+        "We've talked {turn} times now, {name}! You're basically crew!",
+    ],
+    "narration": [
+        "We smashed through everything and grabbed the loot! Shishishi!",
+        "Nami's gonna yell at me, but that was awesome!",
+        "Whoa, that was close! Somebody get me some meat!",
+    ],
+    "summary": [
+        "User {name} chats about {topic}. Friendly nakama, likes adventures.",
+    ],
+}
+
+_rng = random.Random(int(FAKE_SEED)) if FAKE_SEED else random.Random()
+_responses = DEFAULT_RESPONSES
+
+class FakeGeminiError(Exception):
+    """
+    Raised for injected failures, standing in for a 5xx from the API.
+    """
+
+def parse_distribution(spec):
+    """
+    Turns 'fixed:300', 'uniform:100:500', 'normal:400:80' or 'lognormal:<median>:<sigma>'
+    into a function returning a delay in seconds.
+    """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: _rng.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, _rng.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        return lambda: values[0] * _rng.lognormvariate(0, values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+_latency = parse_distribution(FAKE_LATENCY_MS)
+_lite_latency = parse_distribution(FAKE_LITE_LATENCY_MS)
+_chunk_delay = parse_distribution(FAKE_CHUNK_MS)
+
+def configure(api_key=None, **kwargs):
+    """
+    Mirrors genai.configure(). Loads custom response templates if configured.
+    """
+    global _responses
+    if FAKE_RESPONSES_PATH:
+        with open(FAKE_RESPONSES_PATH) as f:
+            _responses = {**DEFAULT_RESPONSES, **json.load(f)}
+    log.warning("Using the fake Gemini provider; no requests will reach the API.")
+
+class Part:
+    def __init__(self, text):
+        self.text = text
+
+class Content:
+    def __init__(self, role, parts):
+        self.role = role
+        self.parts = [part if isinstance(part, Part) else Part(part) for part in parts]
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+def _count_tokens(text):
+    return len(text) // 4 + 1
+
+def _fill(template, prompt, history_len):
+    lines = [line for line in prompt.strip().split("\n") if line.strip()]
+    last_line = lines[-1] if lines else ""
+    name, _, said = last_line.rpartition(": ")
+    words = [word.strip(".,!?") for word in said.split() if len(word) > 3]
+    return template.format(
+        name=name.split()[-1] if name else "nakama",
+        topic=_rng.choice(words).capitalize() if words else "That",
+        turn=history_len // 2 + 1,
+    )
+
+def _judge_reply(prompt):
+    match = re.search(r"exactly (\d+) lines", prompt)
+    if match is None:
+        return "YES" if _rng.random() < FAKE_YES_RATE else "NO"
+    return "\n".join(f"{i}: {'YES' if _rng.random() < FAKE_YES_RATE else 'NO'}" for i in range(1, int(match.group(1)) + 1))
+
+def _reply_for(prompt, history_len=0):
+    if "YES or NO" in prompt or "'<number>: YES'" in prompt:
+        return _judge_reply(prompt)
+    if "keep notes for Luffy" in prompt:
+        kind = "summary"
+    elif history_len or prompt.startswith(("Conversation Context", "What you remember")):
+        kind = "chat"
+    else:
+        kind = "narration"
+    return _fill(_rng.choice(_responses[kind]), prompt, history_len)
+
+def _split_chunks(text):
+    words = text.split(" ")
+    return [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+
+async def _simulate_call(latency):
+    # Errors arrive after some latency, hangs never return on their own.
+    roll = _rng.random()
+    if roll < FAKE_HANG_RATE:
+        await asyncio.sleep(HANG_SECONDS)
+    await asyncio.sleep(latency())
+    if roll < FAKE_HANG_RATE + FAKE_ERROR_RATE:
+        raise FakeGeminiError("503 injected by the fake Gemini provider")
+
+class GenerateContentResponse:
+    """
+    A finished (or, with stream=True, progressively delivered) fake response.
+    """
+    def __init__(self, text, prompt_tokens, stream=False, on_done=None):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt_tokens, _count_tokens(text))
+        self.candidates = [Content("model", [text])]
+        self._stream = stream
+        self._on_done = on_done
+        self._fail_mid_stream = stream and _rng.random() < FAKE_ERROR_RATE / 2
+
+    async def __aiter__(self):
+        if not self._stream:
+            yield self
+            return
+        chunks = _split_chunks(self.text)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(_chunk_delay())
+            if self._fail_mid_stream and index == len(chunks) // 2:
+                raise FakeGeminiError("stream reset injected by the fake Gemini provider")
+            yield Part(chunk)
+        if self._on_done is not None:
+            self._on_done()
+
+class GenerativeModel:
+    def __init__(self, model_name="gemini-2.0-flash-lite", generation_config=None, system_instruction=None, safety_settings=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ""
+        self._latency = _lite_latency if "lite" in model_name else _latency
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        await _simulate_call(self._latency)
+        prompt_tokens = _count_tokens(self.system_instruction) + _count_tokens(prompt)
+        return GenerateContentResponse(_reply_for(prompt), prompt_tokens, stream=stream)
+
+    def start_chat(self, history=None):
+        return ChatSession(self, history or [])
+
+class ChatSession:
+    """
+    Keeps history like the real ChatSession: a turn is only appended once the reply
+    is complete, so a failed or half-read stream leaves the history untouched.
+    """
+    def __init__(self, model, history):
+        self.model = model
+        self.history = [item if isinstance(item, Content) else Content(item['role'], item['parts']) for item in history]
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        await _simulate_call(self.model._latency)
+        prompt_tokens = (_count_tokens(self.model.system_instruction) + _count_tokens(content)
+                         + sum(_count_tokens(part.text) for item in self.history for part in item.parts))
+        text = _reply_for(content, len(self.history))
+        sent = Content("user", [content])
+
+        def record():
+            self.history.extend([sent, Content("model", [text])])
+
+        if stream:
+            return GenerateContentResponse(text, prompt_tokens, stream=True, on_done=record)
+        record()
+        return GenerateContentResponse(text, prompt_tokens)
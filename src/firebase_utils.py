@@ -1,6 +1,9 @@
 import time
+import math
 import firebase_admin
 from firebase_admin import credentials, firestore
+from src.rank_index import index as rank_index
+from src import metrics
 
 cred = credentials.Certificate("firebase_key.json")
 firebase_admin.initialize_app(cred)
@@ -34,7 +37,8 @@ def get_user(user_id):
             "last_recruit_timestamp": None,
             "last_private_adventure_timestamp": None,
             "last_auction_claim_timestamp": None,
-            "last_wanted_poster_timestamp": None
+            "last_wanted_poster_timestamp": None,
+            "guilds": []
         })
         user = user_ref.get()
     return user.to_dict()
@@ -56,6 +60,16 @@ def update_bounty(user_id, amount):
     user_ref.update({
         'bounty': firestore.Increment(amount)
     })
+    rank_index.add(user_id, amount)
+
+def add_user_guild(user_id, guild_id):
+    """
+    Records that a user is active in a guild, for per-server leaderboards.
+    """
+    user_ref = db.collection('pirates').document(str(user_id))
+    user_ref.update({
+        'guilds': firestore.ArrayUnion([str(guild_id)])
+    })
 
 def update_spam_warnings(user_id, amount):
     """
@@ -362,8 +376,19 @@ def set_war_cooldown(ship1_id, ship2_id):
     ship1_ref.update({'war_cooldown': cooldown_time})
     ship2_ref.update({'war_cooldown': cooldown_time})
 
+def set_posters_cooldown(ship_id):
+    ship_ref = db.collection('ships').document(str(ship_id))
+    ship_ref.update({'posters_cooldown': time.time()})
+
+def get_users(user_ids):
+    """
+    Retrieves several users in one batched read. Users without a profile are skipped.
+    """
+    user_refs = [db.collection('pirates').document(str(user_id)) for user_id in user_ids]
+    return {snapshot.id: snapshot.to_dict() for snapshot in db.get_all(user_refs) if snapshot.exists}
+
 @firestore.transactional
-def _resolve_ship_war_transaction(transaction, winner_captain_ref, winner_ship_ref, loser_ship_ref, wager, winner_xp_gain, loser_item_loss):
+def _resolve_ship_war_transaction(transaction, winner_captain_ref, winner_ship_ref, loser_ship_ref, wager, winner_xp_gain, loser_item_loss, degrade_type):
     transaction.update(winner_captain_ref, {
         'berries': firestore.Increment(wager * 2)
     })
@@ -381,25 +406,23 @@ def _resolve_ship_war_transaction(transaction, winner_captain_ref, winner_ship_r
                 f'storage.{item_to_remove}': firestore.Increment(-amount_to_remove)
             })
 
-    # Chance for equipment degradation
-    if random.random() < 0.2: # 20% chance to degrade equipment
+    # Equipment degradation, rolled by the combat engine
+    if degrade_type:
         loser_ship_snapshot = loser_ship_ref.get(transaction=transaction)
         loser_ship_data = loser_ship_snapshot.to_dict()
         upgrades = loser_ship_data.get('upgrades', {})
-
-        degrade_type = random.choice(['hull_lvl', 'cannon_lvl'])
         current_level = upgrades.get(degrade_type, 1)
 
         if current_level > 1:
             new_level = current_level - 1
             transaction.update(loser_ship_ref, {f'upgrades.{degrade_type}': new_level})
 
-def resolve_ship_war(winner_captain_id, winner_ship_id, loser_ship_id, wager, winner_xp_gain, loser_item_loss):
+def resolve_ship_war(winner_captain_id, winner_ship_id, loser_ship_id, wager, winner_xp_gain, loser_item_loss, degrade_type=None):
     winner_captain_ref = db.collection('pirates').document(str(winner_captain_id))
     winner_ship_ref = db.collection('ships').document(str(winner_ship_id))
     loser_ship_ref = db.collection('ships').document(str(loser_ship_id))
     transaction = db.transaction()
-    _resolve_ship_war_transaction(transaction, winner_captain_ref, winner_ship_ref, loser_ship_ref, wager, winner_xp_gain, loser_item_loss)
+    _resolve_ship_war_transaction(transaction, winner_captain_ref, winner_ship_ref, loser_ship_ref, wager, winner_xp_gain, loser_item_loss, degrade_type)
 
 @firestore.transactional
 def _repair_ship_transaction(transaction, ship_ref, tools_needed, hp_to_heal):
@@ -447,6 +470,7 @@ def _create_auction_transaction(transaction, user_ref, item_type, item_id, item_
         "starting_bid": starting_bid,
         "current_bid": starting_bid,
         "highest_bidder_id": None,
+        "created_at": time.time(),
         "end_time": time.time() + 86400 # 24 hours
     })
     return auction_ref.id
@@ -458,6 +482,8 @@ def create_auction(seller_id, item_type, item_id, item_name, quantity, seller_na
 
 @firestore.transactional
 def _bid_on_auction_transaction(transaction, bidder_ref, auction_ref, bid_amount):
+    # Runs once per attempt; attempts beyond commits are contention retries.
+    metrics.incr('auction_bid.attempts')
     auction_snapshot = auction_ref.get(transaction=transaction)
     auction_data = auction_snapshot.to_dict()
 
@@ -493,44 +519,82 @@ def bid_on_auction(bidder_id, auction_id, bid_amount):
     auction_ref = db.collection('auctions').document(str(auction_id))
     transaction = db.transaction()
     _bid_on_auction_transaction(transaction, bidder_ref, auction_ref, bid_amount)
+    metrics.incr('auction_bid.commits')
 
-@firestore.transactional
-def _claim_sold_auction_transaction(transaction, seller_ref, auction_ref):
-    auction_snapshot = auction_ref.get(transaction=transaction)
-    auction_data = auction_snapshot.to_dict()
-
-    payout = math.floor(auction_data['current_bid'] * 0.95)
-    transaction.update(seller_ref, {'berries': firestore.Increment(payout)})
-    transaction.delete(auction_ref)
-    return payout
-
-def claim_sold_auction(seller_id, auction_id):
-    seller_ref = db.collection('pirates').document(str(seller_id))
-    auction_ref = db.collection('auctions').document(str(auction_id))
-    transaction = db.transaction()
-    return _claim_sold_auction_transaction(transaction, seller_ref, auction_ref)
+AUCTION_TAX = 0.05
 
 @firestore.transactional
-def _claim_won_auction_transaction(transaction, winner_ref, auction_ref):
-    auction_snapshot = auction_ref.get(transaction=transaction)
-    auction_data = auction_snapshot.to_dict()
-
-    item_type = auction_data['item_type']
-    item_id = auction_data['item_id']
-    quantity = auction_data['quantity']
-
-    if item_type == 'item':
-        transaction.update(winner_ref, {f'bag.{item_id}': firestore.Increment(quantity)})
-    elif item_type == 'crew':
-        transaction.update(winner_ref, {'crew': firestore.ArrayUnion([item_id])})
-        
-    transaction.delete(auction_ref)
-
-def claim_won_auction(winner_id, auction_id):
-    winner_ref = db.collection('pirates').document(str(winner_id))
-    auction_ref = db.collection('auctions').document(str(auction_id))
+def _settle_auctions_transaction(transaction, auction_refs, now):
+    # Changes are merged per pirate so each document is written once.
+    pirate_updates = {}
+    def pirate_update(user_id):
+        return pirate_updates.setdefault(str(user_id), {})
+
+    def deliver(user_id, auction_data):
+        update = pirate_update(user_id)
+        if auction_data['item_type'] == 'item':
+            field = f"bag.{auction_data['item_id']}"
+            update[field] = update.get(field, 0) + auction_data['quantity']
+        elif auction_data['item_type'] == 'crew':
+            update.setdefault('crew', []).append(auction_data['item_id'])
+
+    ended = []
+    for auction_snapshot in db.get_all(auction_refs, transaction=transaction):
+        if auction_snapshot.exists and auction_snapshot.to_dict()['end_time'] <= now:
+            ended.append(auction_snapshot)
+
+    # Every pirate involved must exist, or updating them would fail the whole batch.
+    pirate_ids = set()
+    for auction_snapshot in ended:
+        auction_data = auction_snapshot.to_dict()
+        pirate_ids.add(str(auction_data['seller_id']))
+        if auction_data.get('highest_bidder_id'):
+            pirate_ids.add(str(auction_data['highest_bidder_id']))
+    pirate_refs = [db.collection('pirates').document(user_id) for user_id in pirate_ids]
+    existing = {snapshot.id for snapshot in db.get_all(pirate_refs, transaction=transaction) if snapshot.exists}
+
+    settled = []
+    skipped = []
+    for auction_snapshot in ended:
+        auction_data = auction_snapshot.to_dict()
+        missing = [str(user_id) for user_id in (auction_data['seller_id'], auction_data.get('highest_bidder_id')) if user_id and str(user_id) not in existing]
+        if missing:
+            skipped.append(auction_snapshot.id)
+            continue
+
+        if auction_data.get('highest_bidder_id'):
+            payout = math.floor(auction_data['current_bid'] * (1 - AUCTION_TAX))
+            update = pirate_update(auction_data['seller_id'])
+            update['berries'] = update.get('berries', 0) + payout
+            deliver(auction_data['highest_bidder_id'], auction_data)
+        else:
+            # Nobody bid: the seller gets the item back and nothing is paid out.
+            payout = 0
+            deliver(auction_data['seller_id'], auction_data)
+        transaction.delete(auction_snapshot.reference)
+        settled.append(dict(auction_data, id=auction_snapshot.id, payout=payout))
+
+    for user_id, update in pirate_updates.items():
+        fields = {}
+        for field, value in update.items():
+            if field == 'crew':
+                fields['crew'] = firestore.ArrayUnion(value)
+            else:
+                fields[field] = firestore.Increment(value)
+        transaction.update(db.collection('pirates').document(user_id), fields)
+    return settled, skipped
+
+def settle_auctions(auction_ids):
+    """
+    Settles ended auctions in one transaction: the seller is paid the winning bid less
+    tax and the winner receives the item, or the seller gets an unsold item back.
+    Auctions that are gone or haven't ended are skipped. Returns the settled auctions,
+    each with its `id` and `payout`, and the IDs of ended auctions that can't be
+    settled because the seller's or winner's pirate document is missing.
+    """
+    auction_refs = [db.collection('auctions').document(str(auction_id)) for auction_id in auction_ids]
     transaction = db.transaction()
-    _claim_won_auction_transaction(transaction, winner_ref, auction_ref)
+    return _settle_auctions_transaction(transaction, auction_refs, time.time())
 
 @firestore.transactional
 def _grant_chat_reward_transaction(transaction, user_ref, berry_reward, xp_reward):
@@ -1,11 +1,41 @@
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# LUFFY_FAKE_GEMINI swaps in an offline provider with the same interface for load testing.
+if os.getenv("LUFFY_FAKE_GEMINI", "off").lower() in ("1", "true", "on"):
+    from src import fake_gemini as genai
+else:
+    import google.generativeai as genai
+
+from src import metrics
+from src.circuit_breaker import CircuitBreaker
+from src.llm_scheduler import scheduler, LLMShedError, PRIORITY_COMMAND, PRIORITY_MENTION, PRIORITY_INTRUSION, PRIORITY_JUDGE
+
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+# Every Gemini call shares one breaker and gets a deadline, so an upstream incident
+# turns into instant canned fallbacks instead of a pile of waiting coroutines.
+NARRATION_TIMEOUT = float(os.getenv("GEMINI_NARRATION_TIMEOUT", 8))
+JUDGE_TIMEOUT = float(os.getenv("GEMINI_JUDGE_TIMEOUT", 6))
+CHAT_TIMEOUT = float(os.getenv("GEMINI_CHAT_TIMEOUT", 15))
+
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    window_seconds=60,
+    min_calls=int(os.getenv("GEMINI_BREAKER_MIN_CALLS", 10)),
+    error_rate=float(os.getenv("GEMINI_BREAKER_ERROR_RATE", 0.5)),
+    open_seconds=float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", 30))
+)
+
+async def _call_gemini(fn, *args, priority, guild_id=None, timeout=None, **kwargs):
+    """
+    Runs one Gemini request through the LLM scheduler and the circuit breaker.
+    """
+    await scheduler.acquire(priority, guild_id)
+    return await gemini_breaker.call(fn, *args, timeout=timeout, **kwargs)
+
 LUFFY_SYSTEM_PROMPT = """
 You are Monkey D. Luffy, captain of the Straw Hat Pirates and future King of the Pirates.
 
@@ -64,103 +94,280 @@ safety_settings = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
-async def get_recruit_description(character_name):
+async def get_recruit_description(character_name, guild_id=None):
     """
     Generates an excited or confused reaction from Luffy about recruiting a character.
     """
     recruit_model = genai.GenerativeModel('gemini-2.0-flash-lite')
     prompt = f"You are Luffy. A new crewmate, {character_name}, just joined. Give your immediate, one-sentence reaction. Be excited or confused depending on who it is. No extra narration."
     try:
-        response = await recruit_model.generate_content_async(prompt)
+        response = await _call_gemini(recruit_model.generate_content_async, prompt, priority=PRIORITY_COMMAND, guild_id=guild_id, timeout=NARRATION_TIMEOUT)
         return response.text
     except Exception as e:
-        print(f"Error calling Recruit API: {e}")
+        print(f"Error calling Recruit API: {e!r}")
+        metrics.incr('gemini.fallback')
         return f"Whoa, we got {character_name}! Are they strong? Shishishi!"
 
-async def get_adventure_description(scenario, success):
+async def get_adventure_description(scenario, success, guild_id=None):
     """
     Generates a chaotic, in-character description of an adventure's outcome.
     """
     adventure_model = genai.GenerativeModel('gemini-2.0-flash-lite')
     prompt = f"Describe this One Piece adventure result in 1 short sentence as Luffy. Be chaotic. Example: 'We beat up the Marines and stole their lunch! Shishishi!'.\n\nScenario: {scenario}\nResult: {'Win' if success else 'Loss'}"
     try:
-        response = await adventure_model.generate_content_async(prompt)
+        response = await _call_gemini(adventure_model.generate_content_async, prompt, priority=PRIORITY_COMMAND, guild_id=guild_id, timeout=NARRATION_TIMEOUT)
         return response.text
     except Exception as e:
-        print(f"Error calling Adventure API: {e}")
+        print(f"Error calling Adventure API: {e!r}")
+        metrics.incr('gemini.fallback')
         return "I'm not sure what happened, but it was an adventure! Shishishi!"
 
-async def get_private_adventure_description(scenario, success):
+async def get_private_adventure_description(scenario, success, guild_id=None):
     """
     Generates a more unique and rewarding chaotic, in-character description of a private adventure's outcome.
     """
     private_adventure_model = genai.GenerativeModel('gemini-2.0-flash-lite')
     prompt = f"Describe this special One Piece private adventure result in 2-3 short, excited sentences as Luffy. Make it sound more epic and rewarding than a regular adventure. Example: 'WHOA! We found a giant treasure chest full of meat and berries! Shishishi! Best adventure EVER!'.\n\nScenario: {scenario}\nResult: {'Win' if success else 'Loss'}"
     try:
-        response = await private_adventure_model.generate_content_async(prompt)
+        response = await _call_gemini(private_adventure_model.generate_content_async, prompt, priority=PRIORITY_COMMAND, guild_id=guild_id, timeout=NARRATION_TIMEOUT)
         return response.text
     except Exception as e:
-        print(f"Error calling Private Adventure API: {e}")
+        print(f"Error calling Private Adventure API: {e!r}")
+        metrics.incr('gemini.fallback')
         return "This private adventure was SUPER! Shishishi!"
 
 import time
 import pickle
-from src.firebase_utils import db
+import random
+import re
+import logging
+import asyncio
+from src import chat_sessions, interest_classifier
+from src.judge_batcher import JudgeBatcher
+
+log = logging.getLogger(__name__)
+
+# History compaction: older turns are folded into a running summary stored beside the
+# session, only the last few turns stay verbatim, and the prompt is kept within budget.
+HISTORY_COMPACTION = os.getenv("LUFFY_HISTORY_COMPACTION", "off").lower() in ("1", "true", "on")
+VERBATIM_TURNS = int(os.getenv("LUFFY_VERBATIM_TURNS", 6))
+COMPACT_EVERY = 4
+PROMPT_TOKEN_BUDGET = int(os.getenv("LUFFY_PROMPT_TOKEN_BUDGET", 1500))
+
+# Fraction of locally-decided judge calls that are still sent to the LLM to measure agreement.
+JUDGE_AUDIT_RATE = float(os.getenv("JUDGE_AUDIT_RATE", 0.05))
 
 model = genai.GenerativeModel(model_name="gemini-2.5-flash",
                               generation_config=generation_config,
                               system_instruction=LUFFY_SYSTEM_PROMPT,
                               safety_settings=safety_settings)
 
-async def is_interesting_to_luffy(message_buffer):
+JUDGE_VERDICT_RE = re.compile(r"^\W*(?:conversation\s*)?(\d+)\W+(YES|NO)\b", re.IGNORECASE | re.MULTILINE)
+
+async def _judge_conversations(message_buffers):
     """
-    Uses a low-cost model to check if a conversation is interesting to Luffy.
+    Asks the low-cost model for a verdict on each buffer in one request.
     """
     judge_model = genai.GenerativeModel('gemini-2.0-flash-lite')
-    prompt = "Is this conversation interesting to Luffy (food, adventure, one piece, treasure, etc)? Reply YES or NO.\n\n" + "\n".join(message_buffer)
+    if len(message_buffers) == 1:
+        prompt = "Is this conversation interesting to Luffy (food, adventure, one piece, treasure, etc)? Reply YES or NO.\n\n" + "\n".join(message_buffers[0])
+        response = await _call_gemini(judge_model.generate_content_async, prompt, priority=PRIORITY_JUDGE, timeout=JUDGE_TIMEOUT)
+        return ["YES" in response.text.upper()]
+
+    conversations = "\n\n".join(f"### Conversation {i}\n" + "\n".join(buffer) for i, buffer in enumerate(message_buffers, start=1))
+    prompt = (
+        "For each numbered conversation below, decide if it is interesting to Luffy (food, adventure, one piece, treasure, etc). "
+        f"Reply with exactly {len(message_buffers)} lines in the form '<number>: YES' or '<number>: NO' and nothing else.\n\n" + conversations
+    )
+    response = await _call_gemini(judge_model.generate_content_async, prompt, priority=PRIORITY_JUDGE, timeout=JUDGE_TIMEOUT)
+    verdicts = [None] * len(message_buffers)
+    for number, answer in JUDGE_VERDICT_RE.findall(response.text):
+        index = int(number) - 1
+        if 0 <= index < len(verdicts):
+            verdicts[index] = answer.upper() == "YES"
+    return verdicts
+
+judge_batcher = JudgeBatcher(_judge_conversations)
+
+async def is_interesting_to_luffy(message_buffer, guild_id=None):
+    """
+    Checks if a conversation is interesting to Luffy. Confident cases are decided by the
+    local classifier; only the ambiguous band goes to the low-cost model. Returns None
+    when there is no verdict because the judge call was shed or failed.
+    """
+    probability = interest_classifier.score(message_buffer)
+    verdict = interest_classifier.local_verdict(probability)
+    if verdict is not None:
+        # Counted whether or not it is audited, so local_* / remote is the true hit rate.
+        metrics.incr('judge.local_yes' if verdict else 'judge.local_no')
+    audit = verdict is not None and random.random() < JUDGE_AUDIT_RATE
+    if verdict is not None and not audit:
+        return verdict
+
     try:
-        response = await judge_model.generate_content_async(prompt)
-        return "YES" in response.text.upper()
+        # The guild's quota is charged per conversation; the batch takes one global slot.
+        await scheduler.acquire(PRIORITY_JUDGE, guild_id, global_slot=False)
+        remote_verdict = await judge_batcher.submit(message_buffer)
+    except LLMShedError:
+        metrics.incr('judge.shed')
+        return verdict
     except Exception as e:
-        print(f"Error calling The Judge API: {e}")
-        return False
+        log.warning(f"Error calling The Judge API: {e!r}")
+        metrics.incr('gemini.fallback')
+        return verdict
+
+    interest_classifier.log_judge_decision(message_buffer, remote_verdict, probability)
+    if audit:
+        # Sampled confident cases keep a live agreement rate against the LLM.
+        metrics.incr('judge.audit')
+        if verdict == remote_verdict:
+            metrics.incr('judge.audit_agree')
+    else:
+        metrics.incr('judge.remote')
+    return remote_verdict
 
-def get_luffy_response(user_id, conversation_history):
+def estimate_tokens(text):
     """
-    Generates a response in the persona of Monkey D. Luffy, maintaining chat history in Firestore.
+    Rough token count for budgeting (about 4 characters per token).
     """
-    chat_session_ref = db.collection('chat_sessions').document(str(user_id))
-    chat_session_doc = chat_session_ref.get()
+    return len(text) // 4 + 1
 
-    history = []
-    if chat_session_doc.exists:
-        history_data = chat_session_doc.to_dict().get('history', [])
-        # Convert the list of dicts back to a list of Content objects
-        for item in history_data:
-            role = item['role']
-            parts = [part['text'] for part in item['parts']]
-            history.append({'role': role, 'parts': parts})
+def _history_tokens(history):
+    return sum(estimate_tokens(part.text) for content in history for part in content.parts)
 
-    chat = model.start_chat(history=history)
+def _transcript(history):
+    return "\n".join(f"{content.role}: {' '.join(part.text for part in content.parts)}" for content in history)
 
-    # Limit chat history to the last 10 messages
-    if len(chat.history) > 20:
-        chat.history = chat.history[-20:]
-    
+async def _summarize_turns(summary, turns):
+    """
+    Folds older chat turns into the running summary using the low-cost model.
+    """
+    summary_model = genai.GenerativeModel('gemini-2.0-flash-lite')
+    prompt = (
+        "You keep notes for Luffy about a chat with one user. Update the notes with the new turns in at most 60 words. "
+        "Keep the user's name, facts about them, promises and running jokes. Plain text only.\n\n"
+        f"Current notes: {summary or 'none'}\n\nNew turns:\n{_transcript(turns)}"
+    )
+    response = await _call_gemini(summary_model.generate_content_async, prompt, priority=PRIORITY_INTRUSION, timeout=NARRATION_TIMEOUT)
+    return response.text.strip()
+
+async def _compact_history(session):
+    """
+    Keeps only the last few turns verbatim and folds the rest into the session summary.
+    """
+    history = session.chat.history
+    if len(history) <= VERBATIM_TURNS + COMPACT_EVERY:
+        return
+    older = history[:-VERBATIM_TURNS]
     try:
-        response = chat.send_message(f"Conversation Context:\n{conversation_history}")
-
-        # Convert the chat history to a JSON-serializable format
-        serializable_history = []
-        for content in chat.history:
-            parts = [{'text': part.text} for part in content.parts]
-            serializable_history.append({'role': content.role, 'parts': parts})
-
-        chat_session_ref.set({
-            'history': serializable_history,
-            'last_used': time.time()
-        })
+        session.summary = await _summarize_turns(session.summary, older)
+    except Exception as e:
+        # Keep the turns if the summary couldn't be updated; the history limit still applies.
+        print(f"Error summarizing chat history: {e!r}")
+        return
+    del history[:-VERBATIM_TURNS]
+    metrics.incr('chat.compactions')
+
+def _fit_to_budget(session, context_lines):
+    """
+    Drops the oldest channel context lines, then the oldest verbatim turns, until the
+    estimated prompt fits PROMPT_TOKEN_BUDGET.
+    """
+    history = session.chat.history
+    fixed = estimate_tokens(LUFFY_SYSTEM_PROMPT) + estimate_tokens(session.summary)
+    context_tokens = sum(estimate_tokens(line) for line in context_lines)
+    history_tokens = _history_tokens(history)
+    while len(context_lines) > 1 and fixed + history_tokens + context_tokens > PROMPT_TOKEN_BUDGET:
+        context_tokens -= estimate_tokens(context_lines.pop(0))
+    while len(history) > 2 and fixed + history_tokens + context_tokens > PROMPT_TOKEN_BUDGET:
+        history_tokens -= _history_tokens(history[:2])
+        del history[:2]
+    return context_lines
+
+async def _prepare_message(session, conversation_history):
+    """
+    Builds the chat message for a reply, compacting the session history first when
+    compaction is on. Returns the message, the context lines used and a token estimate.
+    """
+    if HISTORY_COMPACTION:
+        await _compact_history(session)
+        context_lines = _fit_to_budget(session, conversation_history.split("\n"))
+        message = "Conversation Context:\n" + "\n".join(context_lines)
+        if session.summary:
+            message = f"What you remember about this nakama: {session.summary}\n\n{message}"
+    else:
+        context_lines = conversation_history.split("\n")
+        message = f"Conversation Context:\n{conversation_history}"
+    estimated_tokens = estimate_tokens(LUFFY_SYSTEM_PROMPT) + _history_tokens(session.chat.history) + estimate_tokens(message)
+    return message, context_lines, estimated_tokens
+
+def _finish_reply(user_id, session, context_lines):
+    if HISTORY_COMPACTION:
+        # Store only the triggering line; the channel context and summary are resent fresh each reply.
+        session.chat.history[-2].parts[0].text = f"Conversation Context:\n{context_lines[-1]}"
+    chat_sessions.cache.mark_updated(user_id, session)
+
+def _log_reply_cost(user_id, response, estimated_tokens, latency_ms, streamed=False):
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None) or estimated_tokens
+    metrics.observe('chat.latency_ms', latency_ms)
+    metrics.observe('chat.prompt_tokens', prompt_tokens)
+    log.info(f"Luffy reply for {user_id}: {latency_ms:.0f} ms, {prompt_tokens} prompt tokens (estimated {estimated_tokens}, compaction {'on' if HISTORY_COMPACTION else 'off'}, streamed {streamed})")
+
+async def get_luffy_response(user_id, conversation_history, guild_id=None, priority=PRIORITY_MENTION):
+    """
+    Generates a response in the persona of Monkey D. Luffy. Chat sessions stay live in
+    memory and their history is written back to Firestore lazily. In compaction mode
+    older turns are folded into a running summary and the prompt is kept within budget.
+    """
+    session = chat_sessions.cache.get(user_id, model)
+
+    try:
+        async with session.lock:
+            message, context_lines, estimated_tokens = await _prepare_message(session, conversation_history)
+            started = time.monotonic()
+            response = await _call_gemini(session.chat.send_message_async, message, priority=priority, guild_id=guild_id, timeout=CHAT_TIMEOUT)
+            latency_ms = (time.monotonic() - started) * 1000
+            _finish_reply(user_id, session, context_lines)
+
+        _log_reply_cost(user_id, response, estimated_tokens, latency_ms)
         return response.text
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        raise
\ No newline at end of file
+        print(f"Error calling Gemini API: {e!r}")
+        metrics.incr('gemini.fallback')
+        raise
+
+async def stream_luffy_response(user_id, conversation_history, guild_id=None, priority=PRIORITY_MENTION):
+    """
+    Same as get_luffy_response, but yields the reply text chunk by chunk as Gemini
+    streams it. The finished turn is saved to the chat session once the stream ends.
+    """
+    session = chat_sessions.cache.get(user_id, model)
+    response = None
+
+    try:
+        async with session.lock:
+            message, context_lines, estimated_tokens = await _prepare_message(session, conversation_history)
+            started = time.monotonic()
+            # The breaker deadline covers the wait for the first chunk; the rest of the stream gets CHAT_TIMEOUT overall.
+            response = await _call_gemini(session.chat.send_message_async, message, stream=True, priority=priority, guild_id=guild_id, timeout=CHAT_TIMEOUT)
+            chunks = response.__aiter__()
+            while True:
+                remaining = CHAT_TIMEOUT - (time.monotonic() - started)
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(remaining, 0.01))
+                except StopAsyncIteration:
+                    break
+                if chunk.text:
+                    yield chunk.text
+            latency_ms = (time.monotonic() - started) * 1000
+            _finish_reply(user_id, session, context_lines)
+
+        _log_reply_cost(user_id, response, estimated_tokens, latency_ms, streamed=True)
+    except Exception as e:
+        print(f"Error calling Gemini API: {e!r}")
+        metrics.incr('gemini.fallback')
+        if response is not None:
+            # A half-consumed stream leaves the chat unusable; reload it from Firestore next time.
+            chat_sessions.cache.discard(user_id, session)
+        raise
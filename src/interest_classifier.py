@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import math
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+# Local first stage for The Judge. Confident buffers are decided here and only
+# the ambiguous band is sent to Gemini.
+JUDGE_LOG_PATH = os.getenv("JUDGE_LOG_PATH", "judge_log.jsonl")
+JUDGE_MODEL_PATH = os.getenv("JUDGE_MODEL_PATH", "judge_model.json")
+LOCAL_YES_THRESHOLD = float(os.getenv("JUDGE_LOCAL_YES", 0.85))
+LOCAL_NO_THRESHOLD = float(os.getenv("JUDGE_LOCAL_NO", 0.15))
+
+# Weighted lexicon used until a naive-Bayes model has been trained from the judge log.
+LEXICON = {
+    # One Piece
+    "one piece": 3.0, "luffy": 2.5, "zoro": 2.5, "sanji": 2.5, "nami": 2.0, "usopp": 2.0,
+    "chopper": 2.0, "robin": 1.5, "franky": 2.0, "brook": 1.5, "jinbe": 2.0, "shanks": 2.5,
+    "ace": 1.0, "straw hat": 3.0, "strawhat": 3.0, "devil fruit": 3.0, "gear 5": 3.0,
+    "nika": 2.5, "haki": 2.5, "yonko": 2.5, "marines": 2.0, "marine": 1.5, "wano": 2.5,
+    "marineford": 2.5, "dressrosa": 2.5, "laugh tale": 3.0, "grand line": 3.0, "bounty": 1.5,
+    "oda": 2.0, "anime": 1.0, "manga": 1.0, "episode": 0.5, "chapter": 0.5,
+    # Food
+    "meat": 2.5, "food": 1.5, "hungry": 2.0, "eat": 1.0, "eating": 1.0, "dinner": 1.5,
+    "lunch": 1.5, "breakfast": 1.5, "bbq": 2.0, "cook": 1.0, "cooking": 1.0, "snack": 1.0,
+    "pizza": 1.0, "ramen": 1.5, "sushi": 1.5, "feast": 2.0,
+    # Adventure
+    "adventure": 2.5, "treasure": 2.5, "pirate": 2.5, "pirates": 2.5, "ship": 1.5,
+    "island": 1.5, "sail": 1.5, "sailing": 1.5, "explore": 1.5, "journey": 1.0,
+    "fight": 1.5, "battle": 1.5, "dream": 1.0, "freedom": 1.0, "nakama": 3.0, "crew": 1.0,
+}
+LEXICON_BIAS = -2.0
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+def _strip_author(line):
+    # Buffer lines look like "username: content"; the username is noise.
+    _, sep, content = line.partition(": ")
+    return content if sep else line
+
+def tokenize(message_buffer):
+    """
+    Lowercases the buffer contents and returns unigram and bigram tokens.
+    """
+    words = []
+    for line in message_buffer:
+        words.extend(TOKEN_RE.findall(_strip_author(line).lower()))
+    bigrams = [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return words + bigrams
+
+def _sigmoid(x):
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1 / (1 + math.exp(-x))
+
+def lexicon_score(tokens):
+    """
+    Returns P(interesting) from the weighted lexicon.
+    """
+    # Each term counts once so a spammed word can't force a YES on its own.
+    return _sigmoid(LEXICON_BIAS + sum(LEXICON.get(token, 0.0) for token in set(tokens)))
+
+class NaiveBayesModel:
+    """
+    Multinomial naive Bayes over buffer tokens, trained from logged judge verdicts.
+    """
+    def __init__(self, class_counts=None, token_counts=None):
+        self.class_counts = class_counts or {"yes": 0, "no": 0}
+        self.token_counts = token_counts or {"yes": {}, "no": {}}
+        self._refresh()
+
+    def _refresh(self):
+        self.vocab = set(self.token_counts["yes"]) | set(self.token_counts["no"])
+        self.totals = {label: sum(counts.values()) for label, counts in self.token_counts.items()}
+
+    @classmethod
+    def train(cls, records):
+        model = cls()
+        for record in records:
+            label = "yes" if record["verdict"] else "no"
+            model.class_counts[label] += 1
+            counts = model.token_counts[label]
+            for token in tokenize(record["buffer"]):
+                counts[token] = counts.get(token, 0) + 1
+        model._refresh()
+        return model
+
+    def predict(self, tokens):
+        """
+        Returns P(interesting) for the tokens.
+        """
+        total = self.class_counts["yes"] + self.class_counts["no"]
+        if not total:
+            return lexicon_score(tokens)
+        vocab_size = len(self.vocab) or 1
+        log_odds = math.log((self.class_counts["yes"] + 1) / (self.class_counts["no"] + 1))
+        for token in tokens:
+            if token not in self.vocab:
+                continue
+            p_yes = (self.token_counts["yes"].get(token, 0) + 1) / (self.totals["yes"] + vocab_size)
+            p_no = (self.token_counts["no"].get(token, 0) + 1) / (self.totals["no"] + vocab_size)
+            log_odds += math.log(p_yes / p_no)
+        return _sigmoid(log_odds)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({"class_counts": self.class_counts, "token_counts": self.token_counts}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data["class_counts"], data["token_counts"])
+
+def _load_model():
+    if not os.path.exists(JUDGE_MODEL_PATH):
+        return None
+    try:
+        model = NaiveBayesModel.load(JUDGE_MODEL_PATH)
+        log.info(f"Loaded judge model from {JUDGE_MODEL_PATH}.")
+        return model
+    except Exception as e:
+        log.error(f"Failed to load judge model from {JUDGE_MODEL_PATH}: {e}")
+        return None
+
+_model = _load_model()
+
+def score(message_buffer, model=None):
+    """
+    Returns P(interesting) for a message buffer, using the trained model if one exists.
+    """
+    model = model or _model
+    tokens = tokenize(message_buffer)
+    if model is not None:
+        return model.predict(tokens)
+    return lexicon_score(tokens)
+
+def local_verdict(probability, yes_threshold=LOCAL_YES_THRESHOLD, no_threshold=LOCAL_NO_THRESHOLD):
+    """
+    Returns True/False for confident scores, or None when the LLM judge should decide.
+    """
+    if probability >= yes_threshold:
+        return True
+    if probability <= no_threshold:
+        return False
+    return None
+
+def log_judge_decision(message_buffer, verdict, probability):
+    """
+    Appends a remote judge verdict to the judge log for later training.
+    """
+    try:
+        with open(JUDGE_LOG_PATH, 'a') as f:
+            f.write(json.dumps({"buffer": list(message_buffer), "verdict": verdict, "local_p": probability}) + "\n")
+    except OSError as e:
+        log.error(f"Failed to write judge log: {e}")
+
+def load_judge_log(path=JUDGE_LOG_PATH):
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+def evaluate(records, scorer=score):
+    """
+    Replays logged LLM verdicts through the local stage and reports coverage and agreement.
+    """
+    local_decisions = 0
+    agreements = 0
+    for record in records:
+        verdict = local_verdict(scorer(record["buffer"]))
+        if verdict is None:
+            continue
+        local_decisions += 1
+        if verdict == record["verdict"]:
+            agreements += 1
+    return {
+        "total": len(records),
+        "local": local_decisions,
+        "remote": len(records) - local_decisions,
+        "agreement": agreements / local_decisions if local_decisions else None
+    }
+
+if __name__ == "__main__":
+    # Train on the judge log and report agreement with the LLM on a held-out split:
+    #   python -m src.interest_classifier [judge_log.jsonl]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    records = load_judge_log(sys.argv[1] if len(sys.argv) > 1 else JUDGE_LOG_PATH)
+    random.Random(0).shuffle(records)
+    split = int(len(records) * 0.8)
+    train_set, held_out = records[:split], records[split:]
+
+    model = NaiveBayesModel.train(train_set)
+    model.save(JUDGE_MODEL_PATH)
+    print(f"Trained on {len(train_set)} verdicts, saved to {JUDGE_MODEL_PATH}.")
+
+    scorers = {
+        "lexicon": lambda buffer: lexicon_score(tokenize(buffer)),
+        "naive bayes": lambda buffer: model.predict(tokenize(buffer)),
+    }
+    for name, scorer in scorers.items():
+        result = evaluate(held_out, scorer)
+        agreement = "n/a" if result["agreement"] is None else f"{result['agreement']:.1%}"
+        print(f"{name}: {result['local']} local / {result['remote']} remote of {result['total']} held-out, agreement {agreement}")
@@ -0,0 +1,100 @@
+import os
+import math
+import time
+from collections import deque
+from src import metrics
+
+# Adaptive intrusion: instead of a fixed percentage, pick the chance of judging a message
+# so each guild gets about `target_per_hour` intrusion replies. The admin level is the ceiling.
+DEFAULT_TARGET_PER_HOUR = float(os.getenv("INTRUSION_TARGET_PER_HOUR", 6))
+RATE_HALF_LIFE = float(os.getenv("INTRUSION_RATE_HALF_LIFE", 600))  # seconds
+PRIOR_YES_RATE = 0.3
+YES_RATE_ALPHA = 0.05
+MIN_PROBABILITY = 0.001
+
+class GuildIntrusionState:
+    def __init__(self, now):
+        self.first_seen = now
+        self.last_candidate = now
+        self.candidate_score = 0.0
+        self.yes_rate = PRIOR_YES_RATE
+        self.intrusions = deque()
+        self.probability = None
+
+class IntrusionController:
+    """
+    Tracks each guild's rate of intrusion candidates (messages that are neither mentions
+    nor part of an active conversation) as a time-decayed EWMA, and the share of judged
+    messages The Judge finds interesting. From those it derives the intrusion chance
+    that hits the hourly target, and stops intruding once the trailing hour is spent.
+    """
+    def __init__(self, half_life=RATE_HALF_LIFE):
+        self.tau = half_life / math.log(2)
+        self.guilds = {}
+
+    def _state(self, guild_id, now):
+        guild_id = str(guild_id)
+        state = self.guilds.get(guild_id)
+        if state is None:
+            state = GuildIntrusionState(now)
+            self.guilds[guild_id] = state
+        return state
+
+    def _candidates_per_hour(self, state, now):
+        score = state.candidate_score * math.exp(-(now - state.last_candidate) / self.tau)
+        # Early on the EWMA hasn't seen a full window yet; correct for the missing history.
+        warmup = 1 - math.exp(-max(now - state.first_seen, 1.0) / self.tau)
+        return score / (self.tau * warmup) * 3600
+
+    def _intrusions_last_hour(self, state, now):
+        while state.intrusions and state.intrusions[0] < now - 3600:
+            state.intrusions.popleft()
+        return len(state.intrusions)
+
+    def note_candidate(self, guild_id):
+        now = time.time()
+        state = self._state(guild_id, now)
+        state.candidate_score = state.candidate_score * math.exp(-(now - state.last_candidate) / self.tau) + 1
+        state.last_candidate = now
+
+    def probability(self, guild_id, ceiling, target_per_hour=DEFAULT_TARGET_PER_HOUR):
+        """
+        Returns the chance (0-1) that the current candidate message is sent to The Judge.
+        """
+        now = time.time()
+        state = self._state(guild_id, now)
+        if self._intrusions_last_hour(state, now) >= target_per_hour:
+            probability = 0.0
+        else:
+            judged_per_hour = target_per_hour / max(state.yes_rate, 0.01)
+            probability = judged_per_hour / max(self._candidates_per_hour(state, now), 1.0)
+            probability = min(ceiling, max(MIN_PROBABILITY, probability))
+        state.probability = probability
+        return probability
+
+    def record_verdict(self, guild_id, interesting):
+        state = self._state(guild_id, time.time())
+        state.yes_rate += YES_RATE_ALPHA * ((1.0 if interesting else 0.0) - state.yes_rate)
+
+    def record_intrusion(self, guild_id):
+        state = self._state(guild_id, time.time())
+        state.intrusions.append(time.time())
+        metrics.incr('intrusion.replies')
+
+    def describe(self, guild_id):
+        """
+        Returns the controller's current view of a guild, or None if it has seen no traffic.
+        """
+        now = time.time()
+        state = self.guilds.get(str(guild_id))
+        if state is None:
+            return None
+        return {
+            'candidates_per_hour': self._candidates_per_hour(state, now),
+            'judge_yes_rate': state.yes_rate,
+            'intrusions_last_hour': self._intrusions_last_hour(state, now),
+            'probability': state.probability,
+            'tracked_for': now - state.first_seen,
+        }
+
+controller = IntrusionController()
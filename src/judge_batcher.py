@@ -0,0 +1,71 @@
+import os
+import time
+import asyncio
+import logging
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+JUDGE_BATCH_WINDOW_MS = int(os.getenv("JUDGE_BATCH_WINDOW_MS", 250))
+JUDGE_BATCH_MAX_SIZE = int(os.getenv("JUDGE_BATCH_MAX_SIZE", 16))
+
+class JudgeBatcher:
+    """
+    Collects judge requests from every channel for a short window and resolves them
+    with a single call to judge_fn, which takes a list of buffers and returns a list
+    of verdicts (True/False, or None when the model gave no verdict for a buffer).
+    """
+    def __init__(self, judge_fn, window_ms=JUDGE_BATCH_WINDOW_MS, max_batch_size=JUDGE_BATCH_MAX_SIZE):
+        self.judge_fn = judge_fn
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self.pending = []
+        self._timer = None
+
+    async def submit(self, message_buffer):
+        """
+        Queues a buffer for the next batch and waits for its verdict.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((list(message_buffer), future, time.monotonic()))
+
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = self.pending[:self.max_batch_size]
+        self.pending = self.pending[self.max_batch_size:]
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+        if self.pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    async def _run(self, batch):
+        metrics.incr('judge.batch_requests')
+        metrics.observe('judge.batch_size', len(batch))
+        try:
+            verdicts = await self.judge_fn([buffer for buffer, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        now = time.monotonic()
+        for index, (_, future, queued_at) in enumerate(batch):
+            metrics.observe('judge.batch_wait_ms', (now - queued_at) * 1000)
+            if future.done():
+                continue
+            verdict = verdicts[index] if index < len(verdicts) else None
+            if verdict is None:
+                future.set_exception(ValueError(f"The Judge gave no verdict for conversation {index + 1}."))
+            else:
+                future.set_result(verdict)
@@ -0,0 +1,216 @@
+import os
+import time
+import logging
+from firebase_admin import firestore
+from src import metrics
+from src.firebase_utils import db
+from src.rank_index import index as rank_index
+
+log = logging.getLogger(__name__)
+
+# Leaderboards are rebuilt in the background, saved as small snapshot documents, and served
+# from memory. The global bounty, berries and ship-level boards come from ordered, limited
+# queries on every refresh. Server boards and crew size (an array length, which Firestore
+# can't order by) need a projected scan of pirates and ships; that runs less often and
+# also reconciles the bounty rank index.
+LEADERBOARD_REFRESH_MINUTES = float(os.getenv("LEADERBOARD_REFRESH_MINUTES", 10))
+LEADERBOARD_SCAN_MINUTES = float(os.getenv("LEADERBOARD_SCAN_MINUTES", 360))
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))
+LEADERBOARD_PAGE_SIZE = 10
+SNAPSHOT_COLLECTION = 'leaderboards'
+BATCH_LIMIT = 500
+
+# metric -> (collection, title)
+METRICS = {
+    'bounty': ('pirates', "Bounty"),
+    'berries': ('pirates', "Berries"),
+    'ship_level': ('ships', "Ship Level"),
+    'crew_size': ('ships', "Crew Size"),
+}
+PIRATE_FIELDS = ['bounty', 'berries', 'guilds']
+SHIP_FIELDS = ['name', 'server_id', 'level', 'xp', 'members']
+GLOBAL = 'global'
+
+def snapshot_id(metric, scope):
+    return f"{scope}_{metric}"
+
+# Boards served from queries rather than the scan: metric -> (collection, fields, order).
+QUERIED = {
+    'bounty': ('pirates', PIRATE_FIELDS, ['bounty']),
+    'berries': ('pirates', PIRATE_FIELDS, ['berries']),
+    'ship_level': ('ships', SHIP_FIELDS, ['level', 'xp']),  # needs a composite index on level, xp
+}
+
+def _query_top(collection, fields, order):
+    query = db.collection(collection).select(fields)
+    for field in order:
+        query = query.order_by(field, direction=firestore.Query.DESCENDING)
+    return [(doc.id, doc.to_dict()) for doc in query.limit(LEADERBOARD_SIZE).stream()]
+
+def _top(entries, sort_key):
+    return sorted(entries, key=sort_key, reverse=True)[:LEADERBOARD_SIZE]
+
+def _pirate_boards(pirates):
+    """
+    pirates: iterable of (user_id, data). Returns {(metric, scope): entries}.
+    """
+    by_scope = {GLOBAL: []}
+    for user_id, data in pirates:
+        entry = {'id': user_id, 'bounty': data.get('bounty', 0) or 0, 'berries': data.get('berries', 0) or 0}
+        by_scope[GLOBAL].append(entry)
+        for guild_id in data.get('guilds') or []:
+            by_scope.setdefault(str(guild_id), []).append(entry)
+
+    boards = {}
+    for scope, entries in by_scope.items():
+        for metric in ('bounty', 'berries'):
+            ranked = _top([entry for entry in entries if entry[metric] > 0], lambda entry: entry[metric])
+            boards[(metric, scope)] = [{'id': entry['id'], 'value': entry[metric]} for entry in ranked]
+    return boards
+
+def _ship_boards(ships):
+    """
+    ships: iterable of (ship_id, data). Returns {(metric, scope): entries}.
+    """
+    by_scope = {GLOBAL: []}
+    for ship_id, data in ships:
+        entry = {
+            'id': ship_id,
+            'name': data.get('name', "Unknown Ship"),
+            'level': data.get('level', 1),
+            'xp': data.get('xp', 0),
+            'crew': len(data.get('members') or []),
+        }
+        by_scope[GLOBAL].append(entry)
+        if data.get('server_id'):
+            by_scope.setdefault(str(data['server_id']), []).append(entry)
+
+    boards = {}
+    for scope, entries in by_scope.items():
+        boards[('ship_level', scope)] = [
+            {'id': entry['id'], 'name': entry['name'], 'value': entry['level'], 'xp': entry['xp']}
+            for entry in _top(entries, lambda entry: (entry['level'], entry['xp']))
+        ]
+        boards[('crew_size', scope)] = [
+            {'id': entry['id'], 'name': entry['name'], 'value': entry['crew']}
+            for entry in _top(entries, lambda entry: entry['crew'])
+        ]
+    return boards
+
+class Leaderboard:
+    def __init__(self, metric, scope, entries, updated_at):
+        self.metric = metric
+        self.scope = scope
+        self.entries = entries
+        self.updated_at = updated_at
+
+    def to_dict(self):
+        return {'metric': self.metric, 'scope': self.scope, 'entries': self.entries, 'updated_at': self.updated_at}
+
+class LeaderboardStore:
+    """
+    In-memory copy of every leaderboard, keyed by (metric, scope) where scope is
+    'global' or a guild ID. `refresh` rebuilds them all and writes back the ones
+    that changed; `load` restores the last snapshot after a restart.
+    """
+    def __init__(self):
+        self.boards = {}
+        self.refreshed_at = None
+        self.scanned_at = None
+
+    def get(self, metric, guild_id=None):
+        """
+        Returns the Leaderboard for a metric, globally or for one guild, or None if
+        it hasn't been built yet.
+        """
+        scope = str(guild_id) if guild_id else GLOBAL
+        board = self.boards.get((metric, scope))
+        if board is None and scope != GLOBAL and self.scanned_at is not None:
+            # Built, but nobody in this guild has made it onto this board yet.
+            board = Leaderboard(metric, scope, [], self.scanned_at)
+        return board
+
+    def checked_at(self, board):
+        """
+        When a board was last confirmed current, which may be later than when it last
+        changed.
+        """
+        queried = board.scope == GLOBAL and board.metric in QUERIED
+        return (self.refreshed_at if queried else self.scanned_at) or board.updated_at
+
+    def load(self):
+        for doc in db.collection(SNAPSHOT_COLLECTION).stream():
+            data = doc.to_dict()
+            self.boards[(data['metric'], data['scope'])] = Leaderboard(data['metric'], data['scope'], data.get('entries', []), data.get('updated_at'))
+        log.info(f"Loaded {len(self.boards)} leaderboard snapshots.")
+
+    def _query_boards(self):
+        """
+        The global boards that can be read with ordered, limited queries.
+        """
+        built = {}
+        for metric, (collection, fields, order) in QUERIED.items():
+            top = _query_top(collection, fields, order)
+            boards = _pirate_boards(top) if collection == 'pirates' else _ship_boards(top)
+            built[(metric, GLOBAL)] = boards[(metric, GLOBAL)]
+        return built
+
+    def _scan_boards(self):
+        """
+        Every board, from one projected scan of pirates and ships, reconciling the rank
+        index along the way.
+        """
+        rank_index.begin_reconcile()
+        pirates = [(doc.id, doc.to_dict()) for doc in db.collection('pirates').select(PIRATE_FIELDS).stream()]
+        rank_index.reconcile((user_id, data.get('bounty', 0)) for user_id, data in pirates)
+        ships = ((doc.id, doc.to_dict()) for doc in db.collection('ships').select(SHIP_FIELDS).stream())
+        return {**_pirate_boards(pirates), **_ship_boards(ships)}
+
+    def refresh(self, scan=None):
+        """
+        Rebuilds the global boards from queries and, when `scan` is true (by default
+        every LEADERBOARD_SCAN_MINUTES), every board from a full scan. Blocking; run it
+        off the event loop.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        if scan is None:
+            scan = self.scanned_at is None or now - self.scanned_at >= LEADERBOARD_SCAN_MINUTES * 60
+        built = self._scan_boards() if scan else self._query_boards()
+
+        changed = []
+        for key, entries in built.items():
+            old = self.boards.get(key)
+            if old is None or old.entries != entries:
+                changed.append(Leaderboard(key[0], key[1], entries, now))
+        # Only a scan sees every board, so only a scan can tell that one is gone.
+        gone = [key for key in self.boards if key not in built] if scan else []
+
+        for board in changed:
+            self.boards[(board.metric, board.scope)] = board
+        for key in gone:
+            del self.boards[key]
+        self.refreshed_at = now
+        if scan:
+            self.scanned_at = now
+        self._save(changed, gone)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.observe('leaderboards.scan_ms' if scan else 'leaderboards.refresh_ms', elapsed_ms)
+        metrics.set_gauge('leaderboards.boards', len(self.boards))
+        log.info(f"Refreshed leaderboards ({'full scan' if scan else 'queries'}) in {elapsed_ms:.0f} ms: {len(changed)} changed, {len(gone)} removed, {len(self.boards)} total.")
+
+    def _save(self, changed, gone):
+        collection = db.collection(SNAPSHOT_COLLECTION)
+        writes = [(board, snapshot_id(board.metric, board.scope)) for board in changed]
+        writes += [(None, snapshot_id(metric, scope)) for metric, scope in gone]
+        for i in range(0, len(writes), BATCH_LIMIT):
+            batch = db.batch()
+            for board, doc_id in writes[i:i + BATCH_LIMIT]:
+                if board is None:
+                    batch.delete(collection.document(doc_id))
+                else:
+                    batch.set(collection.document(doc_id), board.to_dict())
+            batch.commit()
+
+store = LeaderboardStore()
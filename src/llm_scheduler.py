@@ -0,0 +1,173 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Priority classes, most important first.
+PRIORITY_COMMAND = 0    # /adventure, /recruit and other slash-command narration
+PRIORITY_MENTION = 1    # direct mentions and "luffy" keyword hits
+PRIORITY_INTRUSION = 2  # intrusion and active-conversation replies, history summaries
+PRIORITY_JUDGE = 3      # The Judge
+PRIORITY_NAMES = {PRIORITY_COMMAND: "command", PRIORITY_MENTION: "mention", PRIORITY_INTRUSION: "intrusion", PRIORITY_JUDGE: "judge"}
+# At or below this importance work is shed instead of delayed when the budget runs out.
+SHED_FROM_PRIORITY = PRIORITY_INTRUSION
+
+LLM_GLOBAL_QPS = float(os.getenv("LLM_GLOBAL_QPS", 5))
+LLM_GUILD_PER_MINUTE = float(os.getenv("LLM_GUILD_PER_MINUTE", 30))
+LLM_GUILD_BURST = float(os.getenv("LLM_GUILD_BURST", 10))
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", 5))
+# Tokens of each server's burst that only commands and mentions may use.
+LLM_GUILD_RESERVE = float(os.getenv("LLM_GUILD_RESERVE", 3))
+
+class LLMShedError(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, floor=0):
+        """
+        Takes a token if one is available above `floor`.
+        """
+        self._refill()
+        if self.tokens >= 1 + floor:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def wait_time(self):
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class PriorityGate:
+    """
+    A token bucket with a queue: when it is empty, callers wait in a heap and refilled
+    tokens go to the most important one first.
+    """
+    def __init__(self, bucket, gauge):
+        self.bucket = bucket
+        self.gauge = gauge
+        self.waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def try_take(self, floor=0):
+        # Nobody jumps the queue while others are waiting.
+        return not self.waiters and self.bucket.try_take(floor)
+
+    async def wait(self, priority, timeout):
+        """
+        Queues for a token. Returns once granted; raises asyncio.TimeoutError after
+        `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self.waiters, (priority, next(self._seq), future))
+        metrics.set_gauge(self.gauge, len(self.waiters))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            # A token handed over just as the wait ran out still counts.
+            if future.cancel():
+                raise
+
+    async def _dispatch(self):
+        while self.waiters:
+            await asyncio.sleep(self.bucket.wait_time())
+            while self.waiters and self.waiters[0][2].done():
+                heapq.heappop(self.waiters)
+            if self.waiters and self.bucket.try_take():
+                _, _, future = heapq.heappop(self.waiters)
+                future.set_result(True)
+            metrics.set_gauge(self.gauge, len(self.waiters))
+
+class LLMScheduler:
+    """
+    Orders LLM calls by priority under a global QPS ceiling and per-guild token-bucket
+    quotas. High-priority calls queue (up to max_wait) for budget, most important
+    first; low-priority calls are shed immediately when there is none. Low-priority
+    calls also can't dip into the last `guild_reserve` tokens of a guild's burst, so
+    judge and intrusion traffic can't starve commands and mentions.
+    """
+    def __init__(self, global_qps=LLM_GLOBAL_QPS, guild_per_minute=LLM_GUILD_PER_MINUTE, guild_burst=LLM_GUILD_BURST, max_wait=LLM_MAX_WAIT, guild_reserve=LLM_GUILD_RESERVE):
+        self.global_gate = PriorityGate(TokenBucket(global_qps, max(1.0, global_qps)), 'llm.queued')
+        self.guild_per_minute = guild_per_minute
+        self.guild_burst = guild_burst
+        self.guild_reserve = min(guild_reserve, max(0.0, guild_burst - 1))
+        self.max_wait = max_wait
+        self.guild_gates = {}
+
+    def _guild_gate(self, guild_id):
+        if guild_id is None:
+            return None
+        guild_id = str(guild_id)
+        gate = self.guild_gates.get(guild_id)
+        if gate is None:
+            gate = PriorityGate(TokenBucket(self.guild_per_minute / 60, self.guild_burst), 'llm.guild_queued')
+            self.guild_gates[guild_id] = gate
+        return gate
+
+    def _shed(self, priority, reason):
+        metrics.incr(f'llm.shed.{PRIORITY_NAMES.get(priority, priority)}')
+        raise LLMShedError(f"LLM budget exhausted ({reason})")
+
+    async def acquire(self, priority, guild_id=None, global_slot=True):
+        """
+        Waits for permission to make one LLM request, or raises LLMShedError.
+        Pass global_slot=False when the request will be folded into a shared call
+        (e.g. a judge batch) that takes its own global slot.
+        """
+        sheddable = priority >= SHED_FROM_PRIORITY
+        deadline = time.monotonic() + self.max_wait
+
+        guild_gate = self._guild_gate(guild_id)
+        if guild_gate is not None:
+            if sheddable:
+                if not guild_gate.try_take(floor=self.guild_reserve):
+                    self._shed(priority, f"guild {guild_id} quota")
+            elif not guild_gate.try_take():
+                try:
+                    await guild_gate.wait(priority, deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    self._shed(priority, f"guild {guild_id} quota")
+
+        if not global_slot:
+            return
+        if self.global_gate.try_take():
+            metrics.incr(f'llm.granted.{PRIORITY_NAMES.get(priority, priority)}')
+            return
+        if sheddable:
+            if guild_gate is not None:
+                guild_gate.bucket.refund()
+            self._shed(priority, "global QPS")
+
+        try:
+            await self.global_gate.wait(priority, deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            if guild_gate is not None:
+                guild_gate.bucket.refund()
+            self._shed(priority, "queued past max wait")
+        metrics.incr(f'llm.granted.{PRIORITY_NAMES.get(priority, priority)}')
+
+scheduler = LLMScheduler()
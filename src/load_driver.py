@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+import types
+import random
+import asyncio
+import argparse
+
+# Drive the chat path against the fake provider unless told otherwise.
+os.environ.setdefault("LUFFY_FAKE_GEMINI", "on")
+
+class MemorySnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class MemoryDocument:
+    def __init__(self, store, collection, document_id):
+        self.store = store
+        self.key = (collection, str(document_id))
+        self.id = str(document_id)
+
+    def get(self, **kwargs):
+        return MemorySnapshot(self, self.store.get(self.key))
+
+    def set(self, data, merge=False):
+        self.store[self.key] = dict(self.store.get(self.key) or {}, **data) if merge else dict(data)
+
+    def update(self, data):
+        self.store.setdefault(self.key, {}).update(data)
+
+    def delete(self):
+        self.store.pop(self.key, None)
+
+class MemoryCollection:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def document(self, document_id):
+        return MemoryDocument(self.store, self.name, document_id)
+
+class MemoryBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference, data, merge))
+
+    def commit(self):
+        for reference, data, merge in self.writes:
+            reference.set(data, merge=merge)
+
+class MemoryFirestore:
+    """
+    Just enough of a Firestore client, in memory, for the chat path.
+    """
+    def __init__(self):
+        self.store = {}
+
+    def collection(self, name):
+        return MemoryCollection(self.store, name)
+
+    def batch(self):
+        return MemoryBatch()
+
+def _memory_firebase_utils():
+    # Replaces src.firebase_utils before anything imports it, so the run needs no
+    # credentials and never touches Firestore.
+    module = types.ModuleType("src.firebase_utils")
+    db = MemoryFirestore()
+
+    def pirate(user_id):
+        return db.collection('pirates').document(str(user_id))
+
+    def get_user(user_id):
+        reference = pirate(user_id)
+        if not reference.get().exists:
+            reference.set({"bounty": 0, "berries": 500, "xp": 0, "guilds": [], "chat_reward_cooldown_ends": None})
+        return reference.get().to_dict()
+
+    def add_user_guild(user_id, guild_id):
+        user = get_user(user_id)
+        pirate(user_id).update({'guilds': user['guilds'] + [str(guild_id)]})
+
+    def update_spam_warnings(user_id, amount):
+        pirate(user_id).update({'spam_warnings': get_user(user_id).get('spam_warnings', 0) + amount})
+
+    def suspend_user(user_id, suspension_end_time):
+        pirate(user_id).update({'suspended_until': suspension_end_time, 'spam_warnings': 0})
+
+    def lift_suspension(user_id):
+        user = get_user(user_id)
+        user.pop('suspended_until', None)
+        pirate(user_id).set(user)
+
+    def grant_chat_reward(user_id, berry_reward, xp_reward):
+        user = get_user(user_id)
+        pirate(user_id).update({
+            'berries': user['berries'] + berry_reward,
+            'xp': user['xp'] + xp_reward,
+            'chat_reward_cooldown_ends': time.time() + 120
+        })
+
+    module.db = db
+    for helper in (get_user, add_user_guild, update_spam_warnings, suspend_user, lift_suspension, grant_chat_reward):
+        setattr(module, helper.__name__, helper)
+    return module
+
+if os.getenv("LOAD_DRIVER_FIRESTORE", "memory").lower() == "memory":
+    sys.modules["src.firebase_utils"] = _memory_firebase_utils()
+
+from src import metrics
+from src.cogs.events import Events, FALLBACK_REPLY
+
+PHRASES = [
+    "anyone up for a raid tonight?", "I just had the best ramen", "where do we find treasure in this game",
+    "lol that duel was close", "my ship needs repairs again", "what's the strongest devil fruit",
+    "brb dinner", "who wants to trade crew members", "the auction house is wild today",
+    "meat on the bone is underrated", "gm everyone", "did you see the new episode",
+]
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+    def mentioned_in(self, message):
+        return self in message.mentions
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f"load-guild-{guild_id}"
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeSentMessage:
+    def __init__(self, stats, content):
+        self.stats = stats
+        self.content = content
+
+    async def edit(self, content=None):
+        self.stats['edits'] += 1
+        self.content = content
+
+class FakeChannel:
+    def __init__(self, channel_id, stats):
+        self.id = channel_id
+        self.stats = stats
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send(self, content=None, **kwargs):
+        self.stats['sends'] += 1
+        return FakeSentMessage(self.stats, content)
+
+    async def purge(self, limit=None, check=None):
+        return []
+
+class FakeMessage:
+    def __init__(self, author, guild, channel, content, mentions, stats):
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions
+        self.stats = stats
+
+    async def reply(self, content=None, **kwargs):
+        self.stats['fallbacks' if content == FALLBACK_REPLY else 'replies'] += 1
+        return FakeSentMessage(self.stats, content)
+
+class FakeBot:
+    def __init__(self, intrusion_level, guild_ids):
+        self.user = FakeUser(1, "Luffy", bot=True)
+        self.settings = {str(guild_id): {'intrusion_level': intrusion_level} for guild_id in guild_ids}
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run(args):
+    """
+    Feeds synthetic messages to Events.on_message at a Poisson rate and reports
+    reply counts, on_message latency percentiles and the metrics snapshot.
+    """
+    rng = random.Random(args.seed)
+    stats = {'replies': 0, 'fallbacks': 0, 'edits': 0, 'sends': 0, 'errors': 0}
+    guilds = [FakeGuild(1000 + i) for i in range(args.guilds)]
+    channels = {guild.id: [FakeChannel(guild.id * 100 + i, stats) for i in range(args.channels)] for guild in guilds}
+    users = [FakeUser(10_000 + i, f"pirate{i}") for i in range(args.users)]
+    bot = FakeBot(args.intrusion_level, [guild.id for guild in guilds])
+    events = Events(bot)
+    durations = []
+
+    async def deliver(message):
+        started = time.monotonic()
+        try:
+            await events.on_message(message)
+        except Exception as e:
+            stats['errors'] += 1
+            print(f"on_message failed: {e!r}")
+        durations.append((time.monotonic() - started) * 1000)
+
+    tasks = []
+    started = time.monotonic()
+    for _ in range(args.messages):
+        guild = rng.choice(guilds)
+        content = rng.choice(PHRASES)
+        mentions = []
+        roll = rng.random()
+        if roll < args.mention_rate:
+            mentions = [bot.user]
+        elif roll < args.mention_rate * 2:
+            content = f"luffy, {content}"
+        message = FakeMessage(rng.choice(users), guild, rng.choice(channels[guild.id]), content, mentions, stats)
+        tasks.append(asyncio.create_task(deliver(message)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    print(f"{args.messages} messages in {elapsed:.1f}s ({args.messages / elapsed:.1f} msg/s)")
+    print(f"replies {stats['replies']}, fallbacks {stats['fallbacks']}, edits {stats['edits']}, errors {stats['errors']}")
+    print(f"on_message ms: p50 {_percentile(durations, 0.5):.0f}, p95 {_percentile(durations, 0.95):.0f}, p99 {_percentile(durations, 0.99):.0f}, max {max(durations, default=0):.0f}")
+    snapshot = metrics.snapshot()
+    for name, value in sorted(snapshot['counters'].items()):
+        print(f"{name}: {value}")
+    for name, timing in sorted(snapshot['timings'].items()):
+        print(f"{name}: n={timing['count']} avg={timing['avg']:.1f} max={timing['max']:.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive on_message with synthetic traffic against the fake Gemini provider.")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=50, help="messages per second")
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=4, help="channels per guild")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--mention-rate", type=float, default=0.05)
+    parser.add_argument("--intrusion-level", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=None)
+    asyncio.run(run(parser.parse_args()))
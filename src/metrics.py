@@ -0,0 +1,48 @@
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+def incr(name, amount=1):
+    """
+    Increments a named counter.
+    """
+    with _lock:
+        _counters[name] += amount
+
+def observe(name, value):
+    """
+    Records a sample (e.g. a latency in ms) for a named timing.
+    """
+    with _lock:
+        count, total, peak = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + value, max(peak, value))
+
+def set_gauge(name, value):
+    """
+    Sets a named gauge to its current value.
+    """
+    with _lock:
+        _gauges[name] = value
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot():
+    """
+    Returns a copy of all counters, gauges and timing summaries.
+    """
+    with _lock:
+        timings = {
+            name: {'count': count, 'avg': total / count if count else 0.0, 'max': peak}
+            for name, (count, total, peak) in _timings.items()
+        }
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': timings
+        }
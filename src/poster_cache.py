@@ -0,0 +1,111 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Rendered posters are stored on disk under a hash of everything that affects the image,
+# so an unchanged avatar, name and bounty never renders twice.
+POSTER_CACHE_DIR = os.getenv("POSTER_CACHE_DIR", "poster_cache")
+POSTER_CACHE_MAX_BYTES = int(os.getenv("POSTER_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+def poster_key(avatar_key, name, bounty, variant="png"):
+    """
+    Content address for a poster: the avatar hash, the name and bounty printed on it,
+    and the output variant.
+    """
+    return hashlib.sha256(f"{avatar_key}\0{name}\0{bounty}\0{variant}".encode()).hexdigest()
+
+class PosterCache:
+    """
+    On-disk LRU of rendered posters with a byte budget. The index (key -> size, in
+    recency order) lives in memory and is rebuilt from file mtimes on startup.
+    """
+    def __init__(self, directory=POSTER_CACHE_DIR, max_bytes=POSTER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for filename in os.listdir(directory):
+            if filename.endswith(".tmp"):
+                os.remove(os.path.join(directory, filename))
+                continue
+            stat = os.stat(os.path.join(directory, filename))
+            entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, filename, size in sorted(entries):
+            self.index[filename] = size
+            self.total_bytes += size
+        self._report()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _report(self):
+        metrics.set_gauge('poster_cache.entries', len(self.index))
+        metrics.set_gauge('poster_cache.bytes', self.total_bytes)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.index:
+                metrics.incr('poster_cache.miss')
+                return None
+            self.index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.index.pop(key, 0)
+            metrics.incr('poster_cache.miss')
+            return None
+        metrics.incr('poster_cache.hit')
+        return data
+
+    def put(self, key, data):
+        # A unique temp file per write: two renders of the same poster may land at once.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self.lock:
+            self.total_bytes += len(data) - self.index.pop(key, 0)
+            self.index[key] = len(data)
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, size = self.index.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(old_key)
+            self._report()
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+            metrics.incr('poster_cache.evict')
+
+    async def get_async(self, key):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    async def put_async(self, key, data):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.put, key, data)
+        except OSError as e:
+            log.error(f"Failed to cache poster {key}: {e}")
+
+cache = PosterCache()
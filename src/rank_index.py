@@ -0,0 +1,169 @@
+import bisect
+import threading
+from src import metrics
+
+# Bounty ranks without a query: bounties fall into log-spaced buckets counted in a Fenwick
+# tree, and each bucket keeps its own values sorted so ranks stay exact.
+SUB_BUCKET_BITS = 4  # 16 buckets per power of two
+MAX_BITS = 64
+BUCKETS = 1 + MAX_BITS * (1 << SUB_BUCKET_BITS)
+
+def bucket_of(value):
+    """
+    Bucket index for a non-negative value: 0 for zero, then 16 buckets per power of
+    two, so bucket order matches value order.
+    """
+    if value <= 0:
+        return 0
+    bits = min(value.bit_length(), MAX_BITS)
+    if bits <= SUB_BUCKET_BITS:
+        mantissa = value & ((1 << SUB_BUCKET_BITS) - 1)
+    else:
+        mantissa = (value >> (bits - SUB_BUCKET_BITS - 1)) & ((1 << SUB_BUCKET_BITS) - 1)
+    return 1 + (bits - 1) * (1 << SUB_BUCKET_BITS) + mantissa
+
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index, amount):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += amount
+            index += index & -index
+
+    def prefix_sum(self, index):
+        """
+        Sum of positions 0..index inclusive.
+        """
+        total = 0
+        index += 1
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+class RankIndex:
+    """
+    Bounty of every known pirate, answering "how many pirates have a higher bounty"
+    in O(log n). Writes through update_bounty adjust it as they happen; `reconcile`
+    replaces it with a full scan, except for pirates written to while the scan ran.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.tree = FenwickTree(BUCKETS)
+        self.buckets = [[] for _ in range(BUCKETS)]
+        self.touched = None
+        self.ready = False
+
+    def _insert(self, value):
+        bucket = bucket_of(value)
+        bisect.insort(self.buckets[bucket], value)
+        self.tree.add(bucket, 1)
+
+    def _remove(self, value):
+        bucket = bucket_of(value)
+        values = self.buckets[bucket]
+        del values[bisect.bisect_left(values, value)]
+        self.tree.add(bucket, -1)
+
+    def _set(self, user_id, bounty):
+        old = self.values.get(user_id)
+        if old is not None:
+            self._remove(old)
+        self.values[user_id] = max(0, bounty)
+        self._insert(self.values[user_id])
+
+    def set(self, user_id, bounty):
+        """
+        Records a bounty just read from storage.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            self._set(user_id, bounty)
+            if self.touched is not None:
+                self.touched.add(user_id)
+
+    def add(self, user_id, amount):
+        """
+        Applies a bounty increment. A pirate not seen yet is assumed to start at zero,
+        which matches new profiles; anything else is corrected by the next reconcile.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            known = user_id in self.values
+            self._set(user_id, self.values.get(user_id, 0) + amount)
+            # Only a known starting value makes the live one better than the scan's.
+            if known and self.touched is not None:
+                self.touched.add(user_id)
+
+    def begin_reconcile(self):
+        with self.lock:
+            self.touched = set()
+
+    def reconcile(self, bounties):
+        """
+        Rebuilds from (user_id, bounty) pairs read since `begin_reconcile`. Pirates
+        updated during the scan keep their live value.
+        """
+        with self.lock:
+            touched = self.touched or set()
+            values = {user_id: self.values[user_id] for user_id in touched if user_id in self.values}
+            drift = 0
+            for user_id, bounty in bounties:
+                user_id = str(user_id)
+                if user_id in touched:
+                    continue
+                bounty = max(0, bounty or 0)
+                if self.values.get(user_id) != bounty:
+                    drift += 1
+                values[user_id] = bounty
+
+            self.values = values
+            self.tree = FenwickTree(BUCKETS)
+            self.buckets = [[] for _ in range(BUCKETS)]
+            for bounty in values.values():
+                self.buckets[bucket_of(bounty)].append(bounty)
+            for bucket, bucket_values in enumerate(self.buckets):
+                if bucket_values:
+                    bucket_values.sort()
+                    self.tree.add(bucket, len(bucket_values))
+            self.touched = None
+            self.ready = True
+        metrics.set_gauge('rank_index.pirates', len(values))
+        metrics.incr('rank_index.reconcile_drift', drift)
+
+    def rank(self, bounty):
+        """
+        Returns (rank, total) for a bounty: 1 + the number of pirates with a strictly
+        higher bounty, out of all pirates indexed.
+        """
+        bounty = max(0, bounty)
+        bucket = bucket_of(bounty)
+        with self.lock:
+            total = len(self.values)
+            higher = total - self.tree.prefix_sum(bucket)
+            values = self.buckets[bucket]
+            higher += len(values) - bisect.bisect_right(values, bounty)
+        return higher + 1, total
+
+    def rank_of(self, user_id):
+        """
+        Returns (rank, total) for a pirate, or None if they aren't indexed.
+        """
+        with self.lock:
+            bounty = self.values.get(str(user_id))
+        if bounty is None:
+            return None
+        return self.rank(bounty)
+
+def describe_rank(rank, total):
+    """
+    Formats a rank for embeds, e.g. "#12 of 3,400 (top 0.4%)".
+    """
+    share = 100.0 * rank / max(total, 1)
+    return f"#{rank:,} of {total:,} (top {share:.1f}%)" if share < 10 else f"#{rank:,} of {total:,} (top {share:.0f}%)"
+
+index = RankIndex()
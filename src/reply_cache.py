@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import random
+import hashlib
+from collections import OrderedDict
+from src import metrics
+
+# Short, near-identical mentions ("hi luffy", "luffy gm") are answered from a cache of
+# earlier Gemini replies, keyed by a SimHash of the normalized message.
+REPLY_CACHE = os.getenv("LUFFY_REPLY_CACHE", "off").lower() in ("1", "true", "on")
+MAX_ENTRIES = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", 2000))
+TTL_SECONDS = int(os.getenv("REPLY_CACHE_TTL", 6 * 3600))
+VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", 3))
+MAX_TOKENS = int(os.getenv("REPLY_CACHE_MAX_TOKENS", 6))
+MAX_DISTANCE = 3  # Hamming distance; below 4 two hashes always share one of the 4 bands
+SKIP_ACTIVE = os.getenv("REPLY_CACHE_SKIP_ACTIVE", "on").lower() in ("1", "true", "on")
+
+BANDS = 4
+BAND_BITS = 16
+MENTION_RE = re.compile(r"<[@#][!&]?\d+>")
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+REPEAT_RE = re.compile(r"(.)\1+")
+IGNORED_TOKENS = {"luffy", "lufy", "are", "is", "the", "a", "an"}
+SLANG = {"u": "you", "ya": "you", "r": "are", "ur": "your", "hey": "hi", "helo": "hi", "yo": "hi", "heya": "hi"}
+
+def normalize(text):
+    """
+    Lowercases, drops mentions, the bot's name and filler words, squeezes stretched
+    letters ("hiiii" -> "hi") and maps common chat slang, so greetings written
+    slightly differently line up.
+    """
+    text = MENTION_RE.sub(" ", text.lower())
+    text = REPEAT_RE.sub(r"\1", text)
+    tokens = [SLANG.get(token, token) for token in TOKEN_RE.findall(text)]
+    return [token for token in tokens if token not in IGNORED_TOKENS]
+
+def _hash64(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+def simhash(tokens):
+    """
+    64-bit SimHash over word tokens and character trigrams of the joined message.
+    """
+    joined = " ".join(tokens)
+    features = tokens + [joined[i:i + 3] for i in range(max(1, len(joined) - 2))]
+    weights = [0] * 64
+    for feature in features:
+        h = _hash64(feature)
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def _bands(fingerprint):
+    mask = (1 << BAND_BITS) - 1
+    return [(band, fingerprint >> (band * BAND_BITS) & mask) for band in range(BANDS)]
+
+class CacheEntry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.variants = []
+        self.expires_at = time.time() + TTL_SECONDS
+
+class ReplyCache:
+    """
+    LRU of reply variants keyed by SimHash fingerprint, with a banded index so lookups
+    only compare against fingerprints sharing a 16-bit band. An entry answers from
+    cache once it holds `variants` different replies; until then misses fill it.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, variants=VARIANTS, max_tokens=MAX_TOKENS):
+        self.max_entries = max_entries
+        self.variants = variants
+        self.max_tokens = max_tokens
+        self.entries = OrderedDict()
+        self.index = {}
+
+    def key_for(self, text):
+        """
+        Returns the fingerprint for a short message, or None when it is too long to
+        be a stock greeting and should always go to Gemini.
+        """
+        tokens = normalize(text)
+        if not tokens or len(tokens) > self.max_tokens:
+            metrics.incr('reply_cache.skip')
+            return None
+        return simhash(tokens)
+
+    def _find(self, fingerprint):
+        best, best_distance = None, MAX_DISTANCE + 1
+        for band in _bands(fingerprint):
+            for candidate in self.index.get(band, ()):
+                distance = bin(candidate ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return self.entries.get(best)
+
+    def _remove(self, entry):
+        del self.entries[entry.fingerprint]
+        for band in _bands(entry.fingerprint):
+            keys = self.index.get(band)
+            keys.discard(entry.fingerprint)
+            if not keys:
+                del self.index[band]
+
+    def get(self, fingerprint):
+        """
+        Returns a random stored reply for a near-identical message, or None.
+        """
+        entry = self._find(fingerprint)
+        if entry is not None and entry.expires_at < time.time():
+            self._remove(entry)
+            entry = None
+        if entry is None or len(entry.variants) < self.variants:
+            metrics.incr('reply_cache.miss')
+            return None
+        self.entries.move_to_end(entry.fingerprint)
+        metrics.incr('reply_cache.hit')
+        return random.choice(entry.variants)
+
+    def add(self, fingerprint, reply):
+        """
+        Stores a Gemini reply as a variant for the message's entry.
+        """
+        entry = self._find(fingerprint)
+        if entry is None:
+            entry = CacheEntry(fingerprint)
+            self.entries[fingerprint] = entry
+            for band in _bands(fingerprint):
+                self.index.setdefault(band, set()).add(fingerprint)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries.values())))
+        self.entries.move_to_end(entry.fingerprint)
+        if reply not in entry.variants and len(entry.variants) < self.variants:
+            entry.variants.append(reply)
+            metrics.incr('reply_cache.fill')
+        metrics.set_gauge('reply_cache.entries', len(self.entries))
+
+cache = ReplyCache()
@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+import logging
+import discord
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+# Turning a stored user ID into a discord.User: the gateway cache first, then users we
+# fetched recently, and only then a REST call, at most one in flight per ID.
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 900))  # seconds
+USER_FETCH_CONCURRENCY = int(os.getenv("USER_FETCH_CONCURRENCY", 5))
+
+class UserResolver:
+    """
+    Resolves user IDs to discord.User objects. Fetched users (and IDs Discord says don't
+    exist) are remembered for `ttl` seconds; concurrent lookups of the same ID share
+    one fetch, and fetches across IDs are capped so a long list can't trip rate limits.
+    """
+    def __init__(self, ttl=USER_CACHE_TTL, concurrency=USER_FETCH_CONCURRENCY):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.users = {}
+        self.in_flight = {}
+        self.semaphore = None
+
+    async def get(self, bot, user_id):
+        """
+        Returns the discord.User for `user_id`, or None if Discord doesn't know it.
+        Other HTTP errors are raised.
+        """
+        user_id = int(user_id)
+        user = bot.get_user(user_id)
+        if user is not None:
+            metrics.incr('user_resolver.gateway')
+            return user
+
+        cached = self.users.get(user_id)
+        if cached is not None and cached[1] > time.time():
+            metrics.incr('user_resolver.hit')
+            return cached[0]
+
+        task = self.in_flight.get(user_id)
+        if task is None:
+            metrics.incr('user_resolver.fetch')
+            task = asyncio.ensure_future(self._fetch(bot, user_id))
+            self.in_flight[user_id] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(user_id, None))
+        else:
+            metrics.incr('user_resolver.shared')
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot, user_id):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                user = await bot.fetch_user(user_id)
+            except discord.NotFound:
+                user = None
+            metrics.observe('user_resolver.fetch_ms', (time.perf_counter() - started) * 1000)
+        self.users[user_id] = (user, time.time() + self.ttl)
+        self._prune()
+        return user
+
+    def _prune(self):
+        now = time.time()
+        expired = [user_id for user_id, (_, expires_at) in self.users.items() if expires_at <= now]
+        for user_id in expired:
+            del self.users[user_id]
+        metrics.set_gauge('user_resolver.cached', len(self.users))
+
+    async def get_many(self, bot, user_ids):
+        """
+        Resolves several IDs concurrently. Returns {user_id: discord.User or None},
+        keyed as given; IDs that fail to resolve for any reason map to None.
+        """
+        async def resolve(user_id):
+            try:
+                return await self.get(bot, user_id)
+            except (discord.HTTPException, ValueError) as e:
+                log.warning(f"Could not resolve user {user_id}: {e}")
+                return None
+
+        users = await asyncio.gather(*(resolve(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, users))
+
+resolver = UserResolver()
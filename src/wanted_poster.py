@@ -0,0 +1,414 @@
+import io
+import os
+import math
+import time
+import asyncio
+import logging
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageDraw, ImageFont
+from src import metrics
+
+log = logging.getLogger(__name__)
+
+TEMPLATE_PATH = "wanted_template.png"
+FONT_PATH = "font.ttf"
+AVATAR_SIZE = (880, 880)
+AVATAR_POSITION = (360, 640)
+NAME_POSITION = (585, 1735)
+NAME_FONT_SIZE = 105
+BOUNTY_POSITION = (850, 1870)
+BOUNTY_FONT_SIZE = 155
+TEXT_RIGHT_EDGE = 1480  # text shrinks to stay left of the poster's torn edge
+MIN_FONT_SIZE = 8
+GLYPH_CHARACTERS = "0123456789,"
+
+# Posters are rendered off the event loop; this bounds how many render at once.
+RENDER_CONCURRENCY = int(os.getenv("POSTER_RENDER_CONCURRENCY", 2))
+
+# Output encoding. The full-size PNG is several MB; Discord shows posters at a few
+# hundred pixels wide, so by default they are rendered from a half-size template as WebP.
+POSTER_FORMAT = os.getenv("POSTER_FORMAT", "webp").lower()  # webp, jpeg, png (palette) or png-full
+POSTER_SCALE = float(os.getenv("POSTER_SCALE", 0.5))
+POSTER_QUALITY = int(os.getenv("POSTER_QUALITY", 80))
+POSTER_PNG_COLORS = 128
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png", "png-full": "png"}
+
+# Crew contact sheets: small posters rendered in a process pool and tiled into pages.
+SHEET_TILE_SCALE = 0.2
+SHEET_COLUMNS = 5
+SHEET_ROWS = 4
+def _usable_cpus():
+    # The CPUs this process may run on, which in a container can be far fewer than the host's.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# /ship posters is rare and each worker costs ~60 MB, so the pool stays small.
+SHEET_WORKERS = int(os.getenv("POSTER_SHEET_WORKERS", min(4, _usable_cpus())))
+
+_templates = {}
+_executor = ThreadPoolExecutor(max_workers=RENDER_CONCURRENCY, thread_name_prefix="poster")
+_semaphore = None
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _load_template(scale=1.0):
+    # Decoded (and scaled) once per process; every render works on a copy.
+    template = _templates.get(scale)
+    if template is None:
+        with Image.open(TEMPLATE_PATH) as image:
+            template = image.convert("RGB")
+        if scale != 1.0:
+            template = template.resize((round(template.width * scale), round(template.height * scale)), Image.LANCZOS)
+        _templates[scale] = template
+    return template
+
+def _scaled(values, scale):
+    return tuple(round(value * scale) for value in values)
+
+# Bump when the layout changes so posters cached under the old one are not served.
+LAYOUT_VERSION = 2
+
+def poster_variant(fmt=POSTER_FORMAT, scale=POSTER_SCALE):
+    """
+    Identifies the output settings, for cache keys.
+    """
+    return f"{fmt}@{scale:g}q{POSTER_QUALITY}v{LAYOUT_VERSION}"
+
+def poster_filename(fmt=POSTER_FORMAT):
+    return f"wanted.{EXTENSIONS.get(fmt, 'png')}"
+
+def encode_poster(poster, fmt=POSTER_FORMAT):
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        poster.save(buffer, format="WEBP", quality=POSTER_QUALITY, method=4)
+    elif fmt == "jpeg":
+        poster.save(buffer, format="JPEG", quality=POSTER_QUALITY, optimize=True, progressive=True)
+    elif fmt == "png":
+        poster.quantize(colors=POSTER_PNG_COLORS, method=Image.Quantize.FASTOCTREE).save(buffer, format="PNG", optimize=True)
+    else:
+        poster.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@functools.lru_cache(maxsize=None)
+def _font(size):
+    return ImageFont.truetype(FONT_PATH, size)
+
+def avatar_pixels(scale=POSTER_SCALE):
+    """
+    Width the avatar is drawn at, so it can be fetched at the right size.
+    """
+    return round(AVATAR_SIZE[0] * scale)
+
+@functools.lru_cache(maxsize=4096)
+def fit_font_size(text, max_width, max_size):
+    """
+    Largest font size up to max_size at which text fits in max_width pixels.
+    """
+    width = _font(max_size).getlength(text)
+    if width <= max_width:
+        return max_size
+    size = max(MIN_FONT_SIZE, int(max_size * max_width / width))
+    while size > MIN_FONT_SIZE and _font(size).getlength(text) > max_width:
+        size -= 1
+    return size
+
+@functools.lru_cache(maxsize=1024)
+def _text_mask(text, size):
+    # Rasterized once per (text, size): an alpha mask and its offset from the baseline origin.
+    font = _font(size)
+    left, top, right, bottom = font.getbbox(text, anchor="ls")
+    mask = Image.new("L", (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor="ls")
+    return mask, (left, top)
+
+class TextBox:
+    """
+    A single line of text on the poster: left edge and baseline of the largest size,
+    and the width it may take before it shrinks.
+    """
+    def __init__(self, position, max_size, right_edge, scale):
+        self.x, top = _scaled(position, scale)
+        self.max_size = max(MIN_FONT_SIZE, round(max_size * scale))
+        self.max_width = round(right_edge * scale) - self.x
+        self.baseline = top + _font(self.max_size).getmetrics()[0]
+
+    def draw(self, poster, text, glyphs=False):
+        size = fit_font_size(text, self.max_width, self.max_size)
+        if not glyphs:
+            mask, (left, top) = _text_mask(text, size)
+            poster.paste((0, 0, 0), (self.x + left, self.baseline + top), mask)
+            return
+        # Bounties reuse one rasterized mask per digit instead of rasterizing each string.
+        font = _font(size)
+        x = self.x
+        for character in text:
+            mask, (left, top) = _text_mask(character, size)
+            poster.paste((0, 0, 0), (round(x) + left, self.baseline + top), mask)
+            x += font.getlength(character)
+
+class PosterLayout:
+    """
+    Everything about a poster that doesn't depend on who is on it, for one scale:
+    the template with its static artwork, the avatar slot and the two text boxes.
+    """
+    def __init__(self, scale):
+        self.base = _load_template(scale)
+        self.avatar_size = _scaled(AVATAR_SIZE, scale)
+        self.avatar_position = _scaled(AVATAR_POSITION, scale)
+        self.name_box = TextBox(NAME_POSITION, NAME_FONT_SIZE, TEXT_RIGHT_EDGE, scale)
+        self.bounty_box = TextBox(BOUNTY_POSITION, BOUNTY_FONT_SIZE, TEXT_RIGHT_EDGE, scale)
+
+    def compose(self, avatar, name, bounty):
+        poster = self.base.copy()
+        if avatar.size != self.avatar_size:
+            avatar = avatar.resize(self.avatar_size)
+        poster.paste(avatar, self.avatar_position)
+        self.name_box.draw(poster, name)
+        bounty_text = f"{bounty:,}"
+        self.bounty_box.draw(poster, bounty_text, glyphs=set(bounty_text) <= set(GLYPH_CHARACTERS))
+        return poster
+
+@functools.lru_cache(maxsize=None)
+def _layout(scale):
+    return PosterLayout(scale)
+
+def compose_poster(avatar, name, bounty, scale=POSTER_SCALE):
+    """
+    Draws a poster and returns the image, unencoded.
+    """
+    if isinstance(avatar, bytes):
+        avatar = Image.open(io.BytesIO(avatar))
+    return _layout(scale).compose(avatar, name, bounty)
+
+def render_poster(avatar, name, bounty, fmt=POSTER_FORMAT, scale=POSTER_SCALE):
+    """
+    Renders a wanted poster from a decoded avatar image (or raw image bytes) and
+    returns the encoded bytes. Blocking; call through render_poster_async from the bot.
+    """
+    poster = compose_poster(avatar, name, bounty, scale)
+
+    started = time.perf_counter()
+    data = encode_poster(poster, fmt)
+    encode_ms = (time.perf_counter() - started) * 1000
+    metrics.observe('poster.encode_ms', encode_ms)
+    metrics.observe('poster.bytes', len(data))
+    log.info(f"Rendered {fmt} poster at {poster.width}x{poster.height}: {len(data):,} bytes, encoded in {encode_ms:.0f} ms")
+    return data
+
+async def render_poster_async(avatar, name, bounty):
+    """
+    Renders a poster in the worker pool, with at most RENDER_CONCURRENCY in flight.
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(RENDER_CONCURRENCY)
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, render_poster, avatar, name, bounty)
+
+def _warm_worker():
+    _layout(SHEET_TILE_SCALE)
+
+def _sheet_context():
+    # The bot runs gRPC, the Firestore listener and Flask threads, none of which survive
+    # a fork, so workers come from a clean forkserver (or spawn where there is none).
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload([__name__])
+    return context
+
+def stop_sheet_pool():
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _sheet_pool():
+    # Started on the first sheet request. Blocking: launching the workers takes a moment.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=SHEET_WORKERS, mp_context=_sheet_context(), initializer=_warm_worker)
+            _process_pool.submit(_warm_worker)  # launches the workers here, off the event loop
+        return _process_pool
+
+def _discard_sheet_pool(pool):
+    # A worker died (e.g. OOM-killed) and took the pool with it; the next call starts a new one.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not pool:
+            return
+        _process_pool = None
+    log.warning("Contact sheet pool broke; starting a new one.")
+    metrics.incr('poster.sheet_pool_restarts')
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def _run_in_sheet_pool(function, *args):
+    """
+    Runs function(*args) in the sheet pool, retrying once in a fresh pool if the
+    current one is broken.
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = await loop.run_in_executor(_executor, _sheet_pool)
+        try:
+            return await loop.run_in_executor(pool, function, *args)
+        except BrokenProcessPool:
+            _discard_sheet_pool(pool)
+            if attempt:
+                raise
+
+def build_sheet(tiles, fmt=POSTER_FORMAT, columns=SHEET_COLUMNS):
+    """
+    Tiles poster images into one contact sheet and returns it encoded.
+    """
+    tile_width, tile_height = tiles[0].size
+    rows = math.ceil(len(tiles) / columns)
+    sheet = Image.new("RGB", (tile_width * min(columns, len(tiles)), tile_height * rows), "white")
+    for index, tile in enumerate(tiles):
+        sheet.paste(tile, (index % columns * tile_width, index // columns * tile_height))
+    return encode_poster(sheet, fmt)
+
+def render_sheet(members, fmt=POSTER_FORMAT):
+    """
+    Renders (avatar, name, bounty) tuples as tiles and assembles them into one encoded
+    contact sheet. Returns the bytes and the CPU seconds spent. Runs in a pool process,
+    so only the encoded page crosses back.
+    """
+    started = time.process_time()
+    data = build_sheet([compose_poster(*member, scale=SHEET_TILE_SCALE) for member in members], fmt)
+    return data, time.process_time() - started
+
+async def render_contact_sheets_async(members, fmt=POSTER_FORMAT, on_progress=None):
+    """
+    Splits (avatar, name, bounty) tuples into pages of SHEET_COLUMNS x SHEET_ROWS and
+    renders each page in the process pool. Returns the encoded pages in order and the
+    total CPU seconds the workers spent, which is what rendering them one after
+    another would have cost. on_progress(done, total) counts posters.
+    """
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+    pages = [members[start:start + per_page] for start in range(0, len(members), per_page)]
+    done = 0
+
+    async def render(page):
+        nonlocal done
+        result = await _run_in_sheet_pool(render_sheet, page, fmt)
+        done += len(page)
+        if on_progress is not None:
+            await on_progress(done, len(members))
+        return result
+
+    results = await asyncio.gather(*(render(page) for page in pages))
+    return [data for data, _ in results], sum(cpu for _, cpu in results)
+
+def _compose_direct(avatar, name, bounty, scale):
+    # The full-canvas pipeline the layout engine replaced, kept for the benchmark.
+    poster = _load_template(scale).copy()
+    poster.paste(avatar.resize(_scaled(AVATAR_SIZE, scale)), _scaled(AVATAR_POSITION, scale))
+    draw = ImageDraw.Draw(poster)
+    draw.text(_scaled(NAME_POSITION, scale), name, font=_font(round(NAME_FONT_SIZE * scale)), fill="black")
+    draw.text(_scaled(BOUNTY_POSITION, scale), f"{bounty:,}", font=_font(round(BOUNTY_FONT_SIZE * scale)), fill="black")
+    return poster
+
+def _render_poster_uncached(avatar_bytes, name, bounty):
+    # The original pipeline: template and fonts reloaded for every poster.
+    template = Image.open(TEMPLATE_PATH)
+    name_font = ImageFont.truetype(FONT_PATH, NAME_FONT_SIZE)
+    bounty_font = ImageFont.truetype(FONT_PATH, BOUNTY_FONT_SIZE)
+    avatar = Image.open(io.BytesIO(avatar_bytes)).resize(AVATAR_SIZE)
+    template.paste(avatar, AVATAR_POSITION)
+    draw = ImageDraw.Draw(template)
+    draw.text(NAME_POSITION, name, font=name_font, fill="black")
+    draw.text(BOUNTY_POSITION, f"{bounty:,}", font=bounty_font, fill="black")
+    buffer = io.BytesIO()
+    template.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+async def _benchmark(count):
+    avatar = Image.effect_noise((1024, 1024), 64).convert("RGB")
+    buffer = io.BytesIO()
+    avatar.save(buffer, format="PNG")
+    avatar_bytes = buffer.getvalue()
+
+    async def measure(label, run):
+        stalls = []
+        stop = asyncio.Event()
+
+        async def heartbeat():
+            # Any delay past the 10 ms tick is time the event loop was blocked.
+            while not stop.is_set():
+                before = time.perf_counter()
+                await asyncio.sleep(0.01)
+                stalls.append((time.perf_counter() - before - 0.01) * 1000)
+
+        ticker = asyncio.create_task(heartbeat())
+        started = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+        stalls.sort()
+        print(f"{label}: {count / elapsed:.2f} posters/s, loop stall p99 {stalls[int(len(stalls) * 0.99)]:.0f} ms, max {stalls[-1]:.0f} ms")
+
+    async def inline():
+        for i in range(count):
+            _render_poster_uncached(avatar_bytes, f"pirate{i}", i * 1000)
+            await asyncio.sleep(0.001)
+
+    async def pooled():
+        await asyncio.gather(*(render_poster_async(avatar_bytes, f"pirate{i}", i * 1000) for i in range(count)))
+
+    await measure("before (inline, reloads assets)", inline)
+    await measure(f"after (preloaded, {RENDER_CONCURRENCY} workers)", pooled)
+
+    print(f"original png-full: {len(_render_poster_uncached(avatar_bytes, 'pirate', 1000)):,} bytes")
+    for fmt in EXTENSIONS:
+        for scale in (1.0, POSTER_SCALE):
+            started = time.perf_counter()
+            data = render_poster(avatar_bytes, "pirate", 1000, fmt, scale)
+            print(f"{fmt} @ {scale:g}: {len(data):,} bytes, {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    # The avatar cache hands the layout an avatar already at its drawn size.
+    decoded = Image.open(io.BytesIO(avatar_bytes)).convert("RGB")
+    for scale in (1.0, POSTER_SCALE):
+        sized = decoded.resize((avatar_pixels(scale), avatar_pixels(scale)))
+        _layout(scale)
+        for label, compose, avatar in (("direct", _compose_direct, decoded), ("layout", compose_poster, sized)):
+            started = time.process_time()
+            for i in range(count):
+                compose(avatar, f"pirate{i % 10}", (i % 50) * 1_000_000, scale)
+            print(f"compose {label} @ {scale:g}: {(time.process_time() - started) * 1000 / count:.1f} ms CPU per poster")
+
+async def _benchmark_sheet(count):
+    avatar = Image.effect_noise((256, 256), 64).convert("RGB")
+    members = [(avatar, f"pirate{i}", i * 1000) for i in range(count)]
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+    # Both runs start from a decoded, resized template: the workers load theirs at startup.
+    _layout(SHEET_TILE_SCALE)
+
+    started = time.perf_counter()
+    for start in range(0, count, per_page):
+        render_sheet(members[start:start + per_page])
+    sequential = time.perf_counter() - started
+
+    await render_contact_sheets_async(members[:SHEET_WORKERS])  # start the workers
+    started = time.perf_counter()
+    pages, cpu_seconds = await render_contact_sheets_async(members)
+    parallel = time.perf_counter() - started
+
+    print(f"{count} posters on {len(pages)} sheets ({sum(len(page) for page in pages):,} bytes): sequential {sequential:.2f}s, {SHEET_WORKERS} processes {parallel:.2f}s (worker CPU {cpu_seconds:.2f}s), speedup {sequential / parallel:.2f}x")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark wanted poster rendering.")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--sheet", action="store_true", help="benchmark crew contact sheets instead")
+    args = parser.parse_args()
+    asyncio.run(_benchmark_sheet(args.count) if args.sheet else _benchmark(args.count))